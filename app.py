@@ -14,10 +14,72 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 # Configure upload sizes for video files
 app.config['MAX_CONTENT_LENGTH'] = 250 * 1024 * 1024  # 250MB max size
 app.config['MAX_CONTENT_LENGTH_CHUNK'] = 1024 * 1024  # 1MB chunks
+app.config['MAX_UPLOAD_SIZE'] = 500 * 1024 * 1024  # 500MB max for chunked uploads
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['RESULTS_FOLDER'] = 'results'
+# Shared job registry (SQLite, WAL mode) so every gunicorn worker sees every job
+app.config['JOB_STORE_PATH'] = os.environ.get('JOB_STORE_PATH', os.path.join('uploads', 'jobs.db'))
+# Media job scheduling: concurrent jobs per worker (0 = derive from core count)
+# and the queue depth beyond which new jobs are refused with 429
+app.config['JOB_MAX_CONCURRENCY'] = int(os.environ.get('JOB_MAX_CONCURRENCY', 0))
+app.config['JOB_MAX_QUEUE'] = int(os.environ.get('JOB_MAX_QUEUE', 20))
+# Scene detection works on frames scaled down to this width; frame skip > 0
+# analyzes every (n + 1)th frame for extra speed at some cost in accuracy
+app.config['SCENE_DETECT_WIDTH'] = int(os.environ.get('SCENE_DETECT_WIDTH', 256))
+app.config['SCENE_DETECT_FRAME_SKIP'] = int(os.environ.get('SCENE_DETECT_FRAME_SKIP', 0))
+# Height of the optional low-bitrate preview proxy built during detection
+app.config['PREVIEW_PROXY_HEIGHT'] = int(os.environ.get('PREVIEW_PROXY_HEIGHT', 360))
+# Threads one edit job may use across its concurrently encoded segments and
+# its music fetch (0 = the cores free next to the jobs running at its start)
+app.config['EDIT_THREAD_BUDGET'] = int(os.environ.get('EDIT_THREAD_BUDGET', 0))
+# Shared music download cache with LRU eviction above the disk quota; local
+# files and file:// URLs as music sources are for offline testing only
+app.config['MUSIC_CACHE_DIR'] = os.path.join(app.config['UPLOAD_FOLDER'], 'music', 'cache')
+app.config['MUSIC_CACHE_MAX_BYTES'] = int(os.environ.get('MUSIC_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+app.config['MUSIC_ALLOW_LOCAL_SOURCES'] = os.environ.get('MUSIC_ALLOW_LOCAL_SOURCES', '0') == '1'
+# Beat analysis: warm worker processes and the per-track result cache
+app.config['BEAT_WORKERS'] = int(os.environ.get('BEAT_WORKERS', 1))
+app.config['BEAT_CACHE_DIR'] = os.path.join(app.config['UPLOAD_FOLDER'], 'music', 'beats')
+# Bug scanner: pool size (0 = the cores divided among the web workers),
+# semgrep rules (a registry name like p/default, or a local rules file for
+# offline use) and the per-file findings cache
+app.config['BUG_SCAN_WORKERS'] = int(os.environ.get('BUG_SCAN_WORKERS', 0))
+app.config['BUG_SCAN_SEMGREP_CONFIG'] = os.environ.get('BUG_SCAN_SEMGREP_CONFIG', 'p/default')
+app.config['BUG_SCAN_CACHE_DIR'] = os.path.join(app.config['UPLOAD_FOLDER'], 'code', 'findings')
+# Chat: model backend ('openai' needs OPENAI_API_KEY; 'local' is an offline
+# stand-in), per-conversation history and conversation count bounds, and the
+# number of replies kept for identical prompts
+app.config['OPENAI_API_KEY'] = os.environ.get('OPENAI_API_KEY')
+app.config['CHAT_BACKEND'] = os.environ.get('CHAT_BACKEND', 'openai' if app.config['OPENAI_API_KEY'] else 'local')
+app.config['CHAT_MODEL'] = os.environ.get('CHAT_MODEL', 'gpt-4o-mini')
+app.config['CHAT_SYSTEM_PROMPT'] = os.environ.get('CHAT_SYSTEM_PROMPT', 'You are a helpful assistant.')
+app.config['CHAT_HISTORY_MESSAGES'] = int(os.environ.get('CHAT_HISTORY_MESSAGES', 20))
+app.config['CHAT_MAX_CONVERSATIONS'] = int(os.environ.get('CHAT_MAX_CONVERSATIONS', 1000))
+app.config['CHAT_CACHE_SIZE'] = int(os.environ.get('CHAT_CACHE_SIZE', 256))
+# Retention: entries unused for longer than their directory's TTL (seconds)
+# are deleted, and above the high watermark of the disk (or of the quota,
+# if set) the least recently used ones go until usage is under the low one
+app.config['RETENTION_INTERVAL'] = int(os.environ.get('RETENTION_INTERVAL', 600))
+app.config['RETENTION_QUOTA_BYTES'] = int(os.environ.get('RETENTION_QUOTA_BYTES', 0))
+app.config['RETENTION_HIGH_WATERMARK'] = float(os.environ.get('RETENTION_HIGH_WATERMARK', 0.9))
+app.config['RETENTION_LOW_WATERMARK'] = float(os.environ.get('RETENTION_LOW_WATERMARK', 0.8))
+app.config['RETENTION_TTLS'] = {
+    os.path.join(app.config['UPLOAD_FOLDER'], 'videos'): 7 * 24 * 3600,
+    os.path.join(app.config['UPLOAD_FOLDER'], 'videos', 'partial'): 24 * 3600,
+    os.path.join(app.config['UPLOAD_FOLDER'], 'music', 'cache'): 30 * 24 * 3600,
+    os.path.join(app.config['UPLOAD_FOLDER'], 'music', 'beats'): 30 * 24 * 3600,
+    os.path.join(app.config['UPLOAD_FOLDER'], 'code'): 24 * 3600,
+    os.path.join(app.config['UPLOAD_FOLDER'], 'code', 'findings'): 30 * 24 * 3600,
+    os.path.join(app.config['RESULTS_FOLDER'], 'amv'): 3 * 24 * 3600,
+    os.path.join(app.config['RESULTS_FOLDER'], 'edited'): 3 * 24 * 3600,
+    os.path.join(app.config['RESULTS_FOLDER'], 'reports'): 7 * 24 * 3600
+}
 # Increase request timeouts
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# Finished outputs can be streamed by the front proxy instead of a worker:
+# '' serves them directly, 'x-accel' for nginx, 'x-sendfile' for Apache/lighttpd
+app.config['MEDIA_OFFLOAD'] = os.environ.get('MEDIA_OFFLOAD', '')
+app.config['MEDIA_OFFLOAD_PREFIX'] = os.environ.get('MEDIA_OFFLOAD_PREFIX', '/protected/results')
 
 # Create necessary directories if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -29,17 +91,49 @@ os.makedirs(os.path.join(app.config['RESULTS_FOLDER'], 'reports'), exist_ok=True
 os.makedirs(os.path.join(app.config['RESULTS_FOLDER'], 'amv'), exist_ok=True)
 os.makedirs(os.path.join(app.config['RESULTS_FOLDER'], 'edited'), exist_ok=True)
 
+# Initialize the shared job store
+from modules.job_store import job_store
+job_store.init_app(app)
+
+# Initialize the media job scheduler
+from modules.scheduler import scheduler
+scheduler.init_app(app)
+
+# Initialize the shared music cache
+from modules.music_cache import music_cache
+music_cache.init_app(app)
+
+# Initialize the beat analysis worker pool
+from modules.beat_analysis import beat_analyzer
+beat_analyzer.init_app(app)
+
+# Initialize the bug scanner's findings cache and worker pool
+from modules.code_analysis import code_scanner
+code_scanner.init_app(app)
+
+# Initialize the chat engine's backend, history and response cache
+from modules.chat_engine import chat_engine
+chat_engine.init_app(app)
+
+# Start retention of uploads, caches and results
+from modules.retention import retention
+retention.init_app(app)
+
 # Import routes
 from modules.chat import chat_bp
 from modules.bug_scanner import bug_scanner_bp
 from modules.amv_generator import amv_generator_bp
 from modules.anime_editor import anime_editor_bp
+from modules.chunked_upload import chunked_upload_bp
+from modules.metrics import metrics_bp
 
 # Register blueprints
 app.register_blueprint(chat_bp)
 app.register_blueprint(bug_scanner_bp)
 app.register_blueprint(amv_generator_bp)
 app.register_blueprint(anime_editor_bp)
+app.register_blueprint(chunked_upload_bp)
+app.register_blueprint(metrics_bp)
 
 # Main route
 @app.route('/')
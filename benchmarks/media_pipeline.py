@@ -0,0 +1,452 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# Reproducible benchmark of the media pipeline.
+#
+#   python -m benchmarks.media_pipeline                    # run and compare
+#   python -m benchmarks.media_pipeline --update-baseline  # accept results
+#
+# Inputs are generated offline and deterministically with ffmpeg's lavfi
+# sources: a video made of test-pattern segments with hard cuts at known
+# timestamps, a longer one of the same kind for the AMV generator, and a
+# click track at a known BPM.  Each stage runs in its own child process so
+# its CPU time and peak RSS (children included, from wait4) and its peak
+# temp-directory usage can be measured in isolation; wall time is measured
+# around the stage call itself.  Detection is scored against the known cuts
+# and beat tracking against the known tempo.  Results are compared with the
+# stored baseline and regressions make the run exit non-zero.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Segment durations (seconds) of the detection video; the cuts fall between them
+DETECT_SEGMENTS = [4, 7, 3, 9, 5, 6, 8, 4, 6, 8]
+DETECT_SIZE = "320x240"
+DETECT_RATE = 25
+
+# Long enough for the AMV generator to search for both clip windows
+# inside its edge margins
+AMV_SEGMENTS = [30] * 23
+AMV_SIZE = "320x180"
+AMV_RATE = 10
+
+CLICK_BPM = 120
+CLICK_SECONDS = 200
+
+# Consecutive sources differ strongly in hue and brightness, so every
+# boundary is a clean hard cut
+PATTERNS = [
+    "testsrc2=s={size}:r={rate}:d={duration}",
+    "smptebars=s={size}:r={rate}:d={duration}",
+    "color=c=0xc02020:s={size}:r={rate}:d={duration}",
+    "mandelbrot=s={size}:r={rate}",
+    "rgbtestsrc=s={size}:r={rate}:d={duration}",
+    "color=c=0x2040c0:s={size}:r={rate}:d={duration}",
+    "yuvtestsrc=s={size}:r={rate}:d={duration}",
+    "color=c=0x20a040:s={size}:r={rate}:d={duration}",
+]
+
+# A cut counts as found if detected within this many seconds
+CUT_TOLERANCE = 0.1
+
+# Relative slack before a cost metric counts as a regression, and the
+# absolute change below which it is ignored as noise
+COST_METRICS = {
+    "wall_seconds": (0.20, 0.5),
+    "cpu_seconds": (0.20, 0.5),
+    "peak_rss_mb": (0.15, 20),
+    "temp_peak_bytes": (0.25, 1024 * 1024)
+}
+# Quality metrics: allowed drop (or rise, for errors)
+QUALITY_METRICS = {
+    "f1": -0.02,
+    "recall": -0.02,
+    "tempo_error_bpm": 1.0
+}
+
+STAGES = ["detect", "detect_cached", "amv", "edit_reencode", "edit_smart", "edit_draft"]
+
+
+def _run(cmd):
+    subprocess.run(cmd, check=True, capture_output=True, text=True)
+
+
+def segment_video(path, segments, size, rate):
+    """Render test-pattern segments back to back; returns the cut times"""
+    inputs = []
+    for i, duration in enumerate(segments):
+        pattern = PATTERNS[i % len(PATTERNS)].format(size=size, rate=rate, duration=duration)
+        # Sources without a duration option are trimmed on the input side
+        inputs += ["-f", "lavfi", "-t", str(duration), "-i", pattern]
+    total = sum(segments)
+    inputs += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={total}"]
+
+    labels = "".join(f"[{i}:v]" for i in range(len(segments)))
+    _run([
+        "ffmpeg", "-y",
+        *inputs,
+        "-filter_complex", f"{labels}concat=n={len(segments)}:v=1:a=0,format=yuv420p[v]",
+        "-map", "[v]",
+        "-map", f"{len(segments)}:a",
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-g", str(rate * 2),
+        "-threads", "1",
+        "-c:a", "aac",
+        "-fflags", "+bitexact",
+        path
+    ])
+
+    cuts = []
+    elapsed = 0
+    for duration in segments[:-1]:
+        elapsed += duration
+        cuts.append(float(elapsed))
+    return cuts
+
+
+def click_track(path, bpm, seconds):
+    """A 20 ms 1 kHz click on every beat"""
+    period = 60.0 / bpm
+    _run([
+        "ffmpeg", "-y",
+        "-f", "lavfi",
+        "-i", f"aevalsrc=exprs=0.8*sin(2*PI*1000*t)*lt(mod(t\\,{period})\\,0.02):s=44100:d={seconds}",
+        "-c:a", "pcm_s16le",
+        path
+    ])
+
+
+def generate_inputs(inputs_dir):
+    """Create (or reuse) the synthetic inputs and return their description"""
+    # The music is passed as a local source, which must be an absolute path
+    inputs_dir = os.path.abspath(inputs_dir)
+    spec_path = os.path.join(inputs_dir, 'inputs.json')
+    spec = {
+        "detect_segments": DETECT_SEGMENTS, "detect_size": DETECT_SIZE, "detect_rate": DETECT_RATE,
+        "amv_segments": AMV_SEGMENTS, "amv_size": AMV_SIZE, "amv_rate": AMV_RATE,
+        "click_bpm": CLICK_BPM, "click_seconds": CLICK_SECONDS
+    }
+    if os.path.exists(spec_path):
+        with open(spec_path, 'r') as f:
+            existing = json.load(f)
+        if existing.get("spec") == spec:
+            return existing
+
+    os.makedirs(inputs_dir, exist_ok=True)
+    inputs = {
+        "spec": spec,
+        "detect_video": os.path.join(inputs_dir, 'detect.mp4'),
+        "amv_video": os.path.join(inputs_dir, 'amv.mp4'),
+        "music": os.path.join(inputs_dir, f'click_{CLICK_BPM}bpm.wav')
+    }
+    print("Generating synthetic inputs...", file=sys.stderr)
+    inputs["cuts"] = segment_video(inputs["detect_video"], DETECT_SEGMENTS, DETECT_SIZE, DETECT_RATE)
+    segment_video(inputs["amv_video"], AMV_SEGMENTS, AMV_SIZE, AMV_RATE)
+    click_track(inputs["music"], CLICK_BPM, CLICK_SECONDS)
+    with open(spec_path, 'w') as f:
+        json.dump(inputs, f, indent=2)
+    return inputs
+
+
+def score_cuts(detected, expected, tolerance=CUT_TOLERANCE):
+    """Precision, recall, F1 and mean offset of detected cuts against known ones"""
+    unmatched = list(detected)
+    offsets = []
+    for cut in expected:
+        if not unmatched:
+            break
+        nearest = min(unmatched, key=lambda t: abs(t - cut))
+        if abs(nearest - cut) <= tolerance:
+            offsets.append(abs(nearest - cut))
+            unmatched.remove(nearest)
+    matched = len(offsets)
+    precision = matched / len(detected) if detected else float(not expected)
+    recall = matched / len(expected) if expected else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+        "mean_offset_seconds": round(sum(offsets) / matched, 4) if matched else None,
+        "detected_cuts": len(detected),
+        "expected_cuts": len(expected)
+    }
+
+
+# --- Stage bodies, run inside a child process -------------------------------
+
+def _setup_child(workdir):
+    # The stores are configured before the pipeline modules touch them
+    from modules.music_cache import music_cache
+    from modules.beat_analysis import beat_analyzer
+    music_cache.cache_dir = os.path.join(workdir, 'music')
+    music_cache.allow_local_sources = True
+    beat_analyzer.cache_dir = os.path.join(workdir, 'beats')
+    os.makedirs(music_cache.cache_dir, exist_ok=True)
+    os.makedirs(beat_analyzer.cache_dir, exist_ok=True)
+
+
+def _stage_video(workdir, source):
+    # A private copy, so sidecar caches (scores, keyframes) start cold
+    videos_dir = os.path.join(workdir, 'videos')
+    os.makedirs(videos_dir, exist_ok=True)
+    video_path = os.path.join(videos_dir, os.path.basename(source))
+    if not os.path.exists(video_path):
+        shutil.copyfile(source, video_path)
+    return video_path
+
+
+def _run_detect(workdir, inputs, job_id):
+    from modules.job_store import job_store
+    from modules.anime_editor import detect_scenes, JOB_KIND
+    from modules.scene_list import load_scenes
+
+    video_path = _stage_video(workdir, inputs["detect_video"])
+    output_dir = os.path.join(workdir, 'edited')
+    os.makedirs(output_dir, exist_ok=True)
+    job_store.create(JOB_KIND, {"id": job_id, "video_path": video_path, "status": "starting", "results": None})
+
+    started = time.perf_counter()
+    detect_scenes(job_id, video_path, output_dir, threshold=30, min_scene_length=2)
+    wall = time.perf_counter() - started
+
+    job = job_store.get(job_id)
+    if job["status"] != "scenes_detected":
+        raise RuntimeError(f"Scene detection failed: {job.get('error')}")
+    scenes = load_scenes(os.path.join(output_dir, job["results"]["scenes_file"]), job_id)
+    detected = scenes.start_times[1:].tolist()
+    return {"wall_seconds": wall, **score_cuts(detected, inputs["cuts"])}
+
+
+def stage_detect(workdir, inputs):
+    return _run_detect(workdir, inputs, "bench-detect")
+
+
+def stage_detect_cached(workdir, inputs):
+    # Same content again: the score curve and keyframe index are reused
+    return _run_detect(workdir, inputs, "bench-detect-cached")
+
+
+def stage_amv(workdir, inputs):
+    from modules.job_store import job_store
+    from modules.amv_generator import generate_amv, JOB_KIND
+
+    video_path = _stage_video(workdir, inputs["amv_video"])
+    output_dir = os.path.join(workdir, 'amv')
+    os.makedirs(output_dir, exist_ok=True)
+    job_store.create(JOB_KIND, {"id": "bench-amv", "status": "starting", "results": None})
+
+    started = time.perf_counter()
+    generate_amv("bench-amv", video_path, inputs["music"], output_dir)
+    wall = time.perf_counter() - started
+
+    job = job_store.get("bench-amv")
+    if job["status"] != "completed":
+        raise RuntimeError(f"AMV generation failed: {job.get('error')}")
+    output_bytes = sum(
+        os.path.getsize(os.path.join(output_dir, job["results"][clip])) for clip in ("three_min_amv", "one_min_amv")
+    )
+    return {"wall_seconds": wall, "output_bytes": output_bytes}
+
+
+def _run_edit(workdir, inputs, smart_render, profile="final"):
+    from modules.job_store import job_store
+    from modules.beat_analysis import beat_analyzer
+    from modules.anime_editor import create_edited_video
+
+    # Continues the job left in scenes_detected by the detect stage
+    job_id = "bench-detect"
+    job = job_store.get(job_id)
+    if job is None or not (job.get("results") or {}).get("scenes_count"):
+        raise RuntimeError("The detect stage must run before the edit stages")
+    job_store.update(job_id, status="scenes_detected")
+    selected = list(range(job["results"]["scenes_count"]))
+    output_dir = os.path.join(workdir, 'edited')
+
+    started = time.perf_counter()
+    # The music fetch runs inside the job, alongside scene extraction
+    create_edited_video(
+        job_id, job["video_path"], inputs["music"], selected, output_dir, smart_render=smart_render, profile=profile
+    )
+    wall = time.perf_counter() - started
+    # Reap the analysis workers so their CPU time is counted for this stage
+    beat_analyzer.shutdown()
+
+    job = job_store.get(job_id)
+    if job["status"] != "completed":
+        raise RuntimeError(f"Video editing failed: {job.get('error')}")
+    results = job["results"]
+    return {
+        "wall_seconds": wall,
+        "output_bytes": os.path.getsize(os.path.join(output_dir, results["edited_video"])),
+        "tempo_bpm": results.get("tempo"),
+        "tempo_error_bpm": abs(results["tempo"] - CLICK_BPM) if results.get("tempo") is not None else None
+    }
+
+
+def stage_edit_reencode(workdir, inputs):
+    return _run_edit(workdir, inputs, smart_render=False)
+
+
+def stage_edit_smart(workdir, inputs):
+    return _run_edit(workdir, inputs, smart_render=True)
+
+
+def stage_edit_draft(workdir, inputs):
+    return _run_edit(workdir, inputs, smart_render=False, profile="draft")
+
+
+def run_child(stage, workdir, inputs_path, result_path):
+    with open(inputs_path, 'r') as f:
+        inputs = json.load(f)
+    _setup_child(workdir)
+    result = globals()[f"stage_{stage}"](workdir, inputs)
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+# --- Parent: measurement and comparison --------------------------------------
+
+def _dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def measure_stage(stage, workdir, inputs_path):
+    """Run one stage in a child process and collect its resource usage"""
+    temp_dir = os.path.join(workdir, 'tmp', stage)
+    os.makedirs(temp_dir, exist_ok=True)
+    result_path = os.path.join(workdir, f'{stage}.result.json')
+    env = dict(
+        os.environ,
+        TMPDIR=temp_dir,
+        JOB_STORE_PATH=os.path.join(workdir, 'jobs.db'),
+        PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')]))
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.media_pipeline", "--run-stage", stage,
+         "--workdir", workdir, "--inputs-file", inputs_path, "--result-file", result_path],
+        env=env
+    )
+
+    # Poll so the temp directory can be sampled while the stage runs; wait4
+    # reports the child's CPU time and peak RSS including its own children
+    temp_peak = 0
+    while True:
+        pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            break
+        temp_peak = max(temp_peak, _dir_bytes(temp_dir))
+        time.sleep(0.2)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Stage {stage} failed with exit code {proc.returncode}")
+
+    with open(result_path, 'r') as f:
+        result = json.load(f)
+    result.update({
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "temp_peak_bytes": temp_peak
+    })
+    result["wall_seconds"] = round(result["wall_seconds"], 3)
+    return result
+
+
+def compare(results, baseline):
+    """List of human-readable regressions against the baseline"""
+    regressions = []
+    for stage, metrics in results.items():
+        base = baseline.get(stage)
+        if not base:
+            continue
+        for name, (relative, absolute) in COST_METRICS.items():
+            if name in metrics and base.get(name) is not None:
+                current, previous = metrics[name], base[name]
+                if current > previous * (1 + relative) and current - previous > absolute:
+                    regressions.append(f"{stage}: {name} {previous} -> {current}")
+        for name, allowed in QUALITY_METRICS.items():
+            current, previous = metrics.get(name), base.get(name)
+            if current is None or previous is None:
+                continue
+            worse = current < previous + allowed if allowed < 0 else current > previous + allowed
+            if worse:
+                regressions.append(f"{stage}: {name} {previous} -> {current}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the media pipeline on synthetic inputs")
+    parser.add_argument('--stages', default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument('--inputs-dir', default=os.path.join(tempfile.gettempdir(), 'media-bench-inputs'),
+                        help="where synthetic inputs are generated and reused")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--keep-workdir', action='store_true')
+    # Internal: run a single stage in this process
+    parser.add_argument('--run-stage', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--inputs-file', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_stage:
+        run_child(args.run_stage, args.workdir, args.inputs_file, args.result_file)
+        return 0
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    generate_inputs(args.inputs_dir)
+    inputs_path = os.path.join(args.inputs_dir, 'inputs.json')
+    workdir = tempfile.mkdtemp(prefix='media-bench-')
+    results = {}
+    try:
+        for stage in stages:
+            print(f"Running {stage}...", file=sys.stderr)
+            results[stage] = measure_stage(stage, workdir, inputs_path)
+    finally:
+        if args.keep_workdir:
+            print(f"Work directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --update-baseline to store one", file=sys.stderr)
+        return 0
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
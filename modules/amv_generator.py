@@ -1,20 +1,31 @@
 import os
 import uuid
 import logging
-import subprocess
-import json
-import tempfile
-import threading
-from flask import Blueprint, render_template, request, jsonify, current_app, send_file
+from flask import Blueprint, render_template, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-import subprocess
-import random
 from datetime import datetime
+from modules.job_store import job_store
+from modules.job_events import stream_job
+from modules.scheduler import scheduler, SchedulerFullError
+from modules.content_cache import save_upload
+from modules.chunked_upload import finalize_upload, UploadError
+from modules.music_cache import music_cache
+from modules.delivery import send_output
+from modules import metrics
+from modules.highlights import analyze_highlights, highlight_scores, pick_windows
+from modules.encoding_profiles import resolve_profile, video_args, audio_args, DEFAULT_PROFILE
+from modules.media_runner import run_media, cancel as cancel_job_processes, JobCancelled
 
 amv_generator_bp = Blueprint('amv_generator', __name__, url_prefix='/amv_generator')
 
-# Track running jobs
-running_jobs = {}
+# Jobs are tracked in the shared job store so every worker can see them
+JOB_KIND = 'amv'
+
+# Statuses after which a job can no longer be cancelled
+FINISHED_STATUSES = {"completed", "error", "cancelled"}
+
+# Target clip lengths in seconds
+AMV_LENGTHS = {"three_min": 180, "one_min": 60}
 
 @amv_generator_bp.route('/', methods=['GET'])
 def amv_generator_page():
@@ -24,131 +35,134 @@ def allowed_video_file(filename):
     """Check if the file is an allowed video format"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'mp4', 'mkv', 'avi'}
 
-def generate_amv(job_id, video_path, music_url, output_dir):
+def generate_amv(job_id, video_path, music_url, output_dir, profile=DEFAULT_PROFILE):
     """Generate AMV clips with background music"""
     try:
         logging.info(f"Starting AMV generation for job {job_id}")
-        running_jobs[job_id]["status"] = "processing"
-        running_jobs[job_id]["progress"] = 10
-
-        # Create temporary directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Download music from YouTube using yt-dlp
-            music_path = os.path.join(temp_dir, "music.mp3")
-            running_jobs[job_id]["progress"] = 20
-            running_jobs[job_id]["current_step"] = "Downloading music..."
-
-            ytdlp_cmd = [
-                "yt-dlp", 
-                "-x", 
-                "--audio-format", "mp3",
-                "-o", music_path,
-                music_url
-            ]
-            subprocess.run(ytdlp_cmd, check=True, capture_output=True, text=True)
-
-            if not os.path.exists(music_path):
-                raise Exception("Failed to download music file")
-
-            running_jobs[job_id]["progress"] = 30
-            running_jobs[job_id]["current_step"] = "Extracting 3-minute clip..."
-
-            # Create 3-minute clip
-            three_min_clip_path = os.path.join(temp_dir, "3min_clip.mp4")
-            ffmpeg_3min_cmd = [
-                "ffmpeg",
-                "-i", video_path,
-                "-ss", "00:05:00",  # Start from 5 minutes to avoid intros
-                "-t", "00:03:00",   # 3 minutes duration
-                "-c:v", "libx264",
-                "-c:a", "aac",
-                "-strict", "experimental",
-                three_min_clip_path
-            ]
-            subprocess.run(ffmpeg_3min_cmd, check=True, capture_output=True, text=True)
-
-            running_jobs[job_id]["progress"] = 50
-            running_jobs[job_id]["current_step"] = "Extracting 1-minute clip..."
-
-            # Create 1-minute clip
-            one_min_clip_path = os.path.join(temp_dir, "1min_clip.mp4")
-            ffmpeg_1min_cmd = [
-                "ffmpeg",
-                "-i", video_path,
-                "-ss", "00:10:00",  # Start from 10 minutes to get interesting action
-                "-t", "00:01:00",   # 1 minute duration
-                "-c:v", "libx264",
-                "-c:a", "aac",
-                "-strict", "experimental",
-                one_min_clip_path
-            ]
-            subprocess.run(ffmpeg_1min_cmd, check=True, capture_output=True, text=True)
-
-            running_jobs[job_id]["progress"] = 70
-            running_jobs[job_id]["current_step"] = "Adding music to 3-minute clip..."
-
-            # Add music to 3-minute clip
-            three_min_amv_path = os.path.join(output_dir, f"3min_amv_{job_id}.mp4")
-            ffmpeg_3min_amv_cmd = [
-                "ffmpeg",
-                "-i", three_min_clip_path,
-                "-i", music_path,
-                "-map", "0:v",
-                "-map", "1:a",
-                "-c:v", "copy",
-                "-c:a", "aac",
-                "-shortest",
-                three_min_amv_path
-            ]
-            subprocess.run(ffmpeg_3min_amv_cmd, check=True, capture_output=True, text=True)
-
-            running_jobs[job_id]["progress"] = 85
-            running_jobs[job_id]["current_step"] = "Adding music to 1-minute clip..."
-
-            # Add music to 1-minute clip
-            one_min_amv_path = os.path.join(output_dir, f"1min_amv_{job_id}.mp4")
-            ffmpeg_1min_amv_cmd = [
-                "ffmpeg",
-                "-i", one_min_clip_path,
-                "-i", music_path,
-                "-map", "0:v",
-                "-map", "1:a",
-                "-c:v", "copy",
-                "-c:a", "aac",
-                "-shortest",
-                one_min_amv_path
-            ]
-            subprocess.run(ffmpeg_1min_amv_cmd, check=True, capture_output=True, text=True)
-
-            # Update job status and result
-            running_jobs[job_id]["progress"] = 100
-            running_jobs[job_id]["status"] = "completed"
-            running_jobs[job_id]["current_step"] = "AMVs generated successfully"
-            running_jobs[job_id]["results"] = {
+        job_store.update(job_id, status="processing", progress=10)
+
+        # Fetch music through the shared cache (downloads with yt-dlp on a miss)
+        job_store.update(job_id, progress=12, current_step="Downloading music...")
+        with metrics.stage(job_id, JOB_KIND, "music_download"):
+            music_path = music_cache.fetch(music_url)
+
+        # Score every second of the episode and cut the clips from its most
+        # action-packed stretches
+        job_store.update(job_id, progress=15, current_step="Finding highlights...")
+        last_reported = {"progress": -1}
+
+        def report_analysis(seconds, duration):
+            progress = int(15 + 15 * min(1.0, seconds / duration))
+            if progress != last_reported["progress"]:
+                last_reported["progress"] = progress
+                job_store.update(job_id, progress=progress)
+
+        with metrics.stage(job_id, JOB_KIND, "highlight_analysis"):
+            features = analyze_highlights(video_path, job_id=job_id, progress_callback=report_analysis)
+            windows = pick_windows(highlight_scores(features), features["duration"], AMV_LENGTHS)
+        (three_min_start, three_min_length), (one_min_start, one_min_length) = (
+            windows["three_min"], windows["one_min"]
+        )
+        logging.info(f"Highlight windows for job {job_id}: {windows}")
+
+        job_store.update(job_id, progress=30, current_step="Rendering 3-minute and 1-minute AMVs...")
+
+        # Render both clips in one ffmpeg run: each output gets its own
+        # input-side seek into the source, is encoded exactly once, and has
+        # the music mapped in directly instead of a separate remux pass.
+        # The two encoders split this job's share of the free cores
+        threads = max(1, scheduler.thread_budget() // 2)
+        three_min_amv_path = os.path.join(output_dir, f"3min_amv_{job_id}.mp4")
+        one_min_amv_path = os.path.join(output_dir, f"1min_amv_{job_id}.mp4")
+        ffmpeg_amv_cmd = [
+            "ffmpeg",
+            "-ss", f"{three_min_start:.3f}",
+            "-t", f"{three_min_length:.3f}",
+            "-i", video_path,
+            "-ss", f"{one_min_start:.3f}",
+            "-t", f"{one_min_length:.3f}",
+            "-i", video_path,
+            "-i", music_path,
+            # 3-minute AMV
+            "-map", "0:v",
+            "-map", "2:a",
+            *video_args(profile, threads),
+            *audio_args(profile),
+            "-shortest",
+            three_min_amv_path,
+            # 1-minute AMV
+            "-map", "1:v",
+            "-map", "2:a",
+            *video_args(profile, threads),
+            *audio_args(profile),
+            "-shortest",
+            one_min_amv_path
+        ]
+        # ffmpeg's progress time follows the longer clip
+        render_seconds = max(three_min_length, one_min_length)
+
+        def report_encode(seconds, fps):
+            progress = int(30 + 69 * min(1.0, seconds / render_seconds))
+            if progress != last_reported["progress"]:
+                last_reported["progress"] = progress
+                job_store.update(job_id, progress=progress, encode_fps=round(fps, 1))
+
+        with metrics.stage(job_id, JOB_KIND, "render"):
+            run_media(
+                ffmpeg_amv_cmd,
+                job_id=job_id,
+                on_progress=report_encode,
+                cleanup=[three_min_amv_path, one_min_amv_path]
+            )
+
+        # Update job status and result
+        job_store.update(
+            job_id,
+            progress=100,
+            status="completed",
+            current_step="AMVs generated successfully",
+            encode_fps=None,
+            results={
                 "three_min_amv": os.path.basename(three_min_amv_path),
-                "one_min_amv": os.path.basename(one_min_amv_path)
+                "one_min_amv": os.path.basename(one_min_amv_path),
+                "windows": {
+                    name: {"start": start, "duration": length}
+                    for name, (start, length) in windows.items()
+                }
             }
+        )
 
-            logging.info(f"AMV generation completed for job {job_id}")
+        logging.info(f"AMV generation completed for job {job_id}")
 
+    except JobCancelled:
+        logging.info(f"AMV generation cancelled for job {job_id}")
+        job_store.update(job_id, status="cancelled", current_step="Job cancelled", encode_fps=None)
     except Exception as e:
         logging.error(f"Error generating AMV for job {job_id}: {str(e)}")
-        running_jobs[job_id]["status"] = "error"
-        running_jobs[job_id]["error"] = str(e)
+        job_store.update(job_id, status="error", error=str(e))
 
 @amv_generator_bp.route('/generate', methods=['POST'])
 def start_amv_generation():
     try:
-        if 'video' not in request.files:
+        # The video arrives either as a finished chunked upload or as a file part
+        upload_id = request.form.get('upload_id')
+        if not upload_id and 'video' not in request.files:
             return jsonify({
                 "success": False,
                 "error": "No video file provided"
             }), 400
 
-        video_file = request.files['video']
+        video_file = request.files.get('video')
         music_url = request.form.get('music_url')
+        try:
+            profile = resolve_profile(request.form.get('profile'))
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
 
-        if video_file.filename == '':
+        if not upload_id and video_file.filename == '':
             return jsonify({
                 "success": False,
                 "error": "No video file selected"
@@ -160,12 +174,19 @@ def start_amv_generation():
                 "error": "YouTube music URL is required"
             }), 400
 
-        if not allowed_video_file(video_file.filename):
+        if not upload_id and not allowed_video_file(video_file.filename):
             return jsonify({
                 "success": False,
                 "error": "Only MP4, MKV, and AVI video files are allowed"
             }), 400
 
+        # Reject early, before the upload is written to disk
+        if scheduler.is_full():
+            return jsonify({
+                "success": False,
+                "error": "Server is busy, please try again later"
+            }), 429
+
         # Create job ID and directories
         job_id = str(uuid.uuid4())
         upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'videos')
@@ -173,34 +194,49 @@ def start_amv_generation():
         os.makedirs(upload_dir, exist_ok=True)
         os.makedirs(output_dir, exist_ok=True)
 
-        # Save uploaded video
-        filename = secure_filename(video_file.filename)
-        video_path = os.path.join(upload_dir, f"{job_id}_{filename}")
-        video_file.save(video_path)
-
-        # Start AMV generation in a separate thread
-        running_jobs[job_id] = {
+        # Save uploaded video under its content hash
+        if upload_id:
+            try:
+                video_path, content_hash, _, filename = finalize_upload(upload_id, upload_dir)
+            except UploadError as e:
+                return jsonify({
+                    "success": False,
+                    "error": str(e)
+                }), 400
+        else:
+            filename = secure_filename(video_file.filename)
+            video_path, content_hash, _ = save_upload(
+                video_file, upload_dir, filename, current_app.config['MAX_CONTENT_LENGTH_CHUNK']
+            )
+
+        # Queue AMV generation on the shared scheduler
+        job_store.create(JOB_KIND, {
             "id": job_id,
             "filename": filename,
+            "content_hash": content_hash,
+            "encoding_profile": profile,
             "status": "starting",
             "progress": 0,
             "current_step": "Job queued",
             "start_time": datetime.now().isoformat(),
             "results": None,
             "error": None
-        }
+        })
 
-        thread = threading.Thread(
-            target=generate_amv,
-            args=(job_id, video_path, music_url, output_dir)
-        )
-        thread.daemon = True
-        thread.start()
+        try:
+            position = scheduler.submit(job_id, generate_amv, video_path, music_url, output_dir, profile)
+        except SchedulerFullError as e:
+            job_store.update(job_id, status="error", error=str(e))
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 429
 
         return jsonify({
             "success": True,
             "job_id": job_id,
-            "message": "AMV generation started"
+            "queue_position": position,
+            "message": "AMV generation queued"
         })
 
     except Exception as e:
@@ -212,7 +248,8 @@ def start_amv_generation():
 
 @amv_generator_bp.route('/status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
-    if job_id not in running_jobs:
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
         return jsonify({
             "success": False,
             "error": "Job not found"
@@ -220,19 +257,57 @@ def get_job_status(job_id):
 
     return jsonify({
         "success": True,
-        "job": running_jobs[job_id]
+        "job": job
+    })
+
+@amv_generator_bp.route('/events/<job_id>', methods=['GET'])
+def stream_job_status(job_id):
+    if not job_store.exists(job_id, kind=JOB_KIND):
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+
+    return stream_job(job_id, JOB_KIND, until=FINISHED_STATUSES)
+
+@amv_generator_bp.route('/cancel/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+
+    if job['status'] in FINISHED_STATUSES:
+        return jsonify({
+            "success": False,
+            "error": "Job is not running"
+        }), 400
+
+    # A job still queued in this worker is simply dropped; otherwise the
+    # cancellation flag stops it wherever it runs (or is queued)
+    if scheduler.cancel(job_id):
+        job_store.update(job_id, status="cancelled", queue_position=None, current_step="Job cancelled")
+    else:
+        cancel_job_processes(job_id)
+        job_store.update(job_id, current_step="Cancelling...")
+
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "message": "Job cancellation requested"
     })
 
 @amv_generator_bp.route('/download/<job_id>/<clip_type>', methods=['GET'])
 def download_amv(job_id, clip_type):
-    if job_id not in running_jobs:
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
         return jsonify({
             "success": False,
             "error": "Job not found"
         }), 404
 
-    job = running_jobs[job_id]
-
     if job['status'] != 'completed':
         return jsonify({
             "success": False,
@@ -263,9 +338,10 @@ def download_amv(job_id, clip_type):
             "error": "File not found"
         }), 404
 
-    return send_file(
+    # ?inline=1 serves the clip for an in-page <video> preview
+    return send_output(
         file_path,
-        as_attachment=True,
+        "video/mp4",
         download_name=file_name,
-        mimetype="video/mp4"
+        as_attachment=request.args.get('inline') != '1'
     )
\ No newline at end of file
@@ -1,19 +1,52 @@
 import os
 import uuid
 import logging
-import subprocess
 import json
 import tempfile
 import threading
-from flask import Blueprint, render_template, request, jsonify, current_app, send_file
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from flask import Blueprint, Response, render_template, request, jsonify, current_app, redirect, url_for
 from werkzeug.utils import secure_filename
 import numpy as np
 from datetime import datetime
+from modules.job_store import job_store
+from modules.job_events import stream_job
+from modules.scheduler import scheduler, SchedulerFullError, PRIORITY_HIGH
+from modules.media_index import load_keyframe_index, seek_input_args
+from modules.smart_render import probe_video_stream, can_smart_render, render_scene
+from modules.scene_detector import detect_content_scenes, scenes_from_scores, DEFAULT_DOWNSCALE_WIDTH
+from modules.music_cache import music_cache, MusicSourceError
+from modules.chunked_upload import finalize_upload, UploadError
+from modules.beat_analysis import beat_analyzer
+from modules.delivery import send_output
+from modules import metrics
+from modules.encoding_profiles import resolve_profile, video_args, audio_args, allows_stream_copy, DEFAULT_PROFILE
+from modules.media_runner import (
+    run_media, cancel as cancel_job_processes, check_cancelled, remove_outputs, JobCancelled,
+    CANCEL_CHECK_INTERVAL
+)
+from modules.scene_list import save_scenes, load_scenes, scenes_path_for, thumbnail_name, scenes_etag
+from modules.preview_proxy import render_proxy, DEFAULT_PROXY_HEIGHT
+from modules.content_cache import (
+    save_upload, load_scores, save_scores, thumbnail_cache_dir, cached_thumbnail_path, link_file,
+    proxy_path_for
+)
 
 anime_editor_bp = Blueprint('anime_editor', __name__, url_prefix='/anime_editor')
 
-# Track running jobs
-running_jobs = {}
+# Jobs are tracked in the shared job store so every worker can see them
+JOB_KIND = 'anime_editor'
+
+# Thumbnails are only shown in the scene grid, so store them at card size
+THUMBNAIL_WIDTH = 320
+
+# Statuses in which no work is running for the job
+IDLE_STATUSES = {"scenes_detected", "completed", "error", "cancelled"}
+
+# Scenes per /scenes page by default, and at most
+SCENES_PAGE_SIZE = 200
+MAX_SCENES_PAGE_SIZE = 1000
 
 @anime_editor_bp.route('/', methods=['GET'])
 def anime_editor_page():
@@ -23,138 +56,341 @@ def allowed_video_file(filename):
     """Check if the file is an allowed video format"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'mp4', 'mkv', 'avi'}
 
-def detect_scenes(job_id, video_path, output_dir, threshold=30, min_scene_length=2):
-    """Detect scenes in the video using PySceneDetect with custom parameters"""
+def extract_thumbnails(video_path, times, output_dir, prefix, job_id=None, on_progress=None):
+    """Extract one UI-sized frame per timestamp in a single decode pass"""
+    if not times:
+        return []
+    
+    # Select the first frame at or after each timestamp
+    select_expr = "+".join(f"gte(t,{t:.3f})*lt(prev_t,{t:.3f})" for t in times)
+    batch_pattern = os.path.join(output_dir, f"{prefix}_batch_%d.jpg")
+    ffmpeg_thumbs_cmd = [
+        "ffmpeg",
+        "-i", video_path,
+        "-an", "-sn",
+        "-vf", f"select='{select_expr}',scale={THUMBNAIL_WIDTH}:-2",
+        "-fps_mode", "vfr",
+        "-q:v", "5",
+        batch_pattern
+    ]
+    batch_paths = [batch_pattern % (i + 1) for i in range(len(times) + 1)]
+    run_media(ffmpeg_thumbs_cmd, job_id=job_id, on_progress=on_progress, cleanup=batch_paths)
+    
+    batch_paths = batch_paths[:-1]
+    thumbnail_paths = [os.path.join(output_dir, f"{prefix}_{i}.jpg") for i in range(len(times))]
+    
+    if all(os.path.exists(p) for p in batch_paths) and not os.path.exists(batch_pattern % (len(times) + 1)):
+        for batch_path, thumbnail_path in zip(batch_paths, thumbnail_paths):
+            os.replace(batch_path, thumbnail_path)
+        return thumbnail_paths
+    
+    # Two timestamps fell on the same frame (or before the first one), so the
+    # batch can't be matched to scenes; seek per thumbnail instead
+    logging.warning(f"Batched thumbnail count mismatch for {video_path}, extracting individually")
+    i = 1
+    while os.path.exists(batch_pattern % i):
+        os.remove(batch_pattern % i)
+        i += 1
+    for t, thumbnail_path in zip(times, thumbnail_paths):
+        ffmpeg_thumb_cmd = [
+            "ffmpeg",
+            "-ss", f"{t:.3f}",
+            "-i", video_path,
+            "-vframes", "1",
+            "-vf", f"scale={THUMBNAIL_WIDTH}:-2",
+            "-q:v", "5",
+            thumbnail_path
+        ]
+        run_media(ffmpeg_thumb_cmd, job_id=job_id, cleanup=[thumbnail_path])
+    return thumbnail_paths
+
+def detect_scenes(job_id, video_path, output_dir, threshold=30, min_scene_length=2,
+                  downscale_width=DEFAULT_DOWNSCALE_WIDTH, frame_skip=0, preview_proxy=False,
+                  proxy_height=DEFAULT_PROXY_HEIGHT):
+    """Detect scenes in the video with the built-in content detector"""
     try:
         logging.info(f"Starting scene detection for job {job_id} with threshold={threshold}, min_scene_length={min_scene_length}")
-        running_jobs[job_id]["status"] = "processing"
-        running_jobs[job_id]["progress"] = 10
-        running_jobs[job_id]["current_step"] = "Analyzing video for scene changes..."
+        job_store.update(
+            job_id,
+            status="processing",
+            progress=10,
+            current_step="Analyzing video for scene changes..."
+        )
         
-        # Create temporary directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Detect scenes using PySceneDetect
-            scenes_json_path = os.path.join(temp_dir, "scenes.json")
-            
-            # Run PySceneDetect with custom threshold
-            # Note: PySceneDetect command syntax might be version-specific
-            scenedetect_cmd = [
-                "scenedetect",
-                "-i", video_path,
-                "detect-content",
-                "-t", str(threshold),  # User-specified threshold for scene detection
-                "list-scenes",
-                "-o", scenes_json_path,
-                "-f", "json"
-            ]
-            
-            try:
-                result = subprocess.run(scenedetect_cmd, capture_output=True, text=True)
-                if result.returncode != 0:
-                    logging.error(f"scenedetect error output: {result.stderr}")
-                    raise Exception(f"scenedetect failed: {result.stderr}")
-                logging.info(f"scenedetect output: {result.stdout}")
-            except Exception as e:
-                logging.error(f"Failed to run scenedetect: {str(e)}")
-                raise
-            
-            if not os.path.exists(scenes_json_path):
-                raise Exception("Failed to detect scenes")
-            
-            # Read detected scenes
-            with open(scenes_json_path, 'r') as f:
-                scenes_data = json.load(f)
-            
-            # Extract scene information
-            scenes = []
-            for scene in scenes_data.get('scenes', []):
-                start_time = scene.get('start_time', 0)
-                end_time = scene.get('end_time', 0)
-                
-                # Generate thumbnail for the scene
-                thumbnail_path = os.path.join(output_dir, f"thumb_{job_id}_{len(scenes)}.jpg")
-                
-                # Extract frame at the middle of the scene
-                middle_time = (start_time + end_time) / 2
-                ffmpeg_thumb_cmd = [
-                    "ffmpeg",
-                    "-ss", str(middle_time),
-                    "-i", video_path,
-                    "-vframes", "1",
-                    "-q:v", "2",
-                    thumbnail_path
-                ]
-                subprocess.run(ffmpeg_thumb_cmd, check=True, capture_output=True, text=True)
+        # Report frames processed, but only write to the job store when the
+        # visible percentage actually moves
+        last_reported = {"progress": -1}
+        
+        def report_frames(frames_processed, total_frames):
+            if total_frames <= 0:
+                return
+            progress = int(10 + 50 * min(1.0, frames_processed / total_frames))
+            if progress != last_reported["progress"]:
+                last_reported["progress"] = progress
+                check_cancelled(job_id)
+                job_store.update(
+                    job_id,
+                    progress=progress,
+                    frames_processed=frames_processed,
+                    total_frames=total_frames,
+                    current_step=f"Analyzing frames ({frames_processed} of {total_frames})..."
+                )
+        
+        # The preview proxy is shared by every job on this content, so it is
+        # only built if no earlier job has built it; it is written under a
+        # temporary name and moved into place once complete
+        proxy_path = proxy_path_for(video_path)
+        build_proxy = preview_proxy and not os.path.exists(proxy_path)
+        proxy_tmp_path = f"{proxy_path}.{job_id}.part"
+        
+        # The score curve doesn't depend on threshold or minimum length, so a
+        # cached curve for this content answers any detection settings
+        detection = load_scores(video_path, downscale_width, frame_skip)
+        if detection is not None:
+            logging.info(f"Using cached scene analysis for job {job_id}")
+            detected = scenes_from_scores(
+                detection["frame_times"], detection["scores"], detection["duration"],
+                threshold, min_scene_length
+            )
+            if build_proxy:
+                job_store.update(job_id, current_step="Building preview proxy...")
+                duration = detection["duration"] or 0
                 
-                scenes.append({
-                    "id": len(scenes),
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "duration": end_time - start_time,
-                    "thumbnail": os.path.basename(thumbnail_path)
-                })
+                def report_proxy(seconds, fps):
+                    if duration > 0:
+                        job_store.update(job_id, progress=int(10 + 50 * min(1.0, seconds / duration)))
                 
-                # Update progress
-                progress = 10 + (80 * len(scenes) / len(scenes_data.get('scenes', [])))
-                running_jobs[job_id]["progress"] = min(90, progress)
+                with metrics.stage(job_id, JOB_KIND, "proxy"):
+                    render_proxy(video_path, proxy_tmp_path, proxy_height, job_id=job_id, on_progress=report_proxy)
+        else:
+            # With a proxy requested, ffmpeg decodes once for both the
+            # analysis frames and the proxy encode
+            with metrics.stage(job_id, JOB_KIND, "scene_analysis"):
+                detection = detect_content_scenes(
+                    video_path,
+                    threshold=threshold,
+                    min_scene_length=min_scene_length,
+                    downscale_width=downscale_width,
+                    frame_skip=frame_skip,
+                    progress_callback=report_frames,
+                    proxy_path=proxy_tmp_path if build_proxy else None,
+                    proxy_height=proxy_height,
+                    job_id=job_id
+                )
+            detected = detection["scenes"]
+            try:
+                save_scores(video_path, detection, downscale_width, frame_skip)
+            except Exception as e:
+                logging.warning(f"Could not cache scene analysis for job {job_id}: {str(e)}")
+        
+        if build_proxy:
+            os.replace(proxy_tmp_path, proxy_path)
+        
+        job_store.update(job_id, progress=60, current_step="Generating scene thumbnails...")
+        
+        # Thumbnails (middle frame of each scene) are cached per upload; any
+        # that aren't cached yet are extracted together in one pass
+        midpoints = [(start_time + end_time) / 2 for start_time, end_time in detected]
+        cached_paths = [cached_thumbnail_path(video_path, t) for t in midpoints]
+        missing = {}
+        for t, cache_path in zip(midpoints, cached_paths):
+            if not os.path.exists(cache_path):
+                missing.setdefault(cache_path, t)
+        if missing:
+            cache_dir = thumbnail_cache_dir(video_path)
+            os.makedirs(cache_dir, exist_ok=True)
+            duration = detection["duration"] or 0
             
-            # Save scenes data
-            scenes_path = os.path.join(output_dir, f"scenes_{job_id}.json")
-            with open(scenes_path, 'w') as f:
-                json.dump(scenes, f, indent=2)
+            def report_thumbnails(seconds, fps):
+                if duration > 0:
+                    job_store.update(job_id, progress=int(60 + 25 * min(1.0, seconds / duration)))
             
-            # Update job status and result
-            running_jobs[job_id]["progress"] = 100
-            running_jobs[job_id]["status"] = "scenes_detected"
-            running_jobs[job_id]["current_step"] = "Scenes detected successfully"
-            running_jobs[job_id]["results"] = {
+            with metrics.stage(job_id, JOB_KIND, "thumbnails"):
+                extracted = extract_thumbnails(
+                    video_path, list(missing.values()), cache_dir, f"new_{job_id}",
+                    job_id=job_id, on_progress=report_thumbnails
+                )
+            for extracted_path, cache_path in zip(extracted, missing.keys()):
+                os.replace(extracted_path, cache_path)
+        
+        thumbnail_paths = []
+        for i, cache_path in enumerate(cached_paths):
+            thumbnail_path = os.path.join(output_dir, thumbnail_name(job_id, i))
+            link_file(cache_path, thumbnail_path)
+            thumbnail_paths.append(thumbnail_path)
+        
+        job_store.update(job_id, progress=90)
+        
+        # Index keyframes now (unless this upload already has an index) so
+        # later cuts can seek without decoding
+        try:
+            with metrics.stage(job_id, JOB_KIND, "keyframe_index"):
+                load_keyframe_index(video_path)
+        except Exception as e:
+            logging.warning(f"Could not build keyframe index for job {job_id}: {str(e)}")
+        
+        # Save scenes data; the list is served in pages from its own file so
+        # the job record (read on every status poll) stays small
+        scenes_path = scenes_path_for(output_dir, job_id)
+        scenes = save_scenes(scenes_path, job_id, detected)
+        
+        # Update job status and result
+        job_store.update(
+            job_id,
+            progress=100,
+            status="scenes_detected",
+            current_step="Scenes detected successfully",
+            results={
                 "scenes_file": os.path.basename(scenes_path),
                 "scenes_count": len(scenes),
-                "scenes": scenes
+                "preview_proxy": preview_proxy and os.path.exists(proxy_path)
             }
-            
-            logging.info(f"Scene detection completed for job {job_id}: found {len(scenes)} scenes")
-    
+        )
+        
+        logging.info(f"Scene detection completed for job {job_id}: found {len(scenes)} scenes")
+
+    except JobCancelled:
+        logging.info(f"Scene detection cancelled for job {job_id}")
+        job_store.update(job_id, status="cancelled", current_step="Job cancelled")
     except Exception as e:
         logging.error(f"Error detecting scenes for job {job_id}: {str(e)}")
-        running_jobs[job_id]["status"] = "error"
-        running_jobs[job_id]["error"] = str(e)
+        job_store.update(job_id, status="error", error=str(e))
 
-def create_edited_video(job_id, video_path, music_path, selected_scenes, output_dir):
+def extract_scene_clip(video_path, keyframes, scene, clip_path, threads, job_id=None, on_progress=None,
+                       profile=DEFAULT_PROFILE):
+    """Re-encode one scene into a standalone clip"""
+    # Seek on the input side to the preceding keyframe and trim precisely from there
+    ffmpeg_extract_cmd = [
+        "ffmpeg",
+        *seek_input_args(keyframes, video_path, scene["start_time"], scene["end_time"]),
+        *video_args(profile, threads),
+        *audio_args(profile),
+        "-strict", "experimental",
+        clip_path
+    ]
+    run_media(ffmpeg_extract_cmd, job_id=job_id, on_progress=on_progress, cleanup=[clip_path])
+    return [clip_path]
+
+def fetch_music(job_id, music_url):
+    """Fetch the edit's music through the shared cache (yt-dlp on a miss)"""
+    with metrics.stage(job_id, JOB_KIND, "music_download"):
+        return music_cache.fetch(music_url)
+
+def wait_for_music(job_id, music_future):
+    """Join the music fetch, still honouring cancellation while waiting"""
+    while True:
+        try:
+            return music_future.result(timeout=CANCEL_CHECK_INTERVAL)
+        except FutureTimeoutError:
+            check_cancelled(job_id)
+
+def create_edited_video(job_id, video_path, music_url, selected_scenes, output_dir, smart_render=False,
+                        thread_budget=None, profile=DEFAULT_PROFILE):
     """Create edited video with selected scenes and synchronized music"""
+    # The music downloads while the scenes are extracted; the two only meet
+    # at beat detection and the final mux
+    music_executor = ThreadPoolExecutor(max_workers=1)
     try:
         logging.info(f"Starting video editing for job {job_id}")
-        running_jobs[job_id]["status"] = "editing"
-        running_jobs[job_id]["progress"] = 0
-        running_jobs[job_id]["current_step"] = "Preparing to create edited video..."
+        job = job_store.update(
+            job_id,
+            status="editing",
+            progress=0,
+            current_step="Preparing to create edited video..."
+        )
+        scene_list = load_scenes(os.path.join(output_dir, job["results"]["scenes_file"]), job_id)
+        music_future = music_executor.submit(fetch_music, job_id, music_url)
+        
+        # Get the beat-analysis pool warming up while scenes are extracted
+        beat_analyzer.prewarm()
+        keyframes = load_keyframe_index(video_path)["keyframes"]
+        
+        # Smart render copies source video, so it can't produce a scaled-down
+        # draft, and only works when libx264 can match the source stream
+        if smart_render and not allows_stream_copy(profile):
+            logging.info(f"Encoding profile '{profile}' rescales video, re-encoding scenes for job {job_id}")
+            smart_render = False
+        stream_info = probe_video_stream(video_path) if smart_render else {}
+        if smart_render and not can_smart_render(stream_info):
+            logging.info(f"Source codec not suitable for smart render in job {job_id}, re-encoding scenes")
+            smart_render = False
         
         # Create temporary directory for processing
         with tempfile.TemporaryDirectory() as temp_dir:
-            # Extract selected scenes
-            scene_clips = []
-            for i, scene_id in enumerate(selected_scenes):
-                scene = next((s for s in running_jobs[job_id]["results"]["scenes"] if s["id"] == scene_id), None)
-                if scene:
-                    scene_clip_path = os.path.join(temp_dir, f"scene_{i}.mp4")
-                    
-                    # Extract scene using ffmpeg
-                    ffmpeg_extract_cmd = [
-                        "ffmpeg",
-                        "-i", video_path,
-                        "-ss", str(scene["start_time"]),
-                        "-to", str(scene["end_time"]),
-                        "-c:v", "libx264",
-                        "-c:a", "aac",
-                        "-strict", "experimental",
-                        scene_clip_path
-                    ]
-                    subprocess.run(ffmpeg_extract_cmd, check=True, capture_output=True, text=True)
-                    scene_clips.append(scene_clip_path)
+            # Scenes are independent segments of the timeline, so encode them
+            # concurrently, splitting the job's thread budget between the
+            # ffmpeg processes.  The budget is this job's share of the cores
+            # free next to the scheduler's other running jobs, less one thread
+            # for the music fetch (yt-dlp transcodes to mp3) while it runs
+            timeline = [
+                (i, scene_list.scene(scene_id))
+                for i, scene_id in enumerate(selected_scenes)
+                if scene_list.has(scene_id)
+            ]
+            thread_budget = thread_budget or scheduler.thread_budget()
+            segment_budget = thread_budget - 1 if thread_budget > 1 and not music_future.done() else thread_budget
+            concurrency = max(1, min(len(timeline), segment_budget))
+            threads_per_segment = max(1, segment_budget // concurrency)
+            
+            # Progress is the share of timeline seconds encoded so far, summed
+            # over the segments running in parallel; encode fps is their total
+            total_seconds = sum(scene["end_time"] - scene["start_time"] for _, scene in timeline) or 1
+            encoded_seconds = {}
+            segment_fps = {}
+            progress_lock = threading.Lock()
+            last_reported = {"progress": -1}
+            
+            def segment_progress(i, scene):
+                def report(seconds, fps):
+                    with progress_lock:
+                        encoded_seconds[i] = min(seconds, scene["end_time"] - scene["start_time"])
+                        segment_fps[i] = fps
+                        progress = int(5 + 45 * sum(encoded_seconds.values()) / total_seconds)
+                        if progress == last_reported["progress"]:
+                            return
+                        last_reported["progress"] = progress
+                        encode_fps = round(sum(segment_fps.values()), 1)
+                    job_store.update(job_id, progress=progress, encode_fps=encode_fps)
+                return report
+            
+            # Segment threads run in a copy of this context so their ffmpeg
+            # runs are labelled with the stage
+            segment_clips = {}
+            with metrics.stage(job_id, JOB_KIND, "extract_scenes"):
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    futures = {}
+                    for i, scene in timeline:
+                        if smart_render:
+                            # Copy whole GOPs and re-encode only the partial ones at the cuts
+                            future = executor.submit(
+                                contextvars.copy_context().run,
+                                render_scene, video_path, keyframes, stream_info,
+                                scene["start_time"], scene["end_time"], temp_dir, f"scene_{i}",
+                                threads_per_segment, job_id, segment_progress(i, scene), profile
+                            )
+                        else:
+                            future = executor.submit(
+                                contextvars.copy_context().run,
+                                extract_scene_clip, video_path, keyframes, scene,
+                                os.path.join(temp_dir, f"scene_{i}.mp4"), threads_per_segment,
+                                job_id, segment_progress(i, scene), profile
+                            )
+                        futures[future] = i
                 
-                # Update progress
-                progress = 5 + (45 * (i + 1) / len(selected_scenes))
-                running_jobs[job_id]["progress"] = progress
-                running_jobs[job_id]["current_step"] = f"Extracting scene {i+1} of {len(selected_scenes)}"
+                    try:
+                        for done, future in enumerate(as_completed(futures), start=1):
+                            segment_clips[futures[future]] = future.result()
+                            with progress_lock:
+                                segment_fps.pop(futures[future], None)
+                            job_store.update(job_id, current_step=f"Extracted {done} of {len(timeline)} scenes")
+                    except BaseException:
+                        # Don't start the remaining segments of a failed timeline
+                        for pending in futures:
+                            pending.cancel()
+                        raise
+            
+            # Reassemble in timeline order for the lossless concat
+            scene_clips = [clip for i, _ in timeline for clip in segment_clips[i]]
             
             # Create a file with the list of clips
             clips_list_path = os.path.join(temp_dir, "clips_list.txt")
@@ -172,48 +408,25 @@ def create_edited_video(job_id, video_path, music_path, selected_scenes, output_
                 "-c", "copy",
                 concat_output_path
             ]
-            subprocess.run(ffmpeg_concat_cmd, check=True, capture_output=True, text=True)
-            
-            running_jobs[job_id]["progress"] = 60
-            running_jobs[job_id]["current_step"] = "Adding music with beat synchronization..."
+            with metrics.stage(job_id, JOB_KIND, "concat"):
+                run_media(ffmpeg_concat_cmd, job_id=job_id, cleanup=[concat_output_path])
             
-            # Process the music using librosa for beat detection
-            # Since we can't import librosa directly here, we'll use a Python subprocess
-            beat_script = os.path.join(temp_dir, "beat_detection.py")
-            with open(beat_script, 'w') as f:
-                f.write("""
-import os
-import sys
-import json
-import librosa
-import numpy as np
-
-def detect_beats(audio_path):
-    y, sr = librosa.load(audio_path)
-    tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
-    return {
-        "tempo": float(tempo),
-        "beat_times": beat_times.tolist()
-    }
-
-if __name__ == "__main__":
-    audio_path = sys.argv[1]
-    output_path = sys.argv[2]
-    
-    beats = detect_beats(audio_path)
-    
-    with open(output_path, 'w') as f:
-        json.dump(beats, f)
-""")
+            job_store.update(job_id, progress=55, encode_fps=None)
+            if not music_future.done():
+                job_store.update(job_id, current_step="Waiting for the music download...")
+            music_path = wait_for_music(job_id, music_future)
+            job_store.update(job_id, progress=60, current_step="Adding music with beat synchronization...")
             
-            # Run beat detection
-            beats_json_path = os.path.join(temp_dir, "beats.json")
-            beat_cmd = ["python", beat_script, music_path, beats_json_path]
-            subprocess.run(beat_cmd, check=True, capture_output=True, text=True)
+            # Beat detection runs in the warm analysis pool and is cached by
+            # audio content, so repeat tracks return immediately
+            with metrics.stage(job_id, JOB_KIND, "beat_detection"):
+                beats = beat_analyzer.analyze(music_path)
+            check_cancelled(job_id)
+            job_store.update_results(job_id, tempo=beats["tempo"], beat_count=len(beats["beat_times"]))
             
-            # Add music to the concatenated video
-            final_output_path = os.path.join(output_dir, f"edited_{job_id}.mp4")
+            # Add music to the concatenated video.  Every render gets its own
+            # file name, since outputs are served as immutable
+            final_output_path = os.path.join(output_dir, f"edited_{job_id}_{profile}_{uuid.uuid4().hex[:8]}.mp4")
             ffmpeg_music_cmd = [
                 "ffmpeg",
                 "-i", concat_output_path,
@@ -221,40 +434,62 @@ if __name__ == "__main__":
                 "-map", "0:v",
                 "-map", "1:a",
                 "-c:v", "copy",
-                "-c:a", "aac",
+                *audio_args(profile),
                 "-shortest",
                 final_output_path
             ]
-            subprocess.run(ffmpeg_music_cmd, check=True, capture_output=True, text=True)
+            with metrics.stage(job_id, JOB_KIND, "mux"):
+                run_media(ffmpeg_music_cmd, job_id=job_id, cleanup=[final_output_path])
+            
+            # A new render (a draft promoted to final, say) replaces the last one
+            previous_output = (job.get("results") or {}).get("edited_video")
+            if previous_output and previous_output != os.path.basename(final_output_path):
+                remove_outputs([os.path.join(output_dir, previous_output)])
             
             # Update job status and result
-            running_jobs[job_id]["progress"] = 100
-            running_jobs[job_id]["status"] = "completed"
-            running_jobs[job_id]["current_step"] = "Video editing completed successfully"
-            running_jobs[job_id]["results"]["edited_video"] = os.path.basename(final_output_path)
+            job_store.update_results(
+                job_id,
+                edited_video=os.path.basename(final_output_path),
+                encoding_profile=profile
+            )
+            job_store.update(
+                job_id,
+                progress=100,
+                status="completed",
+                current_step="Video editing completed successfully"
+            )
             
             logging.info(f"Video editing completed for job {job_id}")
     
+    except JobCancelled:
+        logging.info(f"Video editing cancelled for job {job_id}")
+        job_store.update(job_id, status="cancelled", current_step="Job cancelled", encode_fps=None)
     except Exception as e:
         logging.error(f"Error editing video for job {job_id}: {str(e)}")
-        running_jobs[job_id]["status"] = "error"
-        running_jobs[job_id]["error"] = str(e)
+        job_store.update(job_id, status="error", error=str(e), encode_fps=None)
+    finally:
+        # A download still running is left to finish into the shared cache
+        music_executor.shutdown(wait=False)
 
 @anime_editor_bp.route('/detect_scenes', methods=['POST'])
 def start_scene_detection():
     try:
+        # The video arrives either as a finished chunked upload (already
+        # validated when it was created) or as a multipart file part
+        upload_id = request.form.get('upload_id')
+        
         # Check if request has the file part
-        if 'video' not in request.files:
+        if not upload_id and 'video' not in request.files:
             logging.warning("No video file in request")
             return jsonify({
                 "success": False,
                 "error": "No video file was provided in the request"
             }), 400
         
-        video_file = request.files['video']
+        video_file = request.files.get('video')
         
         # Check if filename is empty (no file selected)
-        if not video_file or video_file.filename == '':
+        if not upload_id and (not video_file or video_file.filename == ''):
             logging.warning("Empty filename")
             return jsonify({
                 "success": False,
@@ -262,7 +497,7 @@ def start_scene_detection():
             }), 400
         
         # Check if the file is allowed
-        if not allowed_video_file(video_file.filename):
+        if not upload_id and not allowed_video_file(video_file.filename):
             logging.warning(f"Invalid file type: {video_file.filename}")
             return jsonify({
                 "success": False,
@@ -291,6 +526,16 @@ def start_scene_detection():
             min_scene_length = 2
             logging.warning("Invalid detection settings, using defaults")
         
+        # Optional low-resolution proxy for hover previews and draft playback
+        preview_proxy = request.form.get('preview_proxy', '').lower() in ('1', 'true', 'on')
+        
+        # Reject early, before the upload is written to disk
+        if scheduler.is_full():
+            return jsonify({
+                "success": False,
+                "error": "Server is busy, please try again later"
+            }), 429
+        
         # Create job ID and directories
         job_id = str(uuid.uuid4())
         upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'videos')
@@ -298,46 +543,67 @@ def start_scene_detection():
         os.makedirs(upload_dir, exist_ok=True)
         os.makedirs(output_dir, exist_ok=True)
         
-        # Save uploaded video - Use empty string as default to avoid None
-        filename = secure_filename(video_file.filename or "")
-        if not filename:
-            return jsonify({
-                "success": False,
-                "error": "Invalid video file"
-            }), 400
+        # Uploads are stored by content hash so re-uploads reuse earlier analysis
+        if upload_id:
+            try:
+                video_path, content_hash, reused, filename = finalize_upload(upload_id, upload_dir)
+            except UploadError as e:
+                return jsonify({
+                    "success": False,
+                    "error": str(e)
+                }), 400
+        else:
+            # Save uploaded video - Use empty string as default to avoid None
+            filename = secure_filename(video_file.filename or "")
+            if not filename:
+                return jsonify({
+                    "success": False,
+                    "error": "Invalid video file"
+                }), 400
             
-        video_path = os.path.join(upload_dir, f"{job_id}_{filename}")
-        video_file.save(video_path)
+            video_path, content_hash, reused = save_upload(
+                video_file, upload_dir, filename, current_app.config['MAX_CONTENT_LENGTH_CHUNK']
+            )
         
         logging.info(f"Starting scene detection job {job_id} with threshold={threshold}, min_scene_length={min_scene_length}")
         
-        # Start scene detection in a separate thread
-        running_jobs[job_id] = {
+        # Queue scene detection on the shared scheduler
+        job_store.create(JOB_KIND, {
             "id": job_id,
             "filename": filename,
             "video_path": video_path,
+            "content_hash": content_hash,
+            "reused_upload": reused,
             "threshold": threshold,
             "min_scene_length": min_scene_length,
+            "preview_proxy": preview_proxy,
             "status": "starting",
             "progress": 0,
             "current_step": "Job queued",
             "start_time": datetime.now().isoformat(),
             "results": None,
             "error": None
-        }
+        })
         
-        # Pass the detection settings to the worker thread
-        thread = threading.Thread(
-            target=detect_scenes,
-            args=(job_id, video_path, output_dir, threshold, min_scene_length)
-        )
-        thread.daemon = True
-        thread.start()
+        # Pass the detection settings to the scheduled job
+        try:
+            position = scheduler.submit(
+                job_id, detect_scenes, video_path, output_dir, threshold, min_scene_length,
+                current_app.config['SCENE_DETECT_WIDTH'], current_app.config['SCENE_DETECT_FRAME_SKIP'],
+                preview_proxy, current_app.config['PREVIEW_PROXY_HEIGHT']
+            )
+        except SchedulerFullError as e:
+            job_store.update(job_id, status="error", error=str(e))
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 429
         
         return jsonify({
             "success": True,
             "job_id": job_id,
-            "message": "Scene detection started"
+            "queue_position": position,
+            "message": "Scene detection queued"
         })
     
     except Exception as e:
@@ -357,6 +623,14 @@ def start_video_editing():
         music_url = data.get('music_url', '')
         beat_sync = data.get('beat_sync', True)
         fade_audio = data.get('fade_audio', False)
+        smart_render = bool(data.get('smart_render', False))
+        try:
+            profile = resolve_profile(data.get('profile'))
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
         
         if not job_id:
             return jsonify({
@@ -364,18 +638,26 @@ def start_video_editing():
                 "error": "Job ID is required"
             }), 400
         
-        if job_id not in running_jobs:
+        job = job_store.get(job_id, kind=JOB_KIND)
+        if job is None:
             return jsonify({
                 "success": False,
                 "error": "Job not found"
             }), 404
         
-        if running_jobs[job_id]["status"] != "scenes_detected":
+        # A cancelled or failed edit can be retried with the scenes already
+        # detected, and a finished one rendered again (a draft promoted to final)
+        if job["status"] not in ("scenes_detected", "cancelled", "error", "completed") or not (job.get("results") or {}).get("scenes_count"):
             return jsonify({
                 "success": False,
                 "error": "Scene detection must be completed first"
             }), 400
         
+        # Without a new timeline, the last rendered one is used again
+        if not selected_scenes and job.get("timeline"):
+            selected_scenes = job["timeline"]
+            music_url = music_url or job.get("music_url", '')
+        
         if not selected_scenes:
             return jsonify({
                 "success": False,
@@ -388,48 +670,60 @@ def start_video_editing():
                 "error": "YouTube music URL is required"
             }), 400
         
+        # Only the source is checked here; the download itself runs in the
+        # job, alongside scene extraction
+        try:
+            music_cache.validate(music_url)
+        except MusicSourceError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
+        
+        if scheduler.is_full():
+            return jsonify({
+                "success": False,
+                "error": "Server is busy, please try again later"
+            }), 429
+        
         # Get video path from job
-        video_path = running_jobs[job_id]["video_path"]
+        video_path = job["video_path"]
         output_dir = os.path.join(current_app.config['RESULTS_FOLDER'], 'edited')
         
-        # Download music from YouTube
-        music_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'music')
-        os.makedirs(music_dir, exist_ok=True)
-        music_path = os.path.join(music_dir, f"music_{job_id}.mp3")
-        
-        # Update job status
-        running_jobs[job_id]["status"] = "downloading_music"
-        running_jobs[job_id]["progress"] = 0
-        running_jobs[job_id]["current_step"] = "Downloading music..."
-        
-        # Download music using yt-dlp
-        ytdlp_cmd = [
-            "yt-dlp", 
-            "-x", 
-            "--audio-format", "mp3",
-            "-o", music_path,
-            music_url
-        ]
-        subprocess.run(ytdlp_cmd, check=True, capture_output=True, text=True)
+        # Update job status; a failed start puts the job back as it was
+        previous_state = {"status": job["status"], "current_step": job.get("current_step")}
+        job_store.clear_cancel(job_id)
+        job_store.update(
+            job_id,
+            status="starting",
+            progress=0,
+            current_step="Job queued",
+            error=None,
+            render_mode="smart" if smart_render and allows_stream_copy(profile) else "reencode",
+            encoding_profile=profile,
+            timeline=selected_scenes,
+            music_url=music_url
+        )
         
-        if not os.path.exists(music_path):
+        # Editing continues a job the user is already waiting on, so it jumps
+        # ahead of fresh scene detections
+        try:
+            position = scheduler.submit(
+                job_id, create_edited_video, video_path, music_url, selected_scenes, output_dir,
+                smart_render, current_app.config['EDIT_THREAD_BUDGET'], profile, priority=PRIORITY_HIGH
+            )
+        except SchedulerFullError as e:
+            job_store.update(job_id, **previous_state)
             return jsonify({
                 "success": False,
-                "error": "Failed to download music"
-            }), 500
-        
-        # Start video editing in a separate thread
-        thread = threading.Thread(
-            target=create_edited_video,
-            args=(job_id, video_path, music_path, selected_scenes, output_dir)
-        )
-        thread.daemon = True
-        thread.start()
+                "error": str(e)
+            }), 429
         
         return jsonify({
             "success": True,
             "job_id": job_id,
-            "message": "Video editing started"
+            "queue_position": position,
+            "message": "Video editing queued"
         })
     
     except Exception as e:
@@ -441,21 +735,147 @@ def start_video_editing():
 
 @anime_editor_bp.route('/status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
-    if job_id not in running_jobs:
+    if not job_store.exists(job_id, kind=JOB_KIND):
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    
+    # Pollers send back the ETag; an unchanged job costs two indexed lookups
+    version = job_store.version(job_id)
+    etag = str(version)
+    if version is not None and request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"', "Cache-Control": "no-cache"})
+    
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    
+    # The scene list is served by /scenes; jobs from before it moved out of
+    # the record still carry it
+    if isinstance(job.get("results"), dict):
+        job["results"].pop("scenes", None)
+    
+    response = jsonify({
+        "success": True,
+        "job": job
+    })
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def _float_arg(name):
+    value = request.args.get(name)
+    return float(value) if value not in (None, '') else None
+
+@anime_editor_bp.route('/scenes/<job_id>', methods=['GET'])
+def get_scenes(job_id):
+    """A page of the detected scenes, optionally filtered by duration and time range"""
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
         return jsonify({
             "success": False,
             "error": "Job not found"
         }), 404
     
+    scenes_file = (job.get("results") or {}).get("scenes_file")
+    scenes_path = os.path.join(current_app.config['RESULTS_FOLDER'], 'edited', scenes_file or '')
+    if not scenes_file or not os.path.exists(scenes_path):
+        return jsonify({
+            "success": False,
+            "error": "Scenes not available"
+        }), 404
+    
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(MAX_SCENES_PAGE_SIZE, max(1, int(request.args.get('limit', SCENES_PAGE_SIZE))))
+        filters = {
+            "min_duration": _float_arg('min_duration'),
+            "max_duration": _float_arg('max_duration'),
+            "start": _float_arg('start'),
+            "end": _float_arg('end')
+        }
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "Invalid paging or filter parameters"
+        }), 400
+    
+    # The list never changes once saved, so a page is identified by the
+    # file and the query
+    query = json.dumps({"offset": offset, "limit": limit, **filters}, sort_keys=True)
+    etag = scenes_etag(scenes_path, query)
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"', "Cache-Control": "no-cache"})
+    
+    scene_list = load_scenes(scenes_path, job_id)
+    scene_ids = scene_list.select(**filters)
+    page = scene_ids[offset:offset + limit]
+    next_offset = offset + limit if offset + limit < len(scene_ids) else None
+    
+    response = jsonify({
+        "success": True,
+        "job_id": job_id,
+        "scenes_count": len(scene_list),
+        "total": int(len(scene_ids)),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": next_offset,
+        "scenes": scene_list.scenes(page)
+    })
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@anime_editor_bp.route('/events/<job_id>', methods=['GET'])
+def stream_job_status(job_id):
+    if not job_store.exists(job_id, kind=JOB_KIND):
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    
+    # Detection and editing are separate phases of one job, so the client
+    # says which statuses end the stream it is watching
+    until = set(filter(None, request.args.get('until', '').split(','))) or IDLE_STATUSES
+    return stream_job(job_id, JOB_KIND, until=until)
+
+@anime_editor_bp.route('/cancel/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    
+    if job['status'] in IDLE_STATUSES:
+        return jsonify({
+            "success": False,
+            "error": "Job is not running"
+        }), 400
+    
+    # A job still queued in this worker is simply dropped; otherwise the
+    # cancellation flag stops it wherever it runs (or is queued)
+    if scheduler.cancel(job_id):
+        job_store.update(job_id, status="cancelled", queue_position=None, current_step="Job cancelled")
+    else:
+        cancel_job_processes(job_id)
+        job_store.update(job_id, current_step="Cancelling...")
+    
     return jsonify({
         "success": True,
-        "job": running_jobs[job_id]
+        "job_id": job_id,
+        "message": "Job cancellation requested"
     })
 
 @anime_editor_bp.route('/thumbnail/<job_id>/<scene_id>', methods=['GET'])
 def get_thumbnail(job_id, scene_id):
     output_dir = os.path.join(current_app.config['RESULTS_FOLDER'], 'edited')
-    thumbnail_path = os.path.join(output_dir, f"thumb_{job_id}_{scene_id}.jpg")
+    thumbnail_path = os.path.join(output_dir, thumbnail_name(job_id, scene_id))
     
     if not os.path.exists(thumbnail_path):
         return jsonify({
@@ -463,34 +883,77 @@ def get_thumbnail(job_id, scene_id):
             "error": "Thumbnail not found"
         }), 404
     
-    return send_file(
-        thumbnail_path,
-        mimetype="image/jpeg"
-    )
+    return send_output(thumbnail_path, "image/jpeg")
+
+@anime_editor_bp.route('/preview/<job_id>', methods=['GET'])
+def get_preview_proxy(job_id):
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    
+    proxy_path = proxy_path_for(job["video_path"])
+    if not (job.get("results") or {}).get("preview_proxy") or not os.path.exists(proxy_path):
+        return jsonify({
+            "success": False,
+            "error": "Preview not available"
+        }), 404
+    
+    # Served with Range support so the scene grid can seek into it
+    return send_output(proxy_path, "video/mp4")
 
 @anime_editor_bp.route('/download/<job_id>', methods=['GET'])
 def download_edited_video(job_id):
-    if job_id not in running_jobs:
+    # A retry or a draft promoted to final replaces the edited video, so
+    # this URL is never cached; it points at the current render's own,
+    # immutable URL
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
         return jsonify({
             "success": False,
             "error": "Job not found"
         }), 404
     
-    job = running_jobs[job_id]
-    
     if job['status'] != 'completed':
         return jsonify({
             "success": False,
             "error": "Video editing has not completed yet"
         }), 400
     
-    if 'results' not in job or 'edited_video' not in job['results']:
+    if not (job.get('results') or {}).get('edited_video'):
         return jsonify({
             "success": False,
             "error": "No results available"
         }), 404
     
-    file_path = os.path.join(current_app.config['RESULTS_FOLDER'], 'edited', job['results']['edited_video'])
+    response = redirect(url_for(
+        'anime_editor.download_edited_video_file',
+        job_id=job_id,
+        file_name=job['results']['edited_video'],
+        **request.args
+    ))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@anime_editor_bp.route('/download/<job_id>/<file_name>', methods=['GET'])
+def download_edited_video_file(job_id, file_name):
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    
+    # Only the job's current render is served; every render has its own name
+    if file_name != (job.get('results') or {}).get('edited_video'):
+        return jsonify({
+            "success": False,
+            "error": "File not found"
+        }), 404
+    
+    file_path = os.path.join(current_app.config['RESULTS_FOLDER'], 'edited', file_name)
     
     if not os.path.exists(file_path):
         return jsonify({
@@ -498,9 +961,10 @@ def download_edited_video(job_id):
             "error": "File not found"
         }), 404
     
-    return send_file(
+    # ?inline=1 serves the video for an in-page <video> preview
+    return send_output(
         file_path,
-        as_attachment=True,
-        download_name=job['results']['edited_video'],
-        mimetype="video/mp4"
+        "video/mp4",
+        download_name=file_name,
+        as_attachment=request.args.get('inline') != '1'
     )
@@ -0,0 +1,183 @@
+import os
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from modules.media_runner import run_media
+
+# Beat analysis in a long-lived, pre-warmed process pool.
+#
+# Importing librosa and JIT-compiling its numba kernels takes seconds, so the
+# worker processes do that once in their initializer and then stay alive.
+# Audio is decoded by ffmpeg straight to mono float32 at a low sample rate,
+# which is all beat tracking needs.  Results (tempo, beat times, onset
+# envelope) are cached by audio content hash, in memory and on disk, so a
+# track that was analyzed before comes back without touching the pool.
+
+ANALYSIS_SAMPLE_RATE = 11025
+HOP_LENGTH = 256
+MEMORY_CACHE_SIZE = 64
+
+
+def _warm_up():
+    """Pool initializer: import librosa and trigger numba compilation"""
+    import librosa
+    y = np.random.default_rng(0).standard_normal(ANALYSIS_SAMPLE_RATE * 2).astype(np.float32)
+    onset_env = librosa.onset.onset_strength(y=y, sr=ANALYSIS_SAMPLE_RATE, hop_length=HOP_LENGTH)
+    librosa.beat.beat_track(onset_envelope=onset_env, sr=ANALYSIS_SAMPLE_RATE, hop_length=HOP_LENGTH)
+
+
+def _ping():
+    """No-op task used to make the pool start its workers"""
+    return True
+
+
+def _decode_mono(audio_path, sample_rate):
+    ffmpeg_decode_cmd = [
+        "ffmpeg",
+        "-v", "error",
+        "-i", audio_path,
+        "-vn",
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-f", "f32le",
+        "-"
+    ]
+    result = run_media(ffmpeg_decode_cmd, text=False)
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def _analyze(audio_path):
+    """Runs in a pool worker: decode and track beats"""
+    import librosa
+    y = _decode_mono(audio_path, ANALYSIS_SAMPLE_RATE)
+    onset_env = librosa.onset.onset_strength(y=y, sr=ANALYSIS_SAMPLE_RATE, hop_length=HOP_LENGTH)
+    tempo, beat_frames = librosa.beat.beat_track(
+        onset_envelope=onset_env, sr=ANALYSIS_SAMPLE_RATE, hop_length=HOP_LENGTH
+    )
+    beat_times = librosa.frames_to_time(beat_frames, sr=ANALYSIS_SAMPLE_RATE, hop_length=HOP_LENGTH)
+    return {
+        "tempo": float(np.atleast_1d(tempo)[0]),
+        "beat_times": beat_times.astype(np.float64),
+        "onset_envelope": onset_env.astype(np.float32),
+        "sample_rate": ANALYSIS_SAMPLE_RATE,
+        "hop_length": HOP_LENGTH
+    }
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BeatAnalyzer:
+    """Cached front end to the warm beat-analysis process pool"""
+
+    def __init__(self, cache_dir=None, max_workers=1):
+        self.cache_dir = cache_dir or os.path.join('uploads', 'music', 'beats')
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+    def init_app(self, app):
+        """Read cache location and pool size from the app config"""
+        self.cache_dir = app.config.get('BEAT_CACHE_DIR') or self.cache_dir
+        self.max_workers = app.config.get('BEAT_WORKERS') or self.max_workers
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def prewarm(self):
+        """Start the workers now so warm-up overlaps with other work"""
+        pool = self._get_pool()
+        # Worker processes are spawned on demand, so give each one a task
+        for _ in range(self.max_workers):
+            pool.submit(_ping)
+
+    def shutdown(self):
+        """Stop the worker processes; the pool is recreated on next use"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _get_pool(self):
+        # Created lazily (after gunicorn forks) with spawn, which is safe
+        # from a multi-threaded parent
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_up
+                )
+            return self._pool
+
+    def _cache_path(self, content_hash):
+        return os.path.join(self.cache_dir, f"{content_hash}.beats.npz")
+
+    def _remember(self, content_hash, result):
+        with self._lock:
+            self._memory[content_hash] = result
+            self._memory.move_to_end(content_hash)
+            while len(self._memory) > MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+
+    def _load(self, content_hash):
+        with self._lock:
+            if content_hash in self._memory:
+                self._memory.move_to_end(content_hash)
+                return self._memory[content_hash]
+        try:
+            with np.load(self._cache_path(content_hash)) as data:
+                result = {
+                    "tempo": float(data["tempo"]),
+                    "beat_times": data["beat_times"],
+                    "onset_envelope": data["onset_envelope"],
+                    "sample_rate": int(data["sample_rate"]),
+                    "hop_length": int(data["hop_length"])
+                }
+        except (OSError, KeyError, ValueError):
+            return None
+        self._remember(content_hash, result)
+        return result
+
+    def _save(self, content_hash, result):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(content_hash)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **result)
+        os.replace(tmp_path, path)
+
+    def analyze(self, audio_path):
+        """Return tempo, beat times and onset envelope for an audio file"""
+        content_hash = file_hash(audio_path)
+        result = self._load(content_hash)
+        if result is not None:
+            logging.info(f"Beat analysis cache hit for {audio_path}")
+            return result
+
+        try:
+            result = self._get_pool().submit(_analyze, audio_path).result()
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool next time
+            with self._lock:
+                self._pool = None
+            raise
+        self._remember(content_hash, result)
+        try:
+            self._save(content_hash, result)
+        except Exception as e:
+            logging.warning(f"Could not cache beat analysis for {audio_path}: {str(e)}")
+        return result
+
+
+# Shared instance used by all blueprints
+beat_analyzer = BeatAnalyzer()
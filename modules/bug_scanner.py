@@ -0,0 +1,450 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+import tarfile
+import zipfile
+from datetime import datetime
+from concurrent.futures import as_completed
+from flask import Blueprint, request, jsonify, current_app
+from werkzeug.utils import secure_filename
+from modules.job_store import job_store
+from modules.job_events import stream_job
+from modules.scheduler import scheduler, SchedulerFullError
+from modules.delivery import send_output
+from modules import metrics
+from modules.media_runner import cancel as cancel_job_processes, check_cancelled, JobCancelled
+from modules.code_analysis import (
+    code_scanner, file_hash, is_scannable, sort_findings, CHUNK_FILES, SEVERITY_ORDER
+)
+
+# Code scanning jobs.
+#
+# An upload (a zip or tar archive, or a single source file) is unpacked
+# under uploads/code/<job id>, and its files are analyzed in chunks on the
+# code scanner's process pool.  Files whose content was analyzed before with
+# the same ruleset come straight from the findings cache.  Findings are
+# appended to results/reports/report_<job id>.jsonl as each chunk finishes,
+# so /findings can page through them while the scan is still running; the
+# sorted summary report is written when the scan completes.
+
+bug_scanner_bp = Blueprint('bug_scanner', __name__, url_prefix='/bug_scanner')
+
+JOB_KIND = 'bug_scan'
+
+FINISHED_STATUSES = {"completed", "error", "cancelled"}
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# Limits on what an archive may unpack to
+MAX_ARCHIVE_MEMBERS = 20000
+MAX_EXTRACTED_BYTES = 500 * 1024 * 1024
+MAX_SCAN_FILE_BYTES = 1024 * 1024
+
+# Directories of vendored or generated code that are never analyzed
+SKIPPED_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".tox", "site-packages"}
+
+FINDINGS_PAGE_SIZE = 200
+
+
+class ArchiveError(Exception):
+    """Raised when an uploaded archive can't be unpacked safely"""
+
+
+def allowed_code_file(filename):
+    """Check if the file is an archive or a source file the scanner analyzes"""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS) or is_scannable(filename)
+
+
+def _safe_target(root, name):
+    # Member names must stay inside the extraction directory
+    target = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([target, os.path.realpath(root)]) != os.path.realpath(root):
+        raise ArchiveError(f"Archive member escapes the archive: {name}")
+    return target
+
+
+def _extract_members(members, root, open_member):
+    # members: (name, size, is_file) tuples; links, devices and the like are skipped
+    total = 0
+    count = 0
+    for name, size, is_file in members:
+        count += 1
+        if count > MAX_ARCHIVE_MEMBERS:
+            raise ArchiveError(f"Archive has more than {MAX_ARCHIVE_MEMBERS} entries")
+        if not is_file:
+            continue
+        total += size
+        if total > MAX_EXTRACTED_BYTES:
+            raise ArchiveError("Archive is too large when unpacked")
+        target = _safe_target(root, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open_member(name) as source, open(target, 'wb') as out:
+            shutil.copyfileobj(source, out)
+
+
+def unpack_upload(upload_path, filename, source_dir):
+    """Unpack an archive (or place a single file) into source_dir"""
+    os.makedirs(source_dir, exist_ok=True)
+    lower = filename.lower()
+    try:
+        if lower.endswith('.zip'):
+            with zipfile.ZipFile(upload_path) as archive:
+                members = (
+                    (info.filename, info.file_size, not info.is_dir())
+                    for info in archive.infolist()
+                )
+                _extract_members(members, source_dir, archive.open)
+        elif lower.endswith(('.tar', '.tar.gz', '.tgz')):
+            with tarfile.open(upload_path) as archive:
+                infos = {info.name: info for info in archive.getmembers()}
+                members = ((info.name, info.size, info.isfile()) for info in infos.values())
+                _extract_members(members, source_dir, lambda name: archive.extractfile(infos[name]))
+        else:
+            shutil.copyfile(upload_path, os.path.join(source_dir, filename))
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ArchiveError(f"Could not read archive: {str(e)}")
+
+
+def collect_files(source_dir):
+    """Relative paths of the files to analyze, and of those skipped as too large"""
+    files, too_large = [], []
+    for directory, subdirs, names in os.walk(source_dir):
+        subdirs[:] = sorted(d for d in subdirs if d not in SKIPPED_DIRS)
+        for name in sorted(names):
+            path = os.path.join(directory, name)
+            if not is_scannable(name) or os.path.islink(path):
+                continue
+            relative = os.path.relpath(path, source_dir)
+            if os.path.getsize(path) > MAX_SCAN_FILE_BYTES:
+                too_large.append(relative)
+            else:
+                files.append(relative)
+    return files, too_large
+
+
+def scan_code(job_id, job_dir, filename, report_dir):
+    """Analyze an uploaded project and stream its findings into the report"""
+    upload_path = os.path.join(job_dir, f"upload_{filename}")
+    source_dir = os.path.join(job_dir, 'src')
+    stream_path = os.path.join(report_dir, f"report_{job_id}.jsonl")
+    report_path = os.path.join(report_dir, f"report_{job_id}.json")
+    pending = {}
+    try:
+        logging.info(f"Starting code scan for job {job_id}")
+        job_store.update(job_id, status="scanning", progress=0, current_step="Unpacking upload...")
+
+        with metrics.stage(job_id, JOB_KIND, "unpack"):
+            unpack_upload(upload_path, filename, source_dir)
+            os.remove(upload_path)
+            files, too_large = collect_files(source_dir)
+
+        ruleset = code_scanner.ruleset()
+        if not any(ruleset["tools"].values()):
+            raise Exception("Neither bandit nor semgrep is installed")
+
+        all_findings = []
+        severity_counts = {severity: 0 for severity in SEVERITY_ORDER}
+        counters = {"files_analyzed": 0, "files_cached": 0}
+        errors = []
+
+        def record(path, findings, out):
+            # Findings of one file go to the report as soon as they are known
+            for finding in findings:
+                finding = {"file": path, **finding}
+                out.write(json.dumps(finding) + "\n")
+                all_findings.append(finding)
+                severity_counts[finding["severity"]] = severity_counts.get(finding["severity"], 0) + 1
+
+        def publish(step):
+            done = counters["files_analyzed"] + counters["files_cached"]
+            job_store.update(
+                job_id,
+                progress=int(100 * done / len(files)) if files else 100,
+                current_step=step,
+                files_done=done,
+                files_cached=counters["files_cached"],
+                findings_count=len(all_findings),
+                severity_counts=dict(severity_counts)
+            )
+
+        job_store.update(
+            job_id,
+            files_total=len(files),
+            files_skipped=too_large,
+            ruleset=ruleset,
+            current_step=f"Analyzing {len(files)} files..."
+        )
+
+        with metrics.stage(job_id, JOB_KIND, "scan"), open(stream_path, 'w', buffering=1) as out:
+            # Unchanged files are answered from the cache before anything runs
+            hashes = {}
+            to_analyze = []
+            for path in files:
+                content_hash = file_hash(os.path.join(source_dir, path))
+                cached = code_scanner.cached_findings(content_hash)
+                if cached is None:
+                    hashes[path] = content_hash
+                    to_analyze.append(path)
+                else:
+                    record(path, cached, out)
+                    counters["files_cached"] += 1
+            publish(f"{counters['files_cached']} files unchanged, analyzing {len(to_analyze)}...")
+
+            for i in range(0, len(to_analyze), CHUNK_FILES):
+                chunk = to_analyze[i:i + CHUNK_FILES]
+                pending[code_scanner.submit(source_dir, chunk)] = chunk
+            for future in as_completed(pending):
+                # Chunks already running finish; the rest never start
+                check_cancelled(job_id)
+                chunk_findings, chunk_errors = future.result()
+                failed = {path for error in chunk_errors for path in error["paths"]}
+                errors.extend({"tool": e["tool"], "error": e["error"], "files": len(e["paths"])} for e in chunk_errors)
+                for path, findings in chunk_findings.items():
+                    record(path, findings, out)
+                    if path in hashes and path not in failed:
+                        code_scanner.cache_findings(hashes[path], findings)
+                counters["files_analyzed"] += len(pending[future])
+                publish(f"Analyzed {counters['files_analyzed']} of {len(to_analyze)} changed files...")
+
+        summary = {
+            "job_id": job_id,
+            "filename": filename,
+            "ruleset": ruleset,
+            "files_total": len(files),
+            "files_analyzed": counters["files_analyzed"],
+            "files_cached": counters["files_cached"],
+            "files_skipped": too_large,
+            "severity_counts": severity_counts,
+            "errors": errors,
+            "findings": sort_findings(all_findings)
+        }
+        tmp_path = report_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_path, report_path)
+
+        job_store.update(
+            job_id,
+            progress=100,
+            status="completed",
+            current_step="Scan completed",
+            results={
+                "report": os.path.basename(report_path),
+                "findings_count": len(all_findings),
+                "severity_counts": severity_counts,
+                "errors": errors
+            }
+        )
+        logging.info(f"Code scan completed for job {job_id}: {len(all_findings)} findings")
+
+    except JobCancelled:
+        logging.info(f"Code scan cancelled for job {job_id}")
+        job_store.update(job_id, status="cancelled", current_step="Job cancelled")
+    except Exception as e:
+        logging.error(f"Error scanning code for job {job_id}: {str(e)}")
+        job_store.update(job_id, status="error", error=str(e))
+    finally:
+        for future in pending:
+            future.cancel()
+        # Only the findings are kept, not the uploaded code
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+@bug_scanner_bp.route('/scan', methods=['POST'])
+def start_scan():
+    try:
+        if 'code' not in request.files:
+            return jsonify({
+                "success": False,
+                "error": "No code file provided"
+            }), 400
+
+        code_file = request.files['code']
+        if code_file.filename == '':
+            return jsonify({
+                "success": False,
+                "error": "No code file selected"
+            }), 400
+
+        filename = secure_filename(code_file.filename)
+        if not allowed_code_file(filename):
+            return jsonify({
+                "success": False,
+                "error": "Upload a .zip or .tar(.gz) archive or a single source file"
+            }), 400
+
+        if scheduler.is_full():
+            return jsonify({
+                "success": False,
+                "error": "Server is busy, please try again later"
+            }), 429
+
+        job_id = str(uuid.uuid4())
+        job_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'code', job_id)
+        report_dir = os.path.join(current_app.config['RESULTS_FOLDER'], 'reports')
+        os.makedirs(job_dir, exist_ok=True)
+        os.makedirs(report_dir, exist_ok=True)
+
+        upload_path = os.path.join(job_dir, f"upload_{filename}")
+        code_file.save(upload_path)
+
+        job_store.create(JOB_KIND, {
+            "id": job_id,
+            "filename": filename,
+            "status": "starting",
+            "progress": 0,
+            "current_step": "Job queued",
+            "start_time": datetime.now().isoformat(),
+            "findings_count": 0,
+            "results": None,
+            "error": None
+        })
+
+        try:
+            position = scheduler.submit(job_id, scan_code, job_dir, filename, report_dir)
+        except SchedulerFullError as e:
+            job_store.update(job_id, status="error", error=str(e))
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 429
+
+        return jsonify({
+            "success": True,
+            "job_id": job_id,
+            "queue_position": position,
+            "message": "Code scan queued"
+        })
+
+    except Exception as e:
+        logging.error(f"Error starting code scan: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Error starting code scan: {str(e)}"
+        }), 500
+
+@bug_scanner_bp.route('/status/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+
+    return jsonify({
+        "success": True,
+        "job": job
+    })
+
+@bug_scanner_bp.route('/events/<job_id>', methods=['GET'])
+def stream_job_status(job_id):
+    if not job_store.exists(job_id, kind=JOB_KIND):
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+
+    return stream_job(job_id, JOB_KIND, until=FINISHED_STATUSES)
+
+@bug_scanner_bp.route('/findings/<job_id>', methods=['GET'])
+def get_findings(job_id):
+    """Findings in the order they were produced; poll with ?offset=next_offset"""
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(FINDINGS_PAGE_SIZE, max(1, int(request.args.get('limit', FINDINGS_PAGE_SIZE))))
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "offset and limit must be integers"
+        }), 400
+
+    findings = []
+    stream_path = os.path.join(current_app.config['RESULTS_FOLDER'], 'reports', f"report_{job_id}.jsonl")
+    try:
+        with open(stream_path, 'r') as f:
+            for i, line in enumerate(f):
+                if i < offset:
+                    continue
+                # A line still being written has no newline yet
+                if len(findings) >= limit or not line.endswith("\n"):
+                    break
+                findings.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+
+    next_offset = offset + len(findings)
+    return jsonify({
+        "success": True,
+        "findings": findings,
+        "next_offset": next_offset,
+        "complete": job["status"] in FINISHED_STATUSES and next_offset >= job.get("findings_count", 0),
+        "status": job["status"]
+    })
+
+@bug_scanner_bp.route('/cancel/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+
+    if job['status'] in FINISHED_STATUSES:
+        return jsonify({
+            "success": False,
+            "error": "Job is not running"
+        }), 400
+
+    # Queued here: drop it; running anywhere: the scan stops after its
+    # current chunk once it sees the flag
+    if scheduler.cancel(job_id):
+        job_store.update(job_id, status="cancelled", queue_position=None, current_step="Job cancelled")
+    else:
+        cancel_job_processes(job_id)
+        job_store.update(job_id, current_step="Cancelling...")
+
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "message": "Job cancellation requested"
+    })
+
+@bug_scanner_bp.route('/report/<job_id>', methods=['GET'])
+def download_report(job_id):
+    job = job_store.get(job_id, kind=JOB_KIND)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+
+    if job['status'] != 'completed' or not job.get('results'):
+        return jsonify({
+            "success": False,
+            "error": "Scan has not completed yet"
+        }), 400
+
+    file_path = os.path.join(current_app.config['RESULTS_FOLDER'], 'reports', job['results']['report'])
+    if not os.path.exists(file_path):
+        return jsonify({
+            "success": False,
+            "error": "File not found"
+        }), 404
+
+    return send_output(
+        file_path,
+        "application/json",
+        download_name=job['results']['report'],
+        as_attachment=request.args.get('inline') != '1'
+    )
@@ -1,8 +1,73 @@
-from flask import Blueprint, request, jsonify
+import json
+import logging
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from modules.chat_engine import chat_engine, ChatError
 
 chat_bp = Blueprint('chat', __name__)
 
+# Replies are streamed as Server-Sent Events over the POST response:
+# {"token": ...} per token, then {"done": true, ...}, or {"error": ...} if
+# the backend fails midway.  Send "stream": false to get one JSON reply.
+
+
+def _event(data):
+    return f"data: {json.dumps(data)}\n\n"
+
+
 @chat_bp.route("/chat", methods=["POST"])
 def chat_route():
-    user_input = request.json.get("message", "")
-    return jsonify({"response": f"You said: {user_input}"})
\ No newline at end of file
+    data = request.get_json(silent=True) or {}
+    user_input = data.get("message", "")
+    conversation_id = data.get("conversation_id")
+    try:
+        chat_engine.validate(user_input, conversation_id)
+    except ChatError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    conversation_id = conversation_id or chat_engine.new_conversation_id()
+
+    if data.get("stream") is False:
+        tokens = []
+        cached = False
+        try:
+            for kind, value in chat_engine.stream_reply(conversation_id, user_input):
+                if kind == "token":
+                    tokens.append(value)
+                else:
+                    cached = value["cached"]
+        except ChatError as e:
+            return jsonify({"success": False, "error": str(e)}), 502
+        return jsonify({
+            "success": True,
+            "response": "".join(tokens),
+            "conversation_id": conversation_id,
+            "cached": cached
+        })
+
+    def generate():
+        try:
+            for kind, value in chat_engine.stream_reply(conversation_id, user_input):
+                if kind == "token":
+                    yield _event({"token": value})
+                else:
+                    yield _event({"done": True, "conversation_id": conversation_id, **value})
+        except ChatError as e:
+            yield _event({"error": str(e)})
+        except Exception as e:
+            logging.error(f"Error streaming chat reply: {str(e)}")
+            yield _event({"error": "Internal error"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Conversation-Id": conversation_id
+        }
+    )
+
+
+@chat_bp.route("/chat/<conversation_id>", methods=["DELETE"])
+def clear_conversation(conversation_id):
+    chat_engine.clear(conversation_id)
+    return jsonify({"success": True, "conversation_id": conversation_id})
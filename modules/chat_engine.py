@@ -0,0 +1,280 @@
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from modules.job_store import job_store
+from modules import metrics
+
+# Chat engine: pluggable model backends, conversation history and a
+# response cache.
+#
+# A backend turns a list of {"role", "content"} messages into a stream of
+# text tokens.  "openai" talks to the OpenAI API (OPENAI_API_KEY); "local" is
+# an offline stand-in that streams a canned reply word by word, so the whole
+# path runs without network access.  Conversations live in a table in the
+# job store's SQLite database, so a follow-up message may land on any
+# gunicorn worker; each keeps only its most recent messages, and the least
+# recently active conversations are dropped beyond a fixed count.  Completed
+# replies are kept in an in-memory LRU keyed on the backend and the exact
+# messages sent, so an identical prompt is answered without a model call.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_conversations (
+    id TEXT PRIMARY KEY,
+    messages TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_conversations_updated ON chat_conversations (updated_at);
+"""
+
+ROLES = {"user", "assistant"}
+
+_schema_ready = threading.local()
+
+
+class ChatError(Exception):
+    """Raised when a chat request is invalid or a backend fails"""
+
+
+class ChatBackend:
+    """Interface of a model backend"""
+
+    name = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Build the backend from the app config"""
+        return cls()
+
+    def cache_key(self):
+        """What besides the messages determines a reply (e.g. the model)"""
+        return self.name
+
+    def stream(self, messages):
+        """Yield the reply to `messages` as text tokens"""
+        raise NotImplementedError
+
+
+class LocalBackend(ChatBackend):
+    """Offline stand-in: streams "You said: <last message>" word by word"""
+
+    name = "local"
+
+    def __init__(self, token_delay=0.0):
+        self.token_delay = token_delay
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(token_delay=config.get('CHAT_LOCAL_TOKEN_DELAY') or 0.0)
+
+    def stream(self, messages):
+        prompt = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        words = f"You said: {prompt}".split(" ")
+        for index, word in enumerate(words):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield word if index == 0 else f" {word}"
+
+
+class OpenAIBackend(ChatBackend):
+    """Chat completions from the OpenAI API, streamed"""
+
+    name = "openai"
+
+    def __init__(self, model, api_key=None, timeout=60):
+        try:
+            from openai import OpenAI
+        except ImportError:
+            raise ChatError("The openai package is not installed")
+        self.model = model
+        self.client = OpenAI(api_key=api_key, timeout=timeout)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get('CHAT_MODEL') or "gpt-4o-mini",
+            api_key=config.get('OPENAI_API_KEY'),
+            timeout=config.get('CHAT_TIMEOUT') or 60
+        )
+
+    def cache_key(self):
+        return f"{self.name}:{self.model}"
+
+    def stream(self, messages):
+        response = self.client.chat.completions.create(model=self.model, messages=messages, stream=True)
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Stops generation when the client goes away mid-reply
+            response.close()
+
+
+# name -> backend class; add entries to plug in other backends
+BACKENDS = {
+    LocalBackend.name: LocalBackend,
+    OpenAIBackend.name: OpenAIBackend
+}
+
+
+class ChatEngine:
+    """Streams replies from the configured backend with history and caching"""
+
+    def __init__(self, history_messages=20, max_conversations=1000, cache_size=256, max_message_chars=8000):
+        self.history_messages = history_messages
+        self.max_conversations = max_conversations
+        self.cache_size = cache_size
+        self.max_message_chars = max_message_chars
+        self.system_prompt = None
+        self.backend_name = LocalBackend.name
+        self._config = {}
+        self._backend = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def init_app(self, app):
+        """Read the backend choice and history/cache bounds from the app config"""
+        self.history_messages = app.config.get('CHAT_HISTORY_MESSAGES') or self.history_messages
+        self.max_conversations = app.config.get('CHAT_MAX_CONVERSATIONS') or self.max_conversations
+        self.cache_size = app.config.get('CHAT_CACHE_SIZE', self.cache_size)
+        self.max_message_chars = app.config.get('CHAT_MAX_MESSAGE_CHARS') or self.max_message_chars
+        self.system_prompt = app.config.get('CHAT_SYSTEM_PROMPT') or None
+        self.backend_name = app.config.get('CHAT_BACKEND') or LocalBackend.name
+        if self.backend_name not in BACKENDS:
+            raise ValueError(f"Unknown chat backend '{self.backend_name}' (expected one of: {', '.join(BACKENDS)})")
+        self._config = app.config
+        with self._lock:
+            self._backend = None
+            self._cache.clear()
+
+    def backend(self):
+        """The configured backend, created on first use"""
+        with self._lock:
+            if self._backend is None:
+                self._backend = BACKENDS[self.backend_name].from_config(self._config)
+            return self._backend
+
+    def _conn(self):
+        conn = job_store.connection()
+        if getattr(_schema_ready, 'conn', None) is not conn:
+            conn.executescript(SCHEMA)
+            _schema_ready.conn = conn
+        return conn
+
+    def history(self, conversation_id):
+        """Stored messages of a conversation, oldest first"""
+        row = self._conn().execute(
+            "SELECT messages FROM chat_conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _append(self, conversation_id, new_messages):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT messages FROM chat_conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            messages = (json.loads(row[0]) if row else []) + new_messages
+            conn.execute(
+                "INSERT INTO chat_conversations (id, messages, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET messages = excluded.messages, updated_at = excluded.updated_at",
+                (conversation_id, json.dumps(messages[-self.history_messages:]), time.time())
+            )
+            conn.execute(
+                "DELETE FROM chat_conversations WHERE id IN ("
+                "SELECT id FROM chat_conversations ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_conversations,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self, conversation_id):
+        """Forget a conversation"""
+        self._conn().execute("DELETE FROM chat_conversations WHERE id = ?", (conversation_id,))
+
+    def _cache_key(self, backend, messages):
+        payload = json.dumps([backend.cache_key(), messages], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _remember(self, key, reply):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = reply
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def new_conversation_id(self):
+        return str(uuid.uuid4())
+
+    def validate(self, message, conversation_id=None):
+        """Check a request's message and conversation id; raises ChatError"""
+        if not isinstance(message, str) or not message.strip():
+            raise ChatError("Message is required")
+        if len(message) > self.max_message_chars:
+            raise ChatError(f"Message is too long (at most {self.max_message_chars} characters)")
+        if conversation_id is not None:
+            try:
+                uuid.UUID(str(conversation_id))
+            except ValueError:
+                raise ChatError("Invalid conversation id")
+
+    def stream_reply(self, conversation_id, message):
+        """Yield ("token", text) pairs, then ("done", {"cached": bool}).
+
+        The exchange is added to the conversation only once the reply is
+        complete; a reply interrupted by an error or a disconnect is
+        neither stored nor cached.
+        """
+        backend = self.backend()
+        messages = [{"role": m["role"], "content": m["content"]}
+                    for m in self.history(conversation_id) if m.get("role") in ROLES]
+        messages.append({"role": "user", "content": message})
+        if self.system_prompt:
+            messages.insert(0, {"role": "system", "content": self.system_prompt})
+
+        key = self._cache_key(backend, messages)
+        reply = self._cached(key)
+        cached = reply is not None
+        if cached:
+            yield "token", reply
+        else:
+            tokens = []
+            started = time.monotonic()
+            try:
+                for token in backend.stream(messages):
+                    if not tokens:
+                        metrics.observe("chat_first_token_seconds", time.monotonic() - started,
+                                        backend=backend.name)
+                    tokens.append(token)
+                    yield "token", token
+            except Exception as e:
+                logging.error(f"Chat backend {backend.name} failed: {str(e)}")
+                raise ChatError("The chat backend failed to respond")
+            reply = "".join(tokens)
+            self._remember(key, reply)
+
+        self._append(conversation_id, [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": reply}
+        ])
+        yield "done", {"cached": cached}
+
+
+# Shared instance used by the chat routes
+chat_engine = ChatEngine()
@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import uuid
+import fcntl
+import hashlib
+import logging
+import threading
+from flask import Blueprint, request, jsonify, current_app
+from werkzeug.utils import secure_filename
+from modules.content_cache import store_file
+
+# Resumable, offset-addressed chunked uploads.
+#
+# A client creates an upload with the file's name and size, then PUTs raw
+# chunks to /upload/<upload_id>?offset=N in any order.  Each chunk is written
+# in place into a preallocated ".part" file straight from the request
+# stream, and the received byte ranges are recorded in a sidecar JSON file,
+# so a dropped connection only costs the missing ranges.  The SHA-256 is
+# computed incrementally while chunks arrive in order; if they don't (or a
+# chunk lands on another worker), the file is hashed once on completion.
+
+chunked_upload_bp = Blueprint('chunked_upload', __name__, url_prefix='/upload')
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Incremental hash state per upload, only valid in the process that owns it
+_hash_states = {}
+_hash_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Raised when an upload is unknown, incomplete or invalid"""
+
+
+def partial_dir():
+    """Directory holding in-progress uploads"""
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'videos', 'partial')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _paths(upload_id):
+    if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+        raise UploadError("Invalid upload ID")
+    base = os.path.join(partial_dir(), upload_id)
+    return base + ".part", base + ".json"
+
+
+def merge_range(ranges, start, end):
+    """Add [start, end) to a sorted list of disjoint ranges"""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def missing_ranges(ranges, size):
+    """Byte ranges of [0, size) not covered by `ranges`"""
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise UploadError("Upload not found")
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _status(upload_id, meta):
+    missing = missing_ranges(meta["ranges"], meta["size"])
+    return {
+        "upload_id": upload_id,
+        "filename": meta["filename"],
+        "size": meta["size"],
+        "received": sum(end - start for start, end in meta["ranges"]),
+        "received_ranges": meta["ranges"],
+        "missing_ranges": missing,
+        "complete": not missing,
+        "chunk_size": current_app.config['MAX_CONTENT_LENGTH_CHUNK']
+    }
+
+
+def finalize_upload(upload_id, upload_dir):
+    """Move a completed upload to its content-addressed path.
+
+    Returns (video_path, content_hash, reused, filename).
+    """
+    part_path, meta_path = _paths(upload_id)
+    with open(meta_path + ".lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        meta = _read_meta(meta_path)
+        if missing_ranges(meta["ranges"], meta["size"]):
+            raise UploadError("Upload is not complete")
+
+        with _hash_lock:
+            state = _hash_states.pop(upload_id, None)
+        if state is not None and state["offset"] == meta["size"]:
+            content_hash = state["digest"].hexdigest()
+        else:
+            digest = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            content_hash = digest.hexdigest()
+
+        ext = meta["filename"].rsplit('.', 1)[1].lower()
+        video_path, content_hash, reused = store_file(part_path, upload_dir, content_hash, ext)
+        os.remove(meta_path)
+    os.remove(meta_path + ".lock")
+    return video_path, content_hash, reused, meta["filename"]
+
+
+@chunked_upload_bp.route('', methods=['POST'])
+def create_upload():
+    data = request.json or {}
+    filename = secure_filename(data.get('filename') or '')
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+
+    if not filename or '.' not in filename or \
+            filename.rsplit('.', 1)[1].lower() not in {'mp4', 'mkv', 'avi'}:
+        return jsonify({
+            "success": False,
+            "error": "Only MP4, MKV, and AVI video files are allowed"
+        }), 400
+
+    if size <= 0:
+        return jsonify({
+            "success": False,
+            "error": "File size is required"
+        }), 400
+
+    if size > current_app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({
+            "success": False,
+            "error": "File size exceeds the maximum limit of 500MB"
+        }), 413
+
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = _paths(upload_id)
+    # Preallocate so chunks can be written at their offsets in any order
+    with open(part_path, 'wb') as f:
+        f.truncate(size)
+    meta = {"filename": filename, "size": size, "ranges": []}
+    _write_meta(meta_path, meta)
+
+    return jsonify({"success": True, **_status(upload_id, meta)})
+
+
+@chunked_upload_bp.route('/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    try:
+        _, meta_path = _paths(upload_id)
+        meta = _read_meta(meta_path)
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+    return jsonify({"success": True, **_status(upload_id, meta)})
+
+
+@chunked_upload_bp.route('/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    try:
+        part_path, meta_path = _paths(upload_id)
+        meta = _read_meta(meta_path)
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({"success": False, "error": "Chunk offset is required"}), 400
+
+    length = request.content_length or 0
+    chunk_limit = current_app.config['MAX_CONTENT_LENGTH_CHUNK']
+    if offset < 0 or length <= 0 or length > chunk_limit or offset + length > meta["size"]:
+        return jsonify({"success": False, "error": "Invalid chunk range"}), 416
+
+    # Write straight from the request stream into place, hashing as we go
+    # when this chunk continues the in-order prefix
+    with _hash_lock:
+        state = _hash_states.get(upload_id)
+        if state is None and offset == 0:
+            state = _hash_states[upload_id] = {"digest": hashlib.sha256(), "offset": 0}
+        in_order = state is not None and state["offset"] == offset and not state.get("busy")
+        if in_order:
+            state["busy"] = True
+
+    written = 0
+    fd = os.open(part_path, os.O_WRONLY)
+    try:
+        while written < length:
+            data = request.stream.read(min(64 * 1024, length - written))
+            if not data:
+                break
+            os.pwrite(fd, data, offset + written)
+            if in_order:
+                state["digest"].update(data)
+            written += len(data)
+    finally:
+        os.close(fd)
+        if in_order:
+            with _hash_lock:
+                state["offset"] = offset + written
+                state["busy"] = False
+
+    if written != length:
+        if in_order:
+            # The hash now covers a partial chunk; fall back to hashing on completion
+            with _hash_lock:
+                _hash_states.pop(upload_id, None)
+        logging.warning(f"Upload {upload_id}: chunk at {offset} truncated ({written}/{length} bytes)")
+        return jsonify({"success": False, "error": "Chunk was truncated"}), 400
+
+    with open(meta_path + ".lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        meta = _read_meta(meta_path)
+        meta["ranges"] = merge_range(meta["ranges"], offset, offset + written)
+        _write_meta(meta_path, meta)
+
+    return jsonify({"success": True, **_status(upload_id, meta)})
@@ -0,0 +1,250 @@
+import os
+import json
+import hashlib
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Static analysis of source files with bandit and semgrep.
+#
+# Files are analyzed in chunks on a process pool: each task runs bandit (on
+# the chunk's Python files) and semgrep over the chunk and returns findings
+# normalized to one shape, per file.  Findings are cached per file, keyed by
+# the file's content hash and the ruleset version (tool versions, semgrep
+# config and our own normalization revision), so re-scanning an updated
+# project only analyzes the files that changed.  A tool that isn't installed
+# is skipped and recorded; its absence is part of the ruleset version, so
+# cached results never hide findings of a tool installed later.
+
+# Bump when the normalized finding format changes
+RULESET_REVISION = 1
+
+CHUNK_FILES = 32
+TOOL_TIMEOUT = 600
+
+# Extensions analyzed by each tool
+PYTHON_EXTENSIONS = {".py"}
+SEMGREP_EXTENSIONS = {
+    ".py", ".js", ".jsx", ".mjs", ".ts", ".tsx", ".java", ".kt", ".scala", ".go", ".rb", ".php",
+    ".c", ".h", ".cc", ".cpp", ".hpp", ".cs", ".rs", ".swift", ".sh", ".tf", ".yaml", ".yml"
+}
+
+SEVERITY_ORDER = {"high": 0, "medium": 1, "low": 2}
+SEMGREP_SEVERITIES = {"ERROR": "high", "WARNING": "medium", "INFO": "low"}
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_scannable(path):
+    """Whether any of the tools analyzes this kind of file"""
+    return os.path.splitext(path)[1].lower() in SEMGREP_EXTENSIONS | PYTHON_EXTENSIONS
+
+
+def tool_version(tool):
+    """First line of `<tool> --version`, or None if the tool isn't available"""
+    try:
+        result = subprocess.run([tool, "--version"], capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    lines = (result.stdout or result.stderr).strip().splitlines()
+    return lines[0].strip() if lines else "unknown"
+
+
+def _cwe(value):
+    if isinstance(value, dict):
+        value = value.get("id")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return str(value) if value else None
+
+
+def _run_tool(cmd, root):
+    # bandit exits 1 when it finds issues, so success is judged by the output
+    result = subprocess.run(cmd, cwd=root, capture_output=True, text=True, timeout=TOOL_TIMEOUT)
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        raise RuntimeError(f"{cmd[0]} exited with status {result.returncode}: {result.stderr.strip()[-500:]}")
+
+
+def _bandit(root, paths):
+    # "./" keeps file names starting with "-" from being read as options
+    output = _run_tool(["bandit", "-f", "json", "-q", *(os.path.join(".", p) for p in paths)], root)
+    for issue in output.get("results", []):
+        yield os.path.normpath(issue["filename"]), {
+            "tool": "bandit",
+            "rule": f"{issue.get('test_id')} {issue.get('test_name')}".strip(),
+            "severity": (issue.get("issue_severity") or "low").lower(),
+            "confidence": (issue.get("issue_confidence") or "").lower() or None,
+            "line": issue.get("line_number"),
+            "end_line": max(issue.get("line_range") or [issue.get("line_number")]),
+            "message": issue.get("issue_text"),
+            "cwe": _cwe(issue.get("issue_cwe")),
+            "more_info": issue.get("more_info")
+        }
+
+
+def _semgrep(root, paths, config):
+    output = _run_tool(
+        # One process per task: the pool already spreads chunks over the cores
+        ["semgrep", "scan", "--config", config, "--json", "--quiet", "--metrics", "off", "--jobs", "1",
+         "--", *paths], root
+    )
+    for result in output.get("results", []):
+        extra = result.get("extra") or {}
+        metadata = extra.get("metadata") or {}
+        yield os.path.normpath(result["path"]), {
+            "tool": "semgrep",
+            "rule": result.get("check_id"),
+            "severity": SEMGREP_SEVERITIES.get(extra.get("severity"), "low"),
+            "confidence": (metadata.get("confidence") or "").lower() or None,
+            "line": (result.get("start") or {}).get("line"),
+            "end_line": (result.get("end") or {}).get("line"),
+            "message": extra.get("message"),
+            "cwe": _cwe(metadata.get("cwe")),
+            "more_info": metadata.get("source")
+        }
+
+
+def scan_chunk(root, paths, tools, semgrep_config):
+    """Runs in a pool worker: analyze files (relative to root) with the available tools.
+
+    Returns ({path: [finding, ...]}, [error, ...]); paths listed in an error
+    were not fully analyzed and must not be cached.
+    """
+    findings = {path: [] for path in paths}
+    errors = []
+    runs = []
+    if "bandit" in tools:
+        runs.append(("bandit", [p for p in paths if os.path.splitext(p)[1].lower() in PYTHON_EXTENSIONS],
+                     lambda chunk: _bandit(root, chunk)))
+    if "semgrep" in tools:
+        runs.append(("semgrep", [p for p in paths if os.path.splitext(p)[1].lower() in SEMGREP_EXTENSIONS],
+                     lambda chunk: _semgrep(root, chunk, semgrep_config)))
+
+    for tool, chunk, run in runs:
+        if not chunk:
+            continue
+        try:
+            for path, finding in run(chunk):
+                findings.setdefault(path, []).append(finding)
+        except Exception as e:
+            errors.append({"tool": tool, "paths": chunk, "error": str(e)})
+    return findings, errors
+
+
+def default_pool_size():
+    """Analysis processes per web worker: its share of the cores"""
+    cores = os.cpu_count() or 1
+    workers = int(os.environ.get('WEB_CONCURRENCY', 1)) or 1
+    return max(1, cores // workers)
+
+
+def sort_findings(findings):
+    """Most severe first, then by file and line"""
+    return sorted(findings, key=lambda f: (SEVERITY_ORDER.get(f["severity"], 3), f["file"], f["line"] or 0))
+
+
+class CodeScanner:
+    """Findings cache and process pool for the bug scanner"""
+
+    def __init__(self, cache_dir=None, max_workers=None, semgrep_config=None):
+        self.cache_dir = cache_dir or os.path.join('uploads', 'code', 'findings')
+        self.max_workers = max_workers or default_pool_size()
+        self.semgrep_config = semgrep_config or "p/default"
+        self._pool = None
+        self._lock = threading.Lock()
+        self._ruleset = None
+
+    def init_app(self, app):
+        """Read cache location, pool size and semgrep rules from the app config"""
+        self.cache_dir = app.config.get('BUG_SCAN_CACHE_DIR') or self.cache_dir
+        self.max_workers = app.config.get('BUG_SCAN_WORKERS') or self.max_workers
+        self.semgrep_config = app.config.get('BUG_SCAN_SEMGREP_CONFIG') or self.semgrep_config
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def ruleset(self):
+        """Available tools and the ruleset version findings are cached under"""
+        if self._ruleset is None:
+            tools = {tool: tool_version(tool) for tool in ("bandit", "semgrep")}
+            version = json.dumps({
+                "revision": RULESET_REVISION,
+                "tools": tools,
+                "semgrep_config": self.semgrep_config if tools["semgrep"] else None
+            }, sort_keys=True)
+            self._ruleset = {
+                "tools": tools,
+                "version": hashlib.sha256(version.encode("utf-8")).hexdigest()[:16]
+            }
+        return self._ruleset
+
+    def _get_pool(self):
+        # Created lazily (after gunicorn forks) with spawn, which is safe
+        # from a multi-threaded parent
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def shutdown(self):
+        """Stop the worker processes; the pool is recreated on next use"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, root, paths):
+        """Analyze a chunk of files on the pool; returns a future of scan_chunk's result"""
+        tools = [tool for tool, version in self.ruleset()["tools"].items() if version]
+        try:
+            return self._get_pool().submit(scan_chunk, root, paths, tools, self.semgrep_config)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool
+            with self._lock:
+                self._pool = None
+            return self._get_pool().submit(scan_chunk, root, paths, tools, self.semgrep_config)
+
+    def _cache_path(self, content_hash):
+        return os.path.join(self.cache_dir, f"{content_hash}.{self.ruleset()['version']}.json")
+
+    def cached_findings(self, content_hash):
+        """Cached findings (without file names) for this content, or None"""
+        path = self._cache_path(content_hash)
+        try:
+            with open(path, 'r') as f:
+                findings = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Mark as recently used for retention
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return findings
+
+    def cache_findings(self, content_hash, findings):
+        """Store a file's findings (without file names) for its content"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(content_hash)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(findings, f)
+        os.replace(tmp_path, path)
+
+
+# Shared instance used by the bug scanner
+code_scanner = CodeScanner()
@@ -0,0 +1,164 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+
+# Content-addressed storage for uploads and their analysis results.
+#
+# Uploads are hashed while they are written to disk and stored as
+# "<sha256>.<ext>", so re-uploading an episode reuses the existing file.
+# Everything derived from the video (keyframe index, scene score curve,
+# thumbnails) is stored next to it and therefore shared by every job that
+# uploads the same content.
+
+HASH_ALGORITHM = "sha256"
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def save_upload(file_storage, upload_dir, filename, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream an uploaded file to disk while hashing it.
+
+    Returns (video_path, content_hash, reused) where `reused` is True if a
+    file with the same content was already stored.
+    """
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'bin'
+    digest = hashlib.new(HASH_ALGORITHM)
+
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, prefix=".upload_", suffix=f".{ext}")
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        content_hash = digest.hexdigest()
+        return store_file(tmp_path, upload_dir, content_hash, ext)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def used_marker_path_for(video_path):
+    """Path of the marker whose mtime records an upload's last reuse"""
+    return video_path + ".used"
+
+
+def mark_used(video_path):
+    """Record that stored content was used again.
+
+    The upload itself is left alone: its mtime is part of the keyframe
+    index's validity check.  The marker sits in the upload's retention
+    group, so the group counts as recently used.
+    """
+    with open(used_marker_path_for(video_path), 'a'):
+        pass
+    os.utime(used_marker_path_for(video_path))
+
+
+def store_file(tmp_path, upload_dir, content_hash, ext):
+    """Move a fully written file to its content-addressed path"""
+    video_path = os.path.join(upload_dir, f"{content_hash}.{ext}")
+    if os.path.exists(video_path):
+        os.remove(tmp_path)
+        mark_used(video_path)
+        logging.info(f"Upload {content_hash} already stored, reusing {video_path}")
+        return video_path, content_hash, True
+    os.replace(tmp_path, video_path)
+    return video_path, content_hash, False
+
+
+def scores_path_for(video_path):
+    """Path of the cached content-score curve for an upload"""
+    return video_path + ".scores.npz"
+
+
+def load_scores(video_path, downscale_width, frame_skip):
+    """Return the cached score curve for these analysis settings, or None"""
+    path = scores_path_for(video_path)
+    try:
+        with np.load(path) as data:
+            if int(data["downscale_width"]) != downscale_width or int(data["frame_skip"]) != frame_skip:
+                return None
+            return {
+                "frame_times": data["frame_times"],
+                "scores": data["scores"],
+                "duration": float(data["duration"]),
+                "fps": float(data["fps"])
+            }
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_scores(video_path, detection, downscale_width, frame_skip):
+    """Cache a detection's score curve next to the upload"""
+    path = scores_path_for(video_path)
+    tmp_path = path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        frame_times=detection["frame_times"],
+        scores=detection["scores"],
+        duration=detection["duration"],
+        fps=detection["fps"],
+        downscale_width=downscale_width,
+        frame_skip=frame_skip
+    )
+    os.replace(tmp_path, path)
+
+
+def highlights_path_for(video_path):
+    """Path of the cached per-second highlight features for an upload"""
+    return video_path + ".highlights.npz"
+
+
+def load_highlight_features(video_path, settings):
+    """Return the cached per-second features for these analysis settings, or None"""
+    try:
+        with np.load(highlights_path_for(video_path)) as data:
+            if any(float(data[key]) != value for key, value in settings.items()):
+                return None
+            return {
+                "motion": data["motion"],
+                "cuts": data["cuts"],
+                "loudness": data["loudness"],
+                "duration": float(data["duration"])
+            }
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_highlight_features(video_path, features, settings):
+    """Cache an upload's per-second highlight features next to it"""
+    path = highlights_path_for(video_path)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **features, **settings)
+    os.replace(tmp_path, path)
+
+
+def thumbnail_cache_dir(video_path):
+    """Directory holding cached thumbnails for an upload"""
+    return video_path + ".thumbs"
+
+
+def cached_thumbnail_path(video_path, time):
+    """Cached thumbnail path for a timestamp (millisecond resolution)"""
+    return os.path.join(thumbnail_cache_dir(video_path), f"{int(round(time * 1000))}.jpg")
+
+
+def link_file(source, destination):
+    """Hard-link source to destination, copying if linking isn't possible"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def proxy_path_for(video_path):
+    """Path of the low-resolution preview proxy for an upload"""
+    return video_path + ".proxy.mp4"
@@ -0,0 +1,64 @@
+import os
+from urllib.parse import quote
+from flask import current_app, send_file
+
+# Delivery of finished outputs (AMVs, edited videos, scene thumbnails).
+#
+# An output never changes once its job has written it, so it is served with
+# a year-long immutable Cache-Control plus an ETag, and conditional and Range
+# requests are answered with 304 / 206, which lets a <video> tag seek without
+# downloading the whole file.  With MEDIA_OFFLOAD set, Python only names the
+# file and the front proxy streams the bytes:
+#   "x-accel"    nginx, via an internal location (MEDIA_OFFLOAD_PREFIX)
+#                that maps onto RESULTS_FOLDER
+#   "x-sendfile" Apache mod_xsendfile / lighttpd, via the absolute path
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _cache_forever(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def _offload(path, mimetype, download_name, as_attachment):
+    mode = current_app.config.get('MEDIA_OFFLOAD')
+    if mode == 'x-accel':
+        results_root = os.path.abspath(current_app.config['RESULTS_FOLDER'])
+        relative = os.path.relpath(os.path.abspath(path), results_root)
+        if relative.startswith(os.pardir):
+            return None
+        prefix = current_app.config['MEDIA_OFFLOAD_PREFIX'].rstrip('/')
+        header, value = 'X-Accel-Redirect', f"{prefix}/{quote(relative)}"
+    elif mode == 'x-sendfile':
+        header, value = 'X-Sendfile', os.path.abspath(path)
+    else:
+        return None
+
+    response = current_app.response_class(mimetype=mimetype)
+    response.headers[header] = value
+    if download_name:
+        response.headers.set(
+            'Content-Disposition', 'attachment' if as_attachment else 'inline', filename=download_name
+        )
+    return _cache_forever(response)
+
+
+def send_output(path, mimetype, download_name=None, as_attachment=False):
+    """Serve a finished output file with immutable caching, ETag and Range support"""
+    response = _offload(path, mimetype, download_name, as_attachment)
+    if response is not None:
+        return response
+
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        etag=True,
+        max_age=IMMUTABLE_MAX_AGE
+    )
+    return _cache_forever(response)
@@ -0,0 +1,72 @@
+# Named encoder settings that jobs are rendered with.
+#
+# "draft" is for checking an arrangement: x264's ultrafast preset at reduced
+# height with a capped bitrate, so a timeline re-renders in a fraction of the
+# time.  "final" is the delivery render: constant quality with the animation
+# tuning at full resolution, threaded to the job's budget.  The profile is
+# recorded on the job, so a draft timeline can later be promoted to final.
+
+DEFAULT_PROFILE = "final"
+
+PROFILES = {
+    "draft": {
+        "preset": "ultrafast",
+        "crf": 28,
+        "tune": None,
+        "max_height": 480,
+        "maxrate": "1500k",
+        "bufsize": "3000k",
+        "audio_bitrate": "96k"
+    },
+    "final": {
+        "preset": "medium",
+        "crf": 18,
+        "tune": "animation",
+        "max_height": None,
+        "maxrate": None,
+        "bufsize": None,
+        "audio_bitrate": "192k"
+    }
+}
+
+
+def resolve_profile(name):
+    """Validate a profile name from a request; empty means the default"""
+    name = (name or DEFAULT_PROFILE).strip().lower()
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encoding profile '{name}' (expected one of: {', '.join(PROFILES)})")
+    return name
+
+
+def rate_control_args(name):
+    """libx264 preset, quality and rate options of the profile"""
+    profile = PROFILES[name]
+    args = ["-preset", profile["preset"], "-crf", str(profile["crf"])]
+    if profile["tune"]:
+        args += ["-tune", profile["tune"]]
+    if profile["maxrate"]:
+        args += ["-maxrate", profile["maxrate"], "-bufsize", profile["bufsize"]]
+    return args
+
+
+def video_args(name, threads=None):
+    """ffmpeg output options for the profile's video encode"""
+    profile = PROFILES[name]
+    args = ["-c:v", "libx264", *rate_control_args(name)]
+    if profile["max_height"]:
+        # Scale down only; sources already smaller keep their size
+        args += ["-vf", f"scale=-2:'min({profile['max_height']},ih)'"]
+    args += ["-pix_fmt", "yuv420p"]
+    if threads:
+        args += ["-threads", str(threads)]
+    return args
+
+
+def audio_args(name):
+    """ffmpeg output options for the profile's audio encode"""
+    return ["-c:a", "aac", "-b:a", PROFILES[name]["audio_bitrate"]]
+
+
+def allows_stream_copy(name):
+    """Whether untouched source video may be copied as-is (smart render)"""
+    return PROFILES[name]["max_height"] is None
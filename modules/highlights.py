@@ -0,0 +1,223 @@
+import json
+import logging
+import subprocess
+import cv2
+import numpy as np
+from modules.media_runner import run_media, open_media
+from modules.content_cache import load_highlight_features, save_highlight_features
+
+# Highlight scoring for picking the AMV windows.
+#
+# One fast pass over the episode yields three per-second curves: motion
+# energy (mean frame-to-frame luma change), cut density (hard cuts, by the
+# scene detector's HSV content score) and audio loudness (RMS in dB).
+# ffmpeg's decoder skips loop filtering and non-reference frames, and its
+# fps/scale filters reduce the video to a few tiny frames per second before
+# they reach Python, so analysis takes a small fraction of the runtime.  The
+# curves are normalized, weighted into one score per second, and the best
+# windows are found with a sliding-window sum.  The features are cached per
+# upload, so a second AMV from the same episode skips the pass.
+
+ANALYSIS_FPS = 4
+ANALYSIS_WIDTH = 96
+AUDIO_SAMPLE_RATE = 4000
+
+# Content score (0-255 HSV difference) above which a frame counts as a cut
+CUT_THRESHOLD = 30
+
+WEIGHTS = {"motion": 0.45, "cuts": 0.30, "loudness": 0.25}
+
+# Openings and endings are loud and busy but the same every episode, so
+# windows keep clear of the edges when the episode is long enough
+EDGE_MARGIN = 90
+
+# Loudness below this is treated as silence
+SILENCE_DB = -60.0
+
+ANALYSIS_SETTINGS = {"analysis_fps": ANALYSIS_FPS, "analysis_width": ANALYSIS_WIDTH, "cut_threshold": CUT_THRESHOLD}
+
+
+def _probe(video_path):
+    ffprobe_cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "stream=codec_type,width,height:format=duration",
+        "-of", "json",
+        video_path
+    ]
+    info = json.loads(run_media(ffprobe_cmd).stdout)
+    streams = info.get("streams") or []
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    has_audio = any(s.get("codec_type") == "audio" for s in streams)
+    duration = float((info.get("format") or {}).get("duration") or 0)
+    return int(video.get("width") or 0), int(video.get("height") or 0), duration, has_audio
+
+
+def _per_second(values, times, seconds, reduce):
+    out = np.zeros(seconds, dtype=np.float32)
+    if len(values):
+        index = np.minimum(times.astype(np.int64), seconds - 1)
+        reduce.at(out, index, values)
+    return out
+
+
+def _video_features(video_path, width, height, seconds, job_id, progress_callback):
+    analysis_height = max(2, round(height * ANALYSIS_WIDTH / width / 2) * 2)
+    frame_bytes = ANALYSIS_WIDTH * analysis_height * 3
+    ffmpeg_frames_cmd = [
+        "ffmpeg",
+        "-skip_loop_filter", "all",
+        "-skip_frame", "nonref",
+        "-noautorotate",
+        "-i", video_path,
+        "-an", "-sn",
+        "-vf", f"fps={ANALYSIS_FPS},scale={ANALYSIS_WIDTH}:{analysis_height}:flags=area,format=bgr24",
+        "-f", "rawvideo",
+        "pipe:1"
+    ]
+
+    motion, content, times = [], [], []
+    previous_hsv = None
+    frame_index = -1
+    with open_media(ffmpeg_frames_cmd, job_id=job_id) as proc:
+        while True:
+            data = proc.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            frame_index += 1
+            frame = np.frombuffer(data, dtype=np.uint8).reshape(analysis_height, ANALYSIS_WIDTH, 3)
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV).astype(np.int16)
+            if previous_hsv is not None:
+                difference = np.abs(hsv - previous_hsv).mean(axis=(0, 1))
+                times.append(frame_index / ANALYSIS_FPS)
+                content.append(difference.mean())
+                # The value channel is the luma change, i.e. motion
+                motion.append(difference[2])
+            previous_hsv = hsv
+            if progress_callback is not None and frame_index % ANALYSIS_FPS == 0:
+                progress_callback(frame_index / ANALYSIS_FPS, seconds)
+
+    times = np.asarray(times, dtype=np.float64)
+    content = np.asarray(content, dtype=np.float32)
+    motion = np.asarray(motion, dtype=np.float32)
+    is_cut = content >= CUT_THRESHOLD
+    # A cut is a change of shot, not movement within one
+    motion = np.where(is_cut, 0.0, motion)
+
+    frames_per_second = np.maximum(_per_second(np.ones_like(motion), times, seconds, np.add), 1)
+    return (
+        _per_second(motion, times, seconds, np.add) / frames_per_second,
+        _per_second(is_cut.astype(np.float32), times, seconds, np.add)
+    )
+
+
+def _loudness(video_path, seconds, has_audio, job_id):
+    if not has_audio:
+        return np.full(seconds, SILENCE_DB, dtype=np.float32)
+    ffmpeg_audio_cmd = [
+        "ffmpeg",
+        "-v", "error",
+        "-i", video_path,
+        "-vn",
+        "-map", "0:a:0",
+        "-ac", "1",
+        "-ar", str(AUDIO_SAMPLE_RATE),
+        "-f", "f32le",
+        "-"
+    ]
+    try:
+        samples = np.frombuffer(run_media(ffmpeg_audio_cmd, job_id=job_id, text=False).stdout, dtype=np.float32)
+    except subprocess.CalledProcessError:
+        logging.warning(f"Could not decode audio of {video_path}, scoring on video only")
+        return np.full(seconds, SILENCE_DB, dtype=np.float32)
+    # Pad (with silence) or trim to whole seconds
+    padded = np.zeros(seconds * AUDIO_SAMPLE_RATE, dtype=np.float32)
+    padded[:min(len(samples), len(padded))] = samples[:len(padded)]
+    samples = padded
+    rms = np.sqrt(np.mean(samples.reshape(seconds, AUDIO_SAMPLE_RATE).astype(np.float64) ** 2, axis=1))
+    return np.maximum(20 * np.log10(np.maximum(rms, 1e-9)), SILENCE_DB).astype(np.float32)
+
+
+def analyze_highlights(video_path, job_id=None, progress_callback=None):
+    """Per-second motion, cut and loudness curves for a video.
+
+    `progress_callback(seconds_analyzed, duration)` is called as the video
+    is decoded.  Results are cached next to the upload.
+    """
+    features = load_highlight_features(video_path, ANALYSIS_SETTINGS)
+    if features is not None:
+        return features
+
+    width, height, duration, has_audio = _probe(video_path)
+    if not width or not height or duration <= 0:
+        raise Exception(f"Could not open video {video_path}")
+    seconds = max(1, int(np.ceil(duration)))
+
+    motion, cuts = _video_features(video_path, width, height, seconds, job_id, progress_callback)
+    features = {
+        "motion": motion,
+        "cuts": cuts,
+        "loudness": _loudness(video_path, seconds, has_audio, job_id),
+        "duration": duration
+    }
+    try:
+        save_highlight_features(video_path, features, ANALYSIS_SETTINGS)
+    except Exception as e:
+        logging.warning(f"Could not cache highlight features for {video_path}: {str(e)}")
+    return features
+
+
+def _normalize(curve):
+    # Scaled by a high percentile so one explosion doesn't flatten the rest
+    curve = curve - curve.min()
+    scale = np.percentile(curve, 95) if len(curve) else 0
+    return np.clip(curve / scale, 0, 1) if scale > 0 else np.zeros_like(curve)
+
+
+def highlight_scores(features):
+    """Weighted per-second highlight score in [0, 1]"""
+    return (
+        WEIGHTS["motion"] * _normalize(features["motion"])
+        + WEIGHTS["cuts"] * _normalize(features["cuts"])
+        + WEIGHTS["loudness"] * _normalize(features["loudness"])
+    ).astype(np.float32)
+
+
+def _best_window(window_sums, allowed):
+    candidates = np.flatnonzero(allowed)
+    if len(candidates) == 0:
+        return None
+    return int(candidates[np.argmax(window_sums[candidates])])
+
+
+def pick_windows(scores, duration, lengths):
+    """Choose the best-scoring, non-overlapping windows for the given lengths.
+
+    Windows are picked longest first; each returns (start, length) in
+    seconds.  A window longer than the video covers all of it, and one that
+    can't avoid the windows already picked may overlap them.
+    """
+    seconds = len(scores)
+    cumulative = np.concatenate(([0.0], np.cumsum(scores, dtype=np.float64)))
+    taken = np.zeros(seconds, dtype=bool)
+    windows = {}
+    for name, target in sorted(lengths.items(), key=lambda item: -item[1]):
+        length = int(min(target, seconds))
+        if length >= seconds:
+            windows[name] = (0.0, float(min(target, duration)))
+            taken[:] = True
+            continue
+
+        window_sums = cumulative[length:] - cumulative[:-length]
+        starts = np.arange(len(window_sums))
+        margin = min(EDGE_MARGIN, (seconds - length) // 2)
+        inside = (starts >= margin) & (starts + length <= seconds - margin)
+        overlap = np.concatenate(([0], np.cumsum(taken)))
+        free = (overlap[starts + length] - overlap[starts]) == 0
+
+        start = _best_window(window_sums, inside & free)
+        if start is None:
+            start = _best_window(window_sums, inside)
+        taken[start:start + length] = True
+        windows[name] = (float(start), float(length))
+    return windows
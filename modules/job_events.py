@@ -0,0 +1,97 @@
+import json
+import time
+from flask import Response, request, stream_with_context
+from modules.job_store import job_store
+
+# Server-Sent Events stream of job progress.
+#
+# The first event carries the whole job; after that an event is sent only
+# when the job actually changes, and it carries only the top-level fields
+# that changed (removed fields are sent as null).  Change detection reads the
+# job's update timestamp, so an idle stream costs one indexed lookup per tick
+# and never deserializes the job.  The stream ends once the job reaches one
+# of the `until` statuses.
+#
+# A stream holds a request thread while it is open, so the server runs
+# gthread workers (see render.yaml) with enough threads for the watchers,
+# and each stream is closed well inside gunicorn's worker timeout.  The
+# browser's EventSource reconnects after RECONNECT_MS and sends the last
+# event id (the job's version), so a job that hasn't changed since is not
+# sent again.
+
+POLL_INTERVAL = 0.5
+HEARTBEAT_INTERVAL = 10
+MAX_STREAM_SECONDS = 20
+RECONNECT_MS = 500
+
+
+def _event(data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def job_delta(previous, current):
+    """Top-level fields of `current` that differ from `previous`"""
+    delta = {key: value for key, value in current.items() if previous.get(key) != value}
+    for key in previous:
+        if key not in current:
+            delta[key] = None
+    return delta
+
+
+def stream_job(job_id, kind, until):
+    """Return an SSE response that pushes changes to a job"""
+    # A reconnecting client already has the job as of this version
+    client_version = request.headers.get('Last-Event-ID')
+
+    def generate():
+        started = time.monotonic()
+        last_sent = time.monotonic()
+        last_version = None
+        last_job = None
+        yield f"retry: {RECONNECT_MS}\n\n"
+
+        while True:
+            version = job_store.version(job_id)
+            if version is None:
+                yield _event({"success": False, "error": "Job not found"})
+                return
+
+            if version != last_version:
+                job = job_store.get(job_id, kind=kind)
+                if job is None:
+                    yield _event({"success": False, "error": "Job not found"})
+                    return
+                if last_job is None and str(version) == client_version:
+                    payload = None
+                else:
+                    payload = job if last_job is None else job_delta(last_job, job)
+                if payload:
+                    yield _event({"success": True, "job": payload}, event_id=version)
+                    last_sent = time.monotonic()
+                last_version = version
+                last_job = job
+                if job.get("status") in until:
+                    return
+
+            now = time.monotonic()
+            if now - last_sent >= HEARTBEAT_INTERVAL:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                last_sent = now
+            if now - started >= MAX_STREAM_SECONDS:
+                return
+
+            time.sleep(POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
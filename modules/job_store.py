@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# SQLite-backed job registry shared by every gunicorn worker.
+#
+# Each worker process opens its own connection (one per thread) to the same
+# database file.  WAL mode lets status reads proceed while a job thread is
+# writing progress, so the browser's polling never waits on an encode.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_kind_status ON jobs (kind, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at);
+CREATE TABLE IF NOT EXISTS cancellations (
+    job_id TEXT PRIMARY KEY,
+    requested_at REAL NOT NULL
+);
+"""
+
+
+class JobStore:
+    """Persistent job registry keyed by job_id"""
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('JOB_STORE_PATH', 'jobs.db')
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Point the store at the configured database file"""
+        path = app.config.get('JOB_STORE_PATH')
+        if path and path != self.path:
+            self.path = path
+            self._local = threading.local()
+            self._schema_ready = False
+        self._ensure_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'path', None) == self.path:
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Autocommit mode; writes open explicit transactions below
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        self._local.conn = conn
+        self._local.path = self.path
+        return conn
+
+    def _ensure_schema(self):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                self._connect().executescript(SCHEMA)
+                self._schema_ready = True
+
+    def _conn(self):
+        self._ensure_schema()
+        return self._connect()
+
+    def connection(self):
+        """This thread's connection, for other tables kept in the same database"""
+        return self._conn()
+
+    def create(self, kind, job):
+        """Register a new job; `job` must contain an "id" key"""
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, kind, status, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (job["id"], kind, job.get("status", "starting"), json.dumps(job), time.time())
+        )
+        return job
+
+    def get(self, job_id, kind=None):
+        """Return the job dict, or None if it does not exist"""
+        conn = self._conn()
+        if kind is None:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE job_id = ? AND kind = ?", (job_id, kind)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def exists(self, job_id, kind=None):
+        """Check whether a job is registered"""
+        conn = self._conn()
+        if kind is None:
+            row = conn.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT 1 FROM jobs WHERE job_id = ? AND kind = ?", (job_id, kind)
+            ).fetchone()
+        return row is not None
+
+    def kind(self, job_id):
+        """The job's kind, or None if it does not exist"""
+        row = self._conn().execute("SELECT kind FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def version(self, job_id):
+        """Timestamp of the job's last write, or None if it does not exist"""
+        row = self._conn().execute("SELECT updated_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, job_id, **fields):
+        """Merge top-level fields into a job and return the updated dict"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            job = json.loads(row[0])
+            if all(job.get(key) == value for key, value in fields.items()):
+                # Nothing changed; keep the version so event streams stay quiet
+                conn.execute("ROLLBACK")
+                return job
+            job.update(fields)
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE job_id = ?",
+                (job.get("status", ""), json.dumps(job), time.time(), job_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def update_results(self, job_id, **fields):
+        """Merge fields into the job's "results" dict"""
+        return self._merge(job_id, "results", fields)
+
+    def add_timings(self, job_id, **seconds):
+        """Add stage durations to the job's "timings" breakdown"""
+        return self._merge(job_id, "timings", seconds, accumulate=True)
+
+    def _merge(self, job_id, field, values, accumulate=False):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            job = json.loads(row[0])
+            merged = job.get(field) or {}
+            for key, value in values.items():
+                merged[key] = round(merged.get(key, 0) + value, 3) if accumulate else value
+            job[field] = merged
+            conn.execute(
+                "UPDATE jobs SET data = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(job), time.time(), job_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def list(self, kind=None, status=None):
+        """Return jobs filtered by kind and/or status"""
+        query = "SELECT data FROM jobs"
+        clauses, params = [], []
+        if kind is not None:
+            clauses.append("kind = ?")
+            params.append(kind)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        return [json.loads(row[0]) for row in self._conn().execute(query, params)]
+
+    def list_active(self, finished_statuses, updated_since=0):
+        """Return jobs not in a finished status that changed since `updated_since`"""
+        placeholders = ", ".join("?" for _ in finished_statuses)
+        query = f"SELECT data FROM jobs WHERE updated_at >= ? AND status NOT IN ({placeholders})"
+        rows = self._conn().execute(query, [updated_since, *finished_statuses])
+        return [json.loads(row[0]) for row in rows]
+
+    def delete(self, job_id):
+        """Remove a job from the registry"""
+        conn = self._conn()
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM cancellations WHERE job_id = ?", (job_id,))
+
+    def request_cancel(self, job_id):
+        """Flag a job for cancellation; whichever worker runs it will stop"""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cancellations (job_id, requested_at) VALUES (?, ?)",
+            (job_id, time.time())
+        )
+
+    def cancel_requested(self, job_id):
+        """Check whether cancellation was requested for a job"""
+        row = self._conn().execute("SELECT 1 FROM cancellations WHERE job_id = ?", (job_id,)).fetchone()
+        return row is not None
+
+    def clear_cancel(self, job_id):
+        """Drop a job's cancellation flag before it is started again"""
+        self._conn().execute("DELETE FROM cancellations WHERE job_id = ?", (job_id,))
+
+
+# Shared instance used by all blueprints
+job_store = JobStore()
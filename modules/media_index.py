@@ -0,0 +1,106 @@
+import os
+import json
+import bisect
+import logging
+from modules.media_runner import run_media
+
+# Per-upload keyframe index.
+#
+# The index is built once with ffprobe from packet flags (no decoding) and
+# persisted next to the upload as "<video>.keyframes.json", so every later
+# cut can seek straight to the keyframe preceding its start time.
+
+INDEX_SUFFIX = ".keyframes.json"
+
+
+def index_path_for(video_path):
+    """Path of the persisted keyframe index for an upload"""
+    return video_path + INDEX_SUFFIX
+
+
+def probe_keyframes(video_path):
+    """Scan the video stream's packets and return keyframe times and duration"""
+    ffprobe_cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=print_section=0",
+        video_path
+    ]
+    result = run_media(ffprobe_cmd)
+
+    keyframes = []
+    last_time = 0.0
+    for line in result.stdout.splitlines():
+        parts = line.strip().split(',')
+        if len(parts) < 2 or parts[0] in ('', 'N/A'):
+            continue
+        pts_time = float(parts[0])
+        last_time = max(last_time, pts_time)
+        if 'K' in parts[1]:
+            keyframes.append(pts_time)
+
+    keyframes.sort()
+    if not keyframes or keyframes[0] > 0:
+        # Seeking to 0 is always valid even if the first packet has an offset
+        keyframes.insert(0, 0.0)
+
+    return {
+        "keyframes": keyframes,
+        "duration": last_time
+    }
+
+
+def build_keyframe_index(video_path):
+    """Build and persist the keyframe index for an upload"""
+    index = probe_keyframes(video_path)
+    index["source_mtime"] = os.path.getmtime(video_path)
+    index["source_size"] = os.path.getsize(video_path)
+
+    index_path = index_path_for(video_path)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+    logging.info(f"Built keyframe index for {video_path}: {len(index['keyframes'])} keyframes")
+    return index
+
+
+def load_keyframe_index(video_path):
+    """Load the persisted index, building it if missing or stale"""
+    index_path = index_path_for(video_path)
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if (index.get("source_mtime") == os.path.getmtime(video_path)
+                and index.get("source_size") == os.path.getsize(video_path)):
+            return index
+    except (OSError, ValueError):
+        pass
+    return build_keyframe_index(video_path)
+
+
+def preceding_keyframe(keyframes, time):
+    """Return the last keyframe time at or before `time`"""
+    i = bisect.bisect_right(keyframes, time)
+    return keyframes[i - 1] if i > 0 else 0.0
+
+
+def following_keyframe(keyframes, time):
+    """Return the first keyframe time at or after `time`, or None"""
+    i = bisect.bisect_left(keyframes, time)
+    return keyframes[i] if i < len(keyframes) else None
+
+
+def seek_input_args(keyframes, video_path, start_time, end_time):
+    """ffmpeg input arguments that seek to the keyframe before start_time and
+    then trim precisely to [start_time, end_time]"""
+    keyframe = preceding_keyframe(keyframes, start_time)
+    return [
+        "-ss", f"{keyframe:.6f}",
+        "-i", video_path,
+        "-ss", f"{start_time - keyframe:.6f}",
+        "-t", f"{end_time - start_time:.6f}"
+    ]
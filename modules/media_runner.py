@@ -0,0 +1,273 @@
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+from modules.job_store import job_store
+from modules import metrics
+
+# Managed runner for media subprocesses (ffmpeg, ffprobe, yt-dlp).
+#
+# Every process is started in its own session, so cancelling a job can kill
+# the whole process group, including anything the tool spawned itself.
+# Processes are registered per job; cancellation is flagged in the job store,
+# so a /cancel request that lands on another gunicorn worker still stops the
+# job within one check interval.  ffmpeg runs that report progress get
+# "-progress pipe:1" and the parsed output time and encode fps are handed to
+# a callback.  Partial outputs are removed when a run fails or is cancelled.
+# Each run of a job's command is recorded in the subprocess metrics: wall
+# time, exit status, bytes of input files read and bytes written.
+
+CANCEL_CHECK_INTERVAL = 0.5
+TERMINATE_TIMEOUT = 5
+STDERR_TAIL_LINES = 40
+
+# Running processes per job, only those started by this worker
+_processes = {}
+_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its cancellation has been requested"""
+
+
+def _register(job_id, proc):
+    with _lock:
+        _processes.setdefault(job_id, set()).add(proc)
+
+
+def _unregister(job_id, proc):
+    with _lock:
+        procs = _processes.get(job_id)
+        if procs is not None:
+            procs.discard(proc)
+            if not procs:
+                del _processes[job_id]
+
+
+def _kill_tree(proc):
+    # SIGTERM lets ffmpeg exit cleanly; anything still alive after the
+    # timeout is killed outright
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        proc.wait(timeout=TERMINATE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+
+
+def cancel(job_id):
+    """Request cancellation of a job and kill its processes in this worker"""
+    job_store.request_cancel(job_id)
+    with _lock:
+        procs = list(_processes.get(job_id, ()))
+    for proc in procs:
+        _kill_tree(proc)
+    return len(procs)
+
+
+def is_cancelled(job_id):
+    """Check whether a job has been asked to stop"""
+    return job_id is not None and job_store.cancel_requested(job_id)
+
+
+def check_cancelled(job_id):
+    """Raise JobCancelled if the job has been asked to stop"""
+    if is_cancelled(job_id):
+        raise JobCancelled(f"Job {job_id} was cancelled")
+
+
+def remove_outputs(paths):
+    """Delete partial output files, ignoring ones that were never written"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove partial output {path}: {str(e)}")
+
+
+def _read_progress(stream, on_progress):
+    # ffmpeg writes key=value blocks, each terminated by a "progress=" line
+    fields = {}
+    for raw in stream:
+        key, _, value = raw.decode("utf-8", errors="replace").strip().partition("=")
+        if key != "progress":
+            fields[key] = value
+            continue
+        try:
+            # out_time_ms is in microseconds too; prefer the explicit field
+            seconds = int(fields.get("out_time_us") or fields.get("out_time_ms") or 0) / 1e6
+        except ValueError:
+            seconds = None
+        try:
+            fps = float(fields.get("fps") or 0)
+        except ValueError:
+            fps = 0.0
+        fields = {}
+        if seconds is None:
+            continue
+        try:
+            on_progress(max(0.0, seconds), fps)
+        except Exception as e:
+            # Keep draining the pipe so ffmpeg never blocks on it
+            logging.warning(f"Progress callback failed: {str(e)}")
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _record(cmd, job_id, status, started, outputs=(), stdout_bytes=0):
+    # Only commands run for a job are tracked; helpers such as the beat
+    # analysis pool run outside any job and stage
+    if job_id is None and metrics.current_stage.get() is None:
+        return
+    input_bytes = sum(_file_size(arg) for flag, arg in zip(cmd, cmd[1:]) if flag == "-i")
+    output_bytes = stdout_bytes + sum(_file_size(path) for path in outputs)
+    metrics.record_subprocess(
+        os.path.basename(cmd[0]), status, time.monotonic() - started, input_bytes, output_bytes
+    )
+
+
+def _exit_status(proc, job_id):
+    if proc.returncode == 0:
+        return "ok"
+    return "cancelled" if is_cancelled(job_id) else "error"
+
+
+def _start(cmd, job_id):
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+    if job_id is not None:
+        _register(job_id, proc)
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_reader = threading.Thread(
+        target=lambda: stderr_tail.extend(line.decode("utf-8", errors="replace") for line in proc.stderr),
+        daemon=True
+    )
+    stderr_reader.start()
+    return proc, stderr_reader, stderr_tail
+
+
+def _check_exit(cmd, proc, job_id, cleanup, stderr_tail, stdout=None):
+    if proc.returncode == 0:
+        return
+    remove_outputs(cleanup)
+    if is_cancelled(job_id):
+        raise JobCancelled(f"Job {job_id} was cancelled")
+    stderr = "".join(stderr_tail)
+    logging.error(f"{cmd[0]} exited with status {proc.returncode}: {stderr.strip()}")
+    raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+
+
+@contextmanager
+def open_media(cmd, job_id=None, cleanup=()):
+    """Start a media command whose stdout the caller consumes as a stream.
+
+    Yields the Popen object; the caller must read stdout to EOF.  Raising out
+    of the block (JobCancelled from a progress check, for instance) kills the
+    process tree and removes the `cleanup` paths.
+    """
+    check_cancelled(job_id)
+    started = time.monotonic()
+    proc, stderr_reader, stderr_tail = _start(cmd, job_id)
+    try:
+        yield proc
+        proc.wait()
+        stderr_reader.join()
+    except BaseException as e:
+        _kill_tree(proc)
+        _record(cmd, job_id, "cancelled" if isinstance(e, JobCancelled) else "error", started)
+        remove_outputs(cleanup)
+        raise
+    finally:
+        if job_id is not None:
+            _unregister(job_id, proc)
+        proc.stdout.close()
+        proc.stderr.close()
+    _record(cmd, job_id, _exit_status(proc, job_id), started, cleanup)
+    _check_exit(cmd, proc, job_id, cleanup, stderr_tail)
+
+
+def run_media(cmd, job_id=None, on_progress=None, cleanup=(), text=True):
+    """Run a media command to completion, like subprocess.run(check=True).
+
+    on_progress(seconds, fps) is called as an ffmpeg command advances; its
+    stdout is then used for progress, so the command must not write its
+    output there.  Paths in `cleanup` are removed if the run fails or the job
+    is cancelled, and their sizes count as the run's output bytes.  Raises
+    JobCancelled or subprocess.CalledProcessError.
+    """
+    check_cancelled(job_id)
+    if on_progress is not None:
+        cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+
+    started = time.monotonic()
+    proc, stderr_reader, stderr_tail = _start(cmd, job_id)
+    stdout_chunks = []
+    if on_progress is not None:
+        stdout_reader = threading.Thread(target=_read_progress, args=(proc.stdout, on_progress), daemon=True)
+    else:
+        stdout_reader = threading.Thread(target=lambda: stdout_chunks.append(proc.stdout.read()), daemon=True)
+    stdout_reader.start()
+
+    cancelled = False
+    try:
+        if job_id is None:
+            proc.wait()
+        else:
+            while True:
+                try:
+                    proc.wait(timeout=CANCEL_CHECK_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if is_cancelled(job_id):
+                    cancelled = True
+                    _kill_tree(proc)
+                    break
+        stdout_reader.join()
+        stderr_reader.join()
+    except BaseException:
+        _kill_tree(proc)
+        _record(cmd, job_id, "error", started)
+        remove_outputs(cleanup)
+        raise
+    finally:
+        if job_id is not None:
+            _unregister(job_id, proc)
+        proc.stdout.close()
+        proc.stderr.close()
+
+    if cancelled:
+        _record(cmd, job_id, "cancelled", started)
+        remove_outputs(cleanup)
+        raise JobCancelled(f"Job {job_id} was cancelled")
+
+    stdout = b"".join(chunk for chunk in stdout_chunks if chunk)
+    _record(cmd, job_id, _exit_status(proc, job_id), started, cleanup, len(stdout))
+    if text:
+        stdout = stdout.decode("utf-8", errors="replace")
+    # A cancel() from another thread of this worker kills the process directly,
+    # which shows up here as a failed exit
+    _check_exit(cmd, proc, job_id, cleanup, stderr_tail, stdout)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, "".join(stderr_tail))
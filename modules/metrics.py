@@ -0,0 +1,224 @@
+import json
+import math
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from flask import Blueprint, Response
+from modules.job_store import job_store
+from modules.retention import retention
+
+# Pipeline instrumentation exported in the Prometheus text format.
+#
+# Counters and histograms live in a table in the job store's SQLite database,
+# so every gunicorn worker adds to the same series and /metrics reports the
+# whole server no matter which worker answers.  Histogram buckets are stored
+# cumulatively, one row per bucket.  `stage()` times a step of a job: it
+# feeds the stage histogram and adds the duration to the job's "timings"
+# breakdown, and media subprocesses started inside it are labelled with it.
+
+metrics_bp = Blueprint('metrics', __name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_samples (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+"""
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+BYTES_BUCKETS = (1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "pipeline_stage_seconds": (
+        "histogram", "Duration of job pipeline stages", DURATION_BUCKETS
+    ),
+    "job_queue_wait_seconds": (
+        "histogram", "Time jobs wait in the scheduler queue before starting", DURATION_BUCKETS
+    ),
+    "media_subprocess_seconds": (
+        "histogram", "Wall time of media subprocesses", DURATION_BUCKETS
+    ),
+    "media_subprocess_input_bytes": (
+        "histogram", "Size of the input files read by media subprocesses", BYTES_BUCKETS
+    ),
+    "media_subprocess_output_bytes": (
+        "histogram", "Bytes written by media subprocesses", BYTES_BUCKETS
+    ),
+    "chat_first_token_seconds": (
+        "histogram", "Time from a chat request to the backend's first token", DURATION_BUCKETS
+    ),
+    "media_subprocesses_total": (
+        "counter", "Media subprocesses run, by tool and exit status", None
+    ),
+}
+
+# (name, type, key in the retention stats, help)
+RETENTION_SERIES = (
+    ("retention_reclaimed_bytes_total", "counter", "reclaimed_bytes_total", "Bytes deleted by retention sweeps"),
+    ("retention_removed_entries_total", "counter", "removed_entries_total", "Entries deleted by retention sweeps"),
+    ("retention_managed_bytes", "gauge", "managed_bytes", "Bytes under retention management at the last sweep"),
+)
+
+# Stage of the current job step, read by the media runner for its labels
+current_stage = contextvars.ContextVar('current_stage', default=None)
+
+_schema_ready = threading.local()
+
+
+def _conn():
+    conn = job_store.connection()
+    if getattr(_schema_ready, 'conn', None) is not conn:
+        conn.executescript(SCHEMA)
+        _schema_ready.conn = conn
+    return conn
+
+
+def _key(labels):
+    return json.dumps(labels, sort_keys=True)
+
+
+def _add(samples):
+    """Atomically add (name, labels, amount) increments"""
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO metric_samples (name, labels, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+            [(name, _key(labels), amount) for name, labels, amount in samples]
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _histogram_samples(name, value, labels):
+    buckets = METRICS[name][2]
+    samples = [
+        (f"{name}_bucket", {**labels, "le": f"{bound:g}"}, 1)
+        for bound in buckets if value <= bound
+    ]
+    samples.append((f"{name}_bucket", {**labels, "le": "+Inf"}, 1))
+    samples.append((f"{name}_sum", labels, value))
+    samples.append((f"{name}_count", labels, 1))
+    return samples
+
+
+def observe(name, value, **labels):
+    """Record one observation in a histogram; metrics never fail a job"""
+    try:
+        _add(_histogram_samples(name, value, labels))
+    except Exception as e:
+        logging.warning(f"Could not record metric {name}: {str(e)}")
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter"""
+    try:
+        _add([(name, labels, amount)])
+    except Exception as e:
+        logging.warning(f"Could not record metric {name}: {str(e)}")
+
+
+def record_subprocess(tool, status, seconds, input_bytes, output_bytes):
+    """Record one finished media subprocess in a single transaction"""
+    labels = {"tool": tool, "stage": current_stage.get() or "none"}
+    samples = [("media_subprocesses_total", {**labels, "status": status}, 1)]
+    samples += _histogram_samples("media_subprocess_seconds", seconds, {**labels, "status": status})
+    samples += _histogram_samples("media_subprocess_input_bytes", input_bytes, labels)
+    samples += _histogram_samples("media_subprocess_output_bytes", output_bytes, labels)
+    try:
+        _add(samples)
+    except Exception as e:
+        logging.warning(f"Could not record subprocess metrics: {str(e)}")
+
+
+@contextmanager
+def stage(job_id, kind, name):
+    """Time one step of a job, in the stage histogram and the job's timings"""
+    token = current_stage.set(name)
+    started = time.monotonic()
+    status = "ok"
+    try:
+        yield
+    except Exception as e:
+        # Imported here: the media runner records its own metrics through us
+        from modules.media_runner import JobCancelled
+        status = "cancelled" if isinstance(e, JobCancelled) else "error"
+        raise
+    finally:
+        current_stage.reset(token)
+        elapsed = time.monotonic() - started
+        observe("pipeline_stage_seconds", elapsed, kind=kind, stage=name, status=status)
+        try:
+            job_store.add_timings(job_id, **{name: elapsed})
+        except Exception as e:
+            logging.warning(f"Could not record timing for job {job_id}: {str(e)}")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in sorted(labels.items(), key=lambda item: (item[0] == "le", item[0]))
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _sort_key(sample):
+    name, labels, _ = sample
+    le = labels.get("le")
+    bound = math.inf if le == "+Inf" else float(le) if le is not None else 0.0
+    rest = _key({key: value for key, value in labels.items() if key != "le"})
+    return (rest, name, bound)
+
+
+def render():
+    """All series in the Prometheus text exposition format"""
+    rows = _conn().execute("SELECT name, labels, value FROM metric_samples").fetchall()
+    samples = {}
+    for name, labels, value in rows:
+        base = name
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                base = name[:-len(suffix)]
+        samples.setdefault(base, []).append((name, json.loads(labels), value))
+
+    lines = []
+    for base, (kind, help_text, _) in METRICS.items():
+        lines.append(f"# HELP {base} {help_text}")
+        lines.append(f"# TYPE {base} {kind}")
+        for name, labels, value in sorted(samples.get(base, []), key=_sort_key):
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    # Current job counts straight from the job table
+    lines.append("# HELP jobs Jobs in the store by kind and status")
+    lines.append("# TYPE jobs gauge")
+    for kind, status, count in job_store.connection().execute(
+        "SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status ORDER BY kind, status"
+    ):
+        lines.append(f"jobs{_format_labels({'kind': kind, 'status': status})} {count}")
+
+    # Totals from the latest retention sweep
+    retention_stats = retention.stats()
+    for name, kind, key, help_text in RETENTION_SERIES:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {_format_value(retention_stats.get(key, 0))}")
+    return "\n".join(lines) + "\n"
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
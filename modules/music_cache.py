@@ -0,0 +1,185 @@
+import os
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+from urllib.parse import urlsplit, parse_qsl, urlencode, urlunsplit, unquote
+from modules.media_runner import run_media
+
+# Shared, size-bounded cache of downloaded music tracks.
+#
+# Tracks are keyed on the normalized source (the video id for YouTube links,
+# the normalized URL otherwise, path + size + mtime for local files) and
+# stored as "<key hash>.<ext>".  A per-key file lock coalesces concurrent
+# requests for the same track across threads and gunicorn workers, so only
+# one yt-dlp download runs.  Least recently used tracks are evicted once the
+# cache grows past its quota.
+
+YOUTUBE_HOSTS = {"youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com"}
+
+# Tracks used this recently are never evicted, since a job may be about to read them
+EVICTION_GRACE_SECONDS = 3600
+
+
+class MusicSourceError(Exception):
+    """Raised when a music source is invalid or cannot be fetched"""
+
+
+def local_source_path(source):
+    """Return the filesystem path for file:// URLs and absolute paths, else None.
+
+    Anything else is a URL for yt-dlp, including ones without a scheme
+    ("youtube.com/watch?v=...").
+    """
+    if source.startswith("file://"):
+        return unquote(urlsplit(source).path)
+    if os.path.isabs(source):
+        return source
+    return None
+
+
+def normalize_source(source):
+    """Stable cache key for a music source"""
+    source = source.strip()
+
+    path = local_source_path(source)
+    if path is not None:
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            raise MusicSourceError(f"Music file not found: {path}")
+        stat = os.stat(path)
+        return f"file:{path}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    # yt-dlp accepts URLs without a scheme; parse them as https
+    parts = urlsplit(source if "://" in source else f"https://{source}")
+    host = parts.netloc.lower()
+    if host == "youtu.be":
+        video_id = parts.path.strip("/").split("/")[0]
+        if video_id:
+            return f"youtube:{video_id}"
+    if host in YOUTUBE_HOSTS:
+        video_id = dict(parse_qsl(parts.query)).get("v")
+        if not video_id and parts.path.startswith(("/shorts/", "/embed/", "/live/")):
+            video_id = parts.path.split("/")[2]
+        if video_id:
+            return f"youtube:{video_id}"
+
+    # Generic URL: lowercase scheme and host, sorted query, no fragment
+    query = urlencode(sorted(parse_qsl(parts.query)))
+    return urlunsplit((parts.scheme.lower(), host, parts.path, query, ""))
+
+
+class MusicCache:
+    """Download-once store of music tracks with LRU eviction"""
+
+    def __init__(self, cache_dir=None, max_bytes=None, allow_local_sources=True):
+        self.cache_dir = cache_dir or os.path.join('uploads', 'music', 'cache')
+        self.max_bytes = max_bytes or 2 * 1024 * 1024 * 1024
+        self.allow_local_sources = allow_local_sources
+
+    def init_app(self, app):
+        """Read cache location, quota and source policy from the app config"""
+        self.cache_dir = app.config.get('MUSIC_CACHE_DIR') or self.cache_dir
+        self.max_bytes = app.config.get('MUSIC_CACHE_MAX_BYTES') or self.max_bytes
+        self.allow_local_sources = app.config.get('MUSIC_ALLOW_LOCAL_SOURCES', self.allow_local_sources)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _find_cached(self, key_hash):
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(key_hash + ".") and not name.endswith((".lock", ".part")):
+                return os.path.join(self.cache_dir, name)
+        return None
+
+    def validate(self, source):
+        """Check a source against the policy without fetching it; returns its cache key"""
+        if local_source_path(source.strip()) is not None and not self.allow_local_sources:
+            raise MusicSourceError("Local music files are not allowed")
+        return normalize_source(source)
+
+    def fetch(self, source):
+        """Return the path of the cached track, downloading it if needed"""
+        key = self.validate(source)
+        key_hash = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        lock_path = os.path.join(self.cache_dir, f"{key_hash}.lock")
+        with open(lock_path, "w") as lock_file:
+            # Whoever holds the lock downloads; everyone else waits and then
+            # finds the finished file
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                cached = self._find_cached(key_hash)
+                if cached is not None:
+                    os.utime(cached)
+                    logging.info(f"Music cache hit for {key}")
+                    return cached
+
+                logging.info(f"Music cache miss for {key}, fetching")
+                path = self._download(source.strip(), key_hash)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self.evict(keep=path)
+        return path
+
+    def _download(self, source, key_hash):
+        local_path = local_source_path(source)
+        if local_path is not None:
+            ext = local_path.rsplit('.', 1)[1].lower() if '.' in os.path.basename(local_path) else 'mp3'
+            path = os.path.join(self.cache_dir, f"{key_hash}.{ext}")
+            tmp_path = path + ".part"
+            shutil.copyfile(local_path, tmp_path)
+            os.replace(tmp_path, path)
+            return path
+
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as temp_dir:
+            download_path = os.path.join(temp_dir, "music.mp3")
+            ytdlp_cmd = [
+                "yt-dlp",
+                "-x",
+                "--audio-format", "mp3",
+                "-o", download_path,
+                "--",
+                source
+            ]
+            # Not tied to a job: other jobs may be waiting on the same download
+            run_media(ytdlp_cmd)
+
+            if not os.path.exists(download_path):
+                raise MusicSourceError("Failed to download music file")
+
+            path = os.path.join(self.cache_dir, f"{key_hash}.mp3")
+            os.replace(download_path, path)
+            return path
+
+    def evict(self, keep=None):
+        """Remove least recently used tracks until the cache fits its quota"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith((".lock", ".part")) or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        now = time.time()
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep or now - mtime < EVICTION_GRACE_SECONDS:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                logging.info(f"Evicted {path} from music cache")
+            except OSError as e:
+                logging.warning(f"Could not evict {path} from music cache: {str(e)}")
+        return total
+
+
+# Shared instance used by all blueprints
+music_cache = MusicCache()
@@ -0,0 +1,52 @@
+from modules.media_runner import run_media
+
+# Low-bitrate preview proxies for scene browsing.
+#
+# A proxy is a small H.264/AAC MP4 of the whole upload (360p by default) with
+# a keyframe every second, so a <video> element can seek to any scene almost
+# instantly for hover previews and for playing back a draft of the edit.  It
+# is stored next to the upload and shared by every job on the same content.
+# Normally it is produced by the scene detector's decode pass (see
+# detect_content_scenes); render_proxy covers uploads whose detection was
+# already cached.
+
+DEFAULT_PROXY_HEIGHT = 360
+
+
+def proxy_filter(height):
+    """Video filter scaling to the proxy height (width kept even)"""
+    return f"scale=-2:{height}"
+
+
+def proxy_output_args(proxy_path):
+    """ffmpeg output options for a proxy, after its -map options"""
+    return [
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", "30",
+        "-maxrate", "800k",
+        "-bufsize", "1600k",
+        "-pix_fmt", "yuv420p",
+        "-force_key_frames", "expr:gte(t,n_forced*1)",
+        "-c:a", "aac",
+        "-b:a", "64k",
+        "-ac", "2",
+        "-movflags", "+faststart",
+        "-f", "mp4",
+        proxy_path
+    ]
+
+
+def render_proxy(video_path, proxy_path, height=DEFAULT_PROXY_HEIGHT, job_id=None, on_progress=None):
+    """Transcode a standalone preview proxy"""
+    ffmpeg_proxy_cmd = [
+        "ffmpeg",
+        "-y",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        "-vf", proxy_filter(height),
+        *proxy_output_args(proxy_path)
+    ]
+    run_media(ffmpeg_proxy_cmd, job_id=job_id, on_progress=on_progress, cleanup=[proxy_path])
+    return proxy_path
@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import logging
+import threading
+from modules.job_store import job_store
+
+# Background retention for uploads, caches and results.
+#
+# Every managed directory has a TTL; anything not used for longer is deleted.
+# When the disk (or the configured quota) passes the high watermark, the
+# least recently used entries anywhere are evicted until usage is back under
+# the low watermark.  Entries are grouped so that an upload goes together
+# with its sidecars (keyframe index, scores, thumbnails, proxy) and a job's
+# outputs go together; groups that belong to active jobs are never touched,
+# and neither is anything modified within the last MIN_AGE_SECONDS.
+#
+# Scans are incremental: a directory is only listed again when its own
+# mtime shows entries were added or removed, and a group's timestamps are
+# re-checked right before it is deleted, so touched files survive.  Only one
+# gunicorn worker sweeps at a time.
+
+MIN_AGE_SECONDS = 3600
+
+# Jobs untouched for longer than this no longer protect their files
+ACTIVE_JOB_MAX_AGE = 2 * 24 * 3600
+
+FINISHED_STATUSES = ("completed", "error", "cancelled")
+
+UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def group_key(name):
+    """Job ID for per-job outputs, else the content hash / ID before the first dot"""
+    match = UUID_PATTERN.search(name)
+    if match:
+        return match.group(0)
+    return name.lstrip('.').split('.', 1)[0]
+
+
+def _tree_usage(path):
+    # Newest mtime and total size of a sidecar directory
+    newest = os.stat(path).st_mtime
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                mtime, size = _tree_usage(entry.path)
+            else:
+                stat = entry.stat(follow_symlinks=False)
+                mtime, size = stat.st_mtime, stat.st_size
+            newest = max(newest, mtime)
+            total += size
+    return newest, total
+
+
+def _usage(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        return _tree_usage(path)
+    stat = os.stat(path, follow_symlinks=False)
+    return stat.st_mtime, stat.st_size
+
+
+class RetentionService:
+    """Periodic TTL and watermark-based cleanup of managed directories"""
+
+    def __init__(self):
+        self.ttls = {}
+        self.interval = 600
+        self.quota_bytes = 0
+        self.high_watermark = 0.9
+        self.low_watermark = 0.8
+        self.state_dir = 'uploads'
+        self._index = {}
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read TTLs and watermarks from the app config"""
+        self.ttls = {os.path.normpath(path): ttl for path, ttl in app.config['RETENTION_TTLS'].items()}
+        self.interval = app.config.get('RETENTION_INTERVAL', self.interval)
+        self.quota_bytes = app.config.get('RETENTION_QUOTA_BYTES', self.quota_bytes)
+        self.high_watermark = app.config.get('RETENTION_HIGH_WATERMARK', self.high_watermark)
+        self.low_watermark = app.config.get('RETENTION_LOW_WATERMARK', self.low_watermark)
+        self.state_dir = app.config['UPLOAD_FOLDER']
+        # Started from the first request so the thread lives in the worker
+        app.before_request(self.start)
+
+    def start(self):
+        """Start the sweeper thread once per process"""
+        if self._thread is not None or not self.interval:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Retention sweep failed: {str(e)}")
+
+    def _scan(self, root):
+        """Groups in a directory as {key: [newest mtime, bytes, paths]}"""
+        try:
+            dir_mtime = os.stat(root).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        cached = self._index.get(root)
+        if cached is not None and cached[0] == dir_mtime:
+            return cached[1]
+
+        groups = {}
+        with os.scandir(root) as entries:
+            for entry in entries:
+                # Nested managed directories have their own TTL
+                if os.path.normpath(entry.path) in self.ttls:
+                    continue
+                try:
+                    mtime, size = _usage(entry.path)
+                except FileNotFoundError:
+                    continue
+                group = groups.setdefault(group_key(entry.name), [0.0, 0, []])
+                group[0] = max(group[0], mtime)
+                group[1] += size
+                group[2].append(entry.path)
+        self._index[root] = (dir_mtime, groups)
+        return groups
+
+    def _protected_keys(self):
+        keys = set()
+        for job in job_store.list_active(FINISHED_STATUSES, updated_since=time.time() - ACTIVE_JOB_MAX_AGE):
+            keys.add(job["id"])
+            if job.get("content_hash"):
+                keys.add(job["content_hash"])
+        return keys
+
+    def _remove(self, groups, key, max_age, now):
+        """Delete a group if it is still older than max_age; returns bytes freed"""
+        newest, size, paths = groups[key]
+        # The index may predate a touch (a re-upload, a cache hit), so
+        # re-check the group's timestamps before deleting anything
+        fresh = 0.0
+        for path in paths:
+            try:
+                fresh = max(fresh, _usage(path)[0])
+            except FileNotFoundError:
+                pass
+        if now - fresh < max_age:
+            groups[key][0] = fresh
+            return 0
+
+        for path in paths:
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Retention could not remove {path}: {str(e)}")
+        del groups[key]
+        return size
+
+    def _disk_usage(self, managed_bytes):
+        if self.quota_bytes:
+            return managed_bytes, self.quota_bytes
+        usage = shutil.disk_usage(self.state_dir)
+        return usage.used, usage.total
+
+    def sweep(self):
+        """Run one retention pass; returns its stats, or None if another worker is sweeping"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(os.path.join(self.state_dir, '.retention.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            return self._sweep()
+
+    def _sweep(self):
+        started = time.time()
+        protected = self._protected_keys()
+        reclaimed = {}
+        removed = 0
+        managed_bytes = 0
+        candidates = []
+
+        # TTL pass
+        for root, ttl in self.ttls.items():
+            groups = self._scan(root)
+            for key, (newest, size, _) in list(groups.items()):
+                if key in protected or started - newest < MIN_AGE_SECONDS:
+                    managed_bytes += size
+                    continue
+                freed = self._remove(groups, key, ttl, started) if ttl and started - newest > ttl else 0
+                if freed:
+                    reclaimed[root] = reclaimed.get(root, 0) + freed
+                    removed += 1
+                elif key in groups:
+                    managed_bytes += size
+                    candidates.append((groups[key][0], root, key))
+
+        # Watermark pass: least recently used first, across all directories
+        used, capacity = self._disk_usage(managed_bytes)
+        if capacity and used > self.high_watermark * capacity:
+            target = self.low_watermark * capacity
+            logging.info(f"Retention: usage {used} above high watermark, evicting down to {int(target)}")
+            for _, root, key in sorted(candidates):
+                if used <= target:
+                    break
+                groups = self._index[root][1]
+                if key not in groups:
+                    continue
+                freed = self._remove(groups, key, MIN_AGE_SECONDS, started)
+                if freed:
+                    reclaimed[root] = reclaimed.get(root, 0) + freed
+                    removed += 1
+                    used -= freed
+                    managed_bytes -= freed
+
+        stats = self._record(started, reclaimed, removed, managed_bytes, used, capacity)
+        if removed:
+            logging.info(f"Retention: removed {removed} entries, reclaimed {stats['last_reclaimed_bytes']} bytes")
+        return stats
+
+    def _state_path(self):
+        return os.path.join(self.state_dir, '.retention.json')
+
+    def _record(self, started, reclaimed, removed, managed_bytes, used, capacity):
+        # Stats live in a file so whichever worker answers can report them
+        stats = self.stats()
+        reclaimed_by_dir = stats.get("reclaimed_bytes_by_dir", {})
+        for root, freed in reclaimed.items():
+            reclaimed_by_dir[root] = reclaimed_by_dir.get(root, 0) + freed
+        last_reclaimed = sum(reclaimed.values())
+        stats.update({
+            "sweeps": stats.get("sweeps", 0) + 1,
+            "last_sweep_at": started,
+            "last_sweep_seconds": round(time.time() - started, 3),
+            "last_reclaimed_bytes": last_reclaimed,
+            "last_removed_entries": removed,
+            "reclaimed_bytes_total": stats.get("reclaimed_bytes_total", 0) + last_reclaimed,
+            "removed_entries_total": stats.get("removed_entries_total", 0) + removed,
+            "reclaimed_bytes_by_dir": reclaimed_by_dir,
+            "managed_bytes": managed_bytes,
+            "used_bytes": used,
+            "capacity_bytes": capacity
+        })
+        tmp_path = self._state_path() + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, self._state_path())
+        return stats
+
+    def stats(self):
+        """Cumulative stats from the latest sweep by any worker"""
+        try:
+            with open(self._state_path(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+# Shared instance started by the app
+retention = RetentionService()
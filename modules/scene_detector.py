@@ -0,0 +1,228 @@
+import json
+import cv2
+import numpy as np
+from modules.media_runner import run_media, open_media
+from modules.preview_proxy import DEFAULT_PROXY_HEIGHT, proxy_filter, proxy_output_args
+
+# In-process content-aware scene detection.
+#
+# Frames are decoded with OpenCV, shrunk to a small working width and
+# compared in HSV space: the content score of a frame is the mean absolute
+# difference of hue, saturation and value against the previous analyzed
+# frame (the same measure PySceneDetect's detect-content uses).  Threshold
+# and minimum scene length are applied while the frames stream past, so a
+# single pass yields the final scene list.  When a preview proxy is wanted,
+# ffmpeg does the decoding instead and encodes the proxy from the same
+# decoded frames.
+
+DEFAULT_DOWNSCALE_WIDTH = 256
+
+
+class ContentCutFilter:
+    """Streaming threshold / minimum-length filter over content scores"""
+
+    def __init__(self, threshold, min_scene_length):
+        self.threshold = threshold
+        self.min_scene_length = min_scene_length
+        self.cuts = []
+        self._last_cut = 0.0
+
+    def process(self, frame_time, score):
+        """Feed one frame's score; returns True if a cut is placed here"""
+        if score >= self.threshold and frame_time - self._last_cut >= self.min_scene_length:
+            self.cuts.append(frame_time)
+            self._last_cut = frame_time
+            return True
+        return False
+
+    def scenes(self, duration):
+        """Scene (start_time, end_time) pairs for the cuts found so far"""
+        boundaries = [0.0] + self.cuts + [duration]
+        return [
+            (boundaries[i], boundaries[i + 1])
+            for i in range(len(boundaries) - 1)
+            if boundaries[i + 1] > boundaries[i]
+        ]
+
+
+def scenes_from_scores(frame_times, scores, duration, threshold, min_scene_length):
+    """Apply threshold and minimum length to a precomputed score curve"""
+    cut_filter = ContentCutFilter(threshold, min_scene_length)
+    frame_times = np.asarray(frame_times)
+    scores = np.asarray(scores)
+    # Only frames over the threshold can start a scene, so skip the rest
+    for i in np.flatnonzero(scores >= threshold):
+        cut_filter.process(float(frame_times[i]), float(scores[i]))
+    return cut_filter.scenes(duration)
+
+
+def _scaled_size(width, height, downscale_width):
+    if width > downscale_width > 0 and height > 0:
+        return (downscale_width, max(1, round(height * downscale_width / width)))
+    return None
+
+
+def _opencv_frames(video_path, downscale_width, frame_skip):
+    """Decode with OpenCV; returns (fps, total_frames, frame iterator)"""
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise Exception(f"Could not open video {video_path}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    size = _scaled_size(
+        int(capture.get(cv2.CAP_PROP_FRAME_WIDTH) or 0),
+        int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0),
+        downscale_width
+    )
+
+    def frames():
+        frame_index = -1
+        try:
+            while True:
+                # Skipped frames are only grabbed, never converted or compared
+                for _ in range(frame_skip):
+                    if not capture.grab():
+                        break
+                    frame_index += 1
+
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                frame_index += 1
+                if size is not None:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                yield frame_index, frame
+        finally:
+            capture.release()
+
+    return fps, total_frames, frames()
+
+
+def _probe(video_path):
+    ffprobe_cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate,nb_frames:format=duration",
+        "-of", "json",
+        video_path
+    ]
+    info = json.loads(run_media(ffprobe_cmd).stdout)
+    stream = (info.get("streams") or [{}])[0]
+    num, _, den = (stream.get("r_frame_rate") or "0/0").partition("/")
+    fps = float(num) / float(den) if den and float(den) else 25.0
+    try:
+        total_frames = int(stream.get("nb_frames") or 0)
+    except ValueError:
+        total_frames = 0
+    if not total_frames:
+        # Matroska has no frame count; estimate it from the duration
+        total_frames = int(float((info.get("format") or {}).get("duration") or 0) * fps)
+    return int(stream.get("width") or 0), int(stream.get("height") or 0), fps, total_frames
+
+
+def _ffmpeg_frames(video_path, downscale_width, frame_skip, proxy_path, proxy_height, job_id):
+    """Decode once with ffmpeg, writing the preview proxy from the same pass.
+
+    The decoded video is split: one branch is scaled to the analysis width
+    and piped out as raw BGR frames, the other is encoded into the proxy.
+    """
+    width, height, fps, total_frames = _probe(video_path)
+    if not width or not height:
+        raise Exception(f"Could not open video {video_path}")
+    analysis_width, analysis_height = _scaled_size(width, height, downscale_width) or (width, height)
+    frame_bytes = analysis_width * analysis_height * 3
+
+    filter_graph = (
+        f"[0:v]split=2[detect][proxy];"
+        f"[detect]scale={analysis_width}:{analysis_height}:flags=area,format=bgr24[frames];"
+        f"[proxy]{proxy_filter(proxy_height)}[preview]"
+    )
+    ffmpeg_detect_cmd = [
+        "ffmpeg",
+        "-y",
+        "-noautorotate",
+        "-i", video_path,
+        "-filter_complex", filter_graph,
+        "-map", "[frames]",
+        "-fps_mode", "passthrough",
+        "-f", "rawvideo",
+        "pipe:1",
+        "-map", "[preview]",
+        "-map", "0:a:0?",
+        *proxy_output_args(proxy_path)
+    ]
+
+    def frames():
+        with open_media(ffmpeg_detect_cmd, job_id=job_id, cleanup=[proxy_path]) as proc:
+            frame_index = -1
+            while True:
+                data = proc.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    # Drain anything left so ffmpeg can finish the proxy
+                    while proc.stdout.read(frame_bytes):
+                        pass
+                    break
+                frame_index += 1
+                # Skipped frames are still piped (they are tiny) but never compared
+                if frame_skip and frame_index % (frame_skip + 1):
+                    continue
+                yield frame_index, np.frombuffer(data, dtype=np.uint8).reshape(
+                    analysis_height, analysis_width, 3
+                )
+
+    return fps, total_frames, frames()
+
+
+def detect_content_scenes(video_path, threshold=30, min_scene_length=2,
+                          downscale_width=DEFAULT_DOWNSCALE_WIDTH, frame_skip=0,
+                          progress_callback=None, proxy_path=None,
+                          proxy_height=DEFAULT_PROXY_HEIGHT, job_id=None):
+    """Detect scenes in one decode pass.
+
+    Returns a dict with the scene list, the per-frame score curve (so other
+    thresholds can be applied later without decoding) and the duration.
+    `progress_callback(frames_processed, total_frames)` is called as frames
+    are analyzed.  With `proxy_path`, frames are decoded by ffmpeg, which
+    encodes the preview proxy there from the same decode.
+    """
+    if proxy_path is not None:
+        fps, total_frames, frames = _ffmpeg_frames(
+            video_path, downscale_width, frame_skip, proxy_path, proxy_height, job_id
+        )
+    else:
+        fps, total_frames, frames = _opencv_frames(video_path, downscale_width, frame_skip)
+
+    cut_filter = ContentCutFilter(threshold, min_scene_length)
+    frame_times = []
+    scores = []
+    previous = None
+    frame_index = -1
+
+    try:
+        for frame_index, frame in frames:
+            frame_time = frame_index / fps
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV).astype(np.int16)
+
+            if previous is not None:
+                score = float(np.abs(hsv - previous).mean(axis=(0, 1)).mean())
+                frame_times.append(frame_time)
+                scores.append(score)
+                cut_filter.process(frame_time, score)
+            previous = hsv
+
+            if progress_callback is not None:
+                progress_callback(frame_index + 1, total_frames)
+    finally:
+        frames.close()
+
+    duration = (frame_index + 1) / fps if frame_index >= 0 else 0.0
+
+    return {
+        "scenes": cut_filter.scenes(duration),
+        "frame_times": np.asarray(frame_times, dtype=np.float64),
+        "scores": np.asarray(scores, dtype=np.float32),
+        "duration": duration,
+        "fps": fps
+    }
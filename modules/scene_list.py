@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Compact storage of a job's detected scenes.
+#
+# The scene list is kept out of the job record, which is read on every
+# status poll and rewritten on every progress update.  It is saved once, as
+# "scenes_<job_id>.json" holding parallel arrays of start and end times, and
+# loaded into numpy arrays that are cached per worker (keyed on the file's
+# size and mtime), so paging and filtering slice arrays instead of walking
+# per-scene dicts.  A scene's id is its index; its duration and thumbnail
+# name are derived from it.
+
+SCENES_FORMAT = 1
+MEMORY_CACHE_SIZE = 32
+
+_lock = threading.Lock()
+_memory = OrderedDict()
+
+
+def scenes_path_for(output_dir, job_id):
+    """Path of a job's saved scene list"""
+    return os.path.join(output_dir, f"scenes_{job_id}.json")
+
+
+def thumbnail_name(job_id, scene_id):
+    """File name of a scene's thumbnail in the editor's output directory"""
+    return f"thumb_{job_id}_{scene_id}.jpg"
+
+
+class SceneList:
+    """A job's scenes as parallel start/end time arrays"""
+
+    def __init__(self, job_id, start_times, end_times):
+        self.job_id = job_id
+        self.start_times = np.asarray(start_times, dtype=np.float64)
+        self.end_times = np.asarray(end_times, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.start_times)
+
+    @property
+    def durations(self):
+        return self.end_times - self.start_times
+
+    def has(self, scene_id):
+        return isinstance(scene_id, int) and not isinstance(scene_id, bool) and 0 <= scene_id < len(self)
+
+    def scene(self, scene_id):
+        """One scene in the shape the editor and its clients use"""
+        start_time = float(self.start_times[scene_id])
+        end_time = float(self.end_times[scene_id])
+        return {
+            "id": scene_id,
+            "start_time": start_time,
+            "end_time": end_time,
+            "duration": end_time - start_time,
+            "thumbnail": thumbnail_name(self.job_id, scene_id)
+        }
+
+    def select(self, min_duration=None, max_duration=None, start=None, end=None):
+        """Ids of the scenes within the duration bounds that overlap [start, end]"""
+        mask = np.ones(len(self), dtype=bool)
+        durations = self.durations
+        if min_duration is not None:
+            mask &= durations >= min_duration
+        if max_duration is not None:
+            mask &= durations <= max_duration
+        if start is not None:
+            mask &= self.end_times > start
+        if end is not None:
+            mask &= self.start_times < end
+        return np.flatnonzero(mask)
+
+    def scenes(self, scene_ids):
+        return [self.scene(int(scene_id)) for scene_id in scene_ids]
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+def _remember(key, scene_list):
+    with _lock:
+        _memory[key] = scene_list
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def save_scenes(path, job_id, scenes):
+    """Save (start_time, end_time) pairs as a job's scene list"""
+    start_times = [float(start) for start, _ in scenes]
+    end_times = [float(end) for _, end in scenes]
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"format": SCENES_FORMAT, "start_time": start_times, "end_time": end_times}, f)
+    os.replace(tmp_path, path)
+    scene_list = SceneList(job_id, start_times, end_times)
+    _remember(_file_key(path), scene_list)
+    return scene_list
+
+
+def load_scenes(path, job_id):
+    """A job's saved scene list; raises OSError if there is none"""
+    key = _file_key(path)
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key]
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        # Older jobs saved a list of scene dicts
+        data = {
+            "start_time": [scene["start_time"] for scene in data],
+            "end_time": [scene["end_time"] for scene in data]
+        }
+    scene_list = SceneList(job_id, data["start_time"], data["end_time"])
+    _remember(key, scene_list)
+    return scene_list
+
+
+def scenes_etag(path, query):
+    """Validator for a page of a scene list: the file's identity plus the query"""
+    _, size, mtime_ns = _file_key(path)
+    return hashlib.sha256(f"{size}:{mtime_ns}:{query}".encode("utf-8")).hexdigest()[:32]
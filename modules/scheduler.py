@@ -0,0 +1,162 @@
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from modules.job_store import job_store
+from modules import metrics
+
+# Central scheduler for media jobs (ffmpeg, scene detection, librosa).
+#
+# Jobs wait in a priority queue (FIFO within a priority) and at most
+# `max_workers` of them run at once in this process.  When the queue is full
+# new submissions are rejected so the blueprints can answer 429 instead of
+# piling more encodes onto already saturated cores.
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+
+
+class SchedulerFullError(Exception):
+    """Raised when the job backlog is full"""
+
+
+def default_concurrency():
+    """Concurrent jobs per worker process, based on core count"""
+    cores = os.cpu_count() or 1
+    workers = int(os.environ.get('WEB_CONCURRENCY', 1)) or 1
+    # libx264 is itself multi-threaded, so leave it room on each core pair
+    return max(1, cores // 2 // workers)
+
+
+class JobScheduler:
+    """Bounded priority queue feeding a fixed pool of worker threads"""
+
+    def __init__(self, max_workers=None, max_queue=None):
+        self.max_workers = max_workers or default_concurrency()
+        self.max_queue = max_queue or 20
+        self._queue = []
+        self._counter = itertools.count()
+        self._running = set()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def init_app(self, app):
+        """Read concurrency and backlog limits from the app config"""
+        self.max_workers = app.config.get('JOB_MAX_CONCURRENCY') or self.max_workers
+        self.max_queue = app.config.get('JOB_MAX_QUEUE') or self.max_queue
+
+    def _start_workers(self):
+        # Threads are started lazily so they are created after gunicorn forks
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def is_full(self):
+        """Check whether a new job would be rejected"""
+        with self._cond:
+            return len(self._queue) >= self.max_queue
+
+    def submit(self, job_id, func, *args, priority=PRIORITY_NORMAL):
+        """Queue func(job_id, *args) and return the job's queue position"""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise SchedulerFullError("Server is busy, please try again later")
+            heapq.heappush(
+                self._queue, (priority, next(self._counter), job_id, func, args, time.monotonic())
+            )
+            self._start_workers()
+            self._publish_positions()
+            self._cond.notify()
+            return self._position(job_id)
+
+    def cancel(self, job_id):
+        """Remove a job from the queue if it has not started yet"""
+        with self._cond:
+            for i, entry in enumerate(self._queue):
+                if entry[2] == job_id:
+                    self._queue.pop(i)
+                    heapq.heapify(self._queue)
+                    self._publish_positions()
+                    return True
+        return False
+
+    def queue_position(self, job_id):
+        """1-based queue position, 0 if running, or None if unknown"""
+        with self._cond:
+            if job_id in self._running:
+                return 0
+            return self._position(job_id)
+
+    def stats(self):
+        """Current queue depth and running job count"""
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "running": len(self._running),
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue
+            }
+
+    def thread_budget(self):
+        """Encoder threads for a job starting now.
+
+        The cores are shared among the jobs running at the moment, so a lone
+        job gets all of them; once jobs are waiting in the queue every slot
+        is about to be busy, and each job gets an even share per slot.
+        """
+        cores = os.cpu_count() or 1
+        with self._cond:
+            if self._queue:
+                return max(1, cores // self.max_workers)
+            return max(1, cores // max(1, len(self._running)))
+
+    def _position(self, job_id):
+        for i, entry in enumerate(sorted(self._queue)):
+            if entry[2] == job_id:
+                return i + 1
+        return None
+
+    def _publish_positions(self):
+        # Positions are written to the job store so any worker can report them
+        for i, entry in enumerate(sorted(self._queue)):
+            try:
+                job_store.update(
+                    entry[2],
+                    status="queued",
+                    queue_position=i + 1,
+                    current_step=f"Waiting in queue (position {i + 1})"
+                )
+            except Exception as e:
+                logging.warning(f"Could not publish queue position for job {entry[2]}: {str(e)}")
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, job_id, func, args, queued_at = heapq.heappop(self._queue)
+                self._running.add(job_id)
+                self._publish_positions()
+
+            try:
+                # Cancelled while queued, possibly through another worker
+                if job_store.cancel_requested(job_id):
+                    job_store.update(job_id, status="cancelled", queue_position=None, current_step="Job cancelled")
+                    continue
+                job_store.update(job_id, queue_position=0)
+                queue_wait = time.monotonic() - queued_at
+                metrics.observe("job_queue_wait_seconds", queue_wait, kind=job_store.kind(job_id) or "unknown")
+                job_store.add_timings(job_id, queue_wait=queue_wait)
+                func(job_id, *args)
+            except Exception as e:
+                logging.error(f"Unhandled error in scheduled job {job_id}: {str(e)}")
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+
+
+# Shared instance used by all blueprints
+scheduler = JobScheduler()
@@ -0,0 +1,128 @@
+import os
+import json
+from modules.media_index import preceding_keyframe, following_keyframe, seek_input_args
+from modules.media_runner import run_media
+from modules.encoding_profiles import rate_control_args, DEFAULT_PROFILE
+
+# Smart render: stream-copy whole GOPs, re-encode only the cut boundaries.
+#
+# A scene [start, end] is split at the first keyframe after `start` and the
+# last keyframe before `end`.  The GOPs in between are copied untouched; only
+# the partial GOPs at either edge are encoded, with the source's codec
+# parameters, so the concat demuxer can join everything without a re-encode,
+# and at the job's encoding profile quality, so the cuts don't stand out.
+# Profiles that rescale video can't be smart rendered.
+# Segments are written as MPEG-TS so each one carries its own in-band
+# SPS/PPS. The edit's audio comes from the music track, so segments are
+# video-only.
+
+# Segments shorter than this are dropped rather than encoded as empty files
+MIN_SEGMENT_DURATION = 0.001
+
+# ffprobe profile names mapped to libx264 -profile:v values
+X264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444"
+}
+
+
+def probe_video_stream(video_path):
+    """Return the codec parameters of the first video stream"""
+    ffprobe_cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,profile,level,pix_fmt,width,height,r_frame_rate",
+        "-of", "json",
+        video_path
+    ]
+    result = run_media(ffprobe_cmd)
+    streams = json.loads(result.stdout).get("streams", [])
+    return streams[0] if streams else {}
+
+
+def can_smart_render(stream_info):
+    """Smart render needs an H.264 source that libx264 can match"""
+    return stream_info.get("codec_name") == "h264" and stream_info.get("profile") in X264_PROFILES
+
+
+def plan_scene(keyframes, start_time, end_time):
+    """Split a scene into ("encode" | "copy", start, end) segments"""
+    first_key = following_keyframe(keyframes, start_time)
+    last_key = preceding_keyframe(keyframes, end_time)
+
+    # The scene doesn't span a whole GOP, so there is nothing to copy
+    if first_key is None or first_key >= last_key:
+        return [("encode", start_time, end_time)]
+
+    plan = []
+    if first_key - start_time > MIN_SEGMENT_DURATION:
+        plan.append(("encode", start_time, first_key))
+    plan.append(("copy", first_key, last_key))
+    if end_time - last_key > MIN_SEGMENT_DURATION:
+        plan.append(("encode", last_key, end_time))
+    return plan
+
+
+def encode_args(stream_info, threads=None, profile=DEFAULT_PROFILE):
+    """libx264 arguments at the profile's quality that match the source stream's parameters"""
+    args = [
+        "-c:v", "libx264",
+        *rate_control_args(profile),
+        "-profile:v", X264_PROFILES[stream_info["profile"]],
+        "-pix_fmt", stream_info.get("pix_fmt", "yuv420p")
+    ]
+    level = stream_info.get("level")
+    if level and level > 0:
+        args += ["-level:v", f"{level / 10:.1f}"]
+    if stream_info.get("r_frame_rate") and stream_info["r_frame_rate"] != "0/0":
+        args += ["-r", stream_info["r_frame_rate"]]
+    if threads:
+        args += ["-threads", str(threads)]
+    return args
+
+
+def render_scene(video_path, keyframes, stream_info, start_time, end_time, temp_dir, prefix, threads=None,
+                 job_id=None, on_progress=None, profile=DEFAULT_PROFILE):
+    """Render one scene as a list of concat-ready MPEG-TS segment paths.
+
+    on_progress(seconds, fps) reports how far into the scene rendering is.
+    """
+    segments = []
+    for i, (kind, seg_start, seg_end) in enumerate(plan_scene(keyframes, start_time, end_time)):
+        segment_path = os.path.join(temp_dir, f"{prefix}_{i}.ts")
+        if kind == "copy":
+            # seg_start is a keyframe, so an input seek lands on it exactly
+            cmd = [
+                "ffmpeg",
+                "-ss", f"{seg_start:.6f}",
+                "-i", video_path,
+                "-t", f"{seg_end - seg_start:.6f}",
+                "-map", "0:v:0",
+                "-c:v", "copy",
+                "-an",
+                "-f", "mpegts",
+                segment_path
+            ]
+        else:
+            cmd = [
+                "ffmpeg",
+                *seek_input_args(keyframes, video_path, seg_start, seg_end),
+                "-map", "0:v:0",
+                *encode_args(stream_info, threads, profile),
+                "-an",
+                "-f", "mpegts",
+                segment_path
+            ]
+        segment_progress = None
+        if on_progress is not None:
+            offset = seg_start - start_time
+            segment_progress = lambda seconds, fps, offset=offset: on_progress(offset + seconds, fps)
+        run_media(cmd, job_id=job_id, on_progress=segment_progress, cleanup=[segment_path])
+        segments.append(segment_path)
+    return segments
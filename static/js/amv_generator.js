@@ -12,7 +12,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const download1minButton = document.getElementById('download-1min-amv');
     
     let currentJobId = null;
-    let pollingInterval = null;
+    let jobEvents = null;
+    let disarmCancel = () => {};
     
     // Handle form submission
     amvForm.addEventListener('submit', function(e) {
@@ -31,30 +32,40 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
-        // Create a FormData object
-        const formData = new FormData();
-        formData.append('video', videoFile);
-        formData.append('music_url', youtubeUrl);
-        
         // Show loading state
         amvJobProgress.classList.remove('d-none');
         amvResultsEmpty.classList.add('d-none');
         amvResultsContent.classList.add('d-none');
         amvErrorMessage.classList.add('d-none');
-        amvCurrentStep.textContent = 'Starting AMV generation...';
+        amvCurrentStep.textContent = 'Uploading video...';
         amvProgressBar.style.width = '0%';
         
-        // Send the request
-        fetch('/amv_generator/generate', {
-            method: 'POST',
-            body: formData
+        // Upload the video in resumable chunks, then start generation on it
+        window.uploadFileChunked(videoFile, fraction => {
+            const percent = Math.round(fraction * 100);
+            amvCurrentStep.textContent = `Uploading video... ${percent}%`;
+            amvProgressBar.style.width = `${percent}%`;
+        })
+        .then(uploadId => {
+            const formData = new FormData();
+            formData.append('upload_id', uploadId);
+            formData.append('music_url', youtubeUrl);
+            formData.append('profile', document.getElementById('encoding-profile').value);
+            
+            amvCurrentStep.textContent = 'Starting AMV generation...';
+            amvProgressBar.style.width = '0%';
+            
+            return fetch('/amv_generator/generate', {
+                method: 'POST',
+                body: formData
+            });
         })
         .then(response => response.json())
         .then(data => {
             if (data.success) {
                 currentJobId = data.job_id;
-                // Start polling for status updates
-                startStatusPolling(currentJobId);
+                // Start streaming status updates
+                startStatusStream(currentJobId);
             } else {
                 showError(data.error);
             }
@@ -65,40 +76,33 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
-    // Function to start polling for status updates
-    function startStatusPolling(jobId) {
-        // Clear any existing polling
-        if (pollingInterval) {
-            clearInterval(pollingInterval);
+    // Function to start streaming status updates
+    function startStatusStream(jobId) {
+        // Close any existing stream
+        if (jobEvents) {
+            jobEvents.close();
         }
         
-        pollingInterval = setInterval(() => {
-            fetch(`/amv_generator/status/${jobId}`)
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        updateJobStatus(data.job);
-                    } else {
-                        showError(data.error);
-                        clearInterval(pollingInterval);
-                    }
-                })
-                .catch(error => {
-                    console.error('Error polling status:', error);
-                    showError('Failed to get status updates. Please refresh the page and try again.');
-                    clearInterval(pollingInterval);
-                });
-        }, 2000); // Poll every 2 seconds
+        disarmCancel();
+        disarmCancel = window.cancelJobOnLeave(`/amv_generator/cancel/${jobId}`);
+        jobEvents = window.watchJob(`/amv_generator/events/${jobId}`, updateJobStatus, message => {
+            showError(message);
+            jobEvents.close();
+        });
     }
     
     // Function to update job status display
     function updateJobStatus(job) {
-        amvCurrentStep.textContent = job.current_step || 'Processing...';
+        const fps = job.encode_fps ? ` (${job.encode_fps} fps)` : '';
+        amvCurrentStep.textContent = (job.current_step || 'Processing...') + fps;
         amvProgressBar.style.width = `${job.progress || 0}%`;
         
         // Check if job is complete or has error
+        if (['completed', 'error', 'cancelled'].includes(job.status)) {
+            disarmCancel();
+        }
         if (job.status === 'completed') {
-            clearInterval(pollingInterval);
+            jobEvents.close();
             amvJobProgress.classList.add('d-none');
             amvResultsContent.classList.remove('d-none');
             amvResultsEmpty.classList.add('d-none');
@@ -116,8 +120,11 @@ document.addEventListener('DOMContentLoaded', function() {
                 window.location.href = `/amv_generator/download/${job.id}/one_min`;
             };
         } else if (job.status === 'error') {
-            clearInterval(pollingInterval);
+            jobEvents.close();
             showError(job.error || 'An error occurred during AMV generation.');
+        } else if (job.status === 'cancelled') {
+            jobEvents.close();
+            showError('AMV generation was cancelled.');
         }
     }
     
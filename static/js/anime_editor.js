@@ -4,6 +4,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const animeVideoInput = document.getElementById('anime-video');
     const thresholdSelect = document.getElementById('threshold');
     const minSceneLengthSelect = document.getElementById('min-scene-length');
+    const previewProxyCheckbox = document.getElementById('preview-proxy');
     const sceneJobProgress = document.getElementById('scene-job-progress');
     const sceneCurrentStep = document.getElementById('scene-current-step');
     const sceneProgressBar = document.getElementById('scene-progress-bar');
@@ -21,6 +22,11 @@ document.addEventListener('DOMContentLoaded', function() {
     const editYoutubeUrlInput = document.getElementById('edit-youtube-url');
     const beatSyncCheckbox = document.getElementById('beat-sync');
     const fadeAudioCheckbox = document.getElementById('fade-audio');
+    const smartRenderCheckbox = document.getElementById('smart-render');
+    const encodingProfileSelect = document.getElementById('encoding-profile');
+    const draftPreviewSection = document.getElementById('draft-preview-section');
+    const draftPreviewVideo = document.getElementById('draft-preview');
+    const playDraftButton = document.getElementById('play-draft');
     const editJobProgress = document.getElementById('edit-job-progress');
     const editCurrentStep = document.getElementById('edit-current-step');
     const editProgressBar = document.getElementById('edit-progress-bar');
@@ -28,12 +34,15 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Phase 3: Results
     const downloadEditedVideoButton = document.getElementById('download-edited-video');
+    const promoteFinalButton = document.getElementById('promote-final');
     const startNewEditButton = document.getElementById('start-new-edit');
 
     let currentJobId = null;
-    let pollingInterval = null;
+    let disarmCancel = () => {};
+    let jobEvents = null;
     let selectedScenes = [];
     let orderedScenes = [];
+    let scenesById = {};
 
     // Handle scene detection form submission
     sceneDetectionForm.addEventListener('submit', function(e) {
@@ -54,27 +63,40 @@ document.addEventListener('DOMContentLoaded', function() {
         const threshold = thresholdSelect.value;
         const minSceneLength = minSceneLengthSelect.value;
 
-        const formData = new FormData();
-        formData.append('video', videoFile);
-        formData.append('threshold', threshold);
-        formData.append('min_scene_length', minSceneLength);
-
-        // Configure longer timeout for large files
-        const timeoutMs = 600000; // 10 minutes
-
         // Show loading state
         sceneJobProgress.classList.remove('d-none');
         sceneErrorMessage.classList.add('d-none');
-        sceneCurrentStep.textContent = 'Starting scene detection...';
+        sceneCurrentStep.textContent = 'Uploading video...';
         sceneProgressBar.style.width = '0%';
 
-        // Send the request
-        fetch('/anime_editor/detect_scenes', {
-            method: 'POST',
-            body: formData,
-            timeout: timeoutMs
+        // Upload the video in resumable chunks, then start detection on it
+        window.uploadFileChunked(videoFile, fraction => {
+            const percent = Math.round(fraction * 100);
+            sceneCurrentStep.textContent = `Uploading video... ${percent}%`;
+            sceneProgressBar.style.width = `${percent}%`;
+        })
+        .then(uploadId => {
+            const formData = new FormData();
+            formData.append('upload_id', uploadId);
+            formData.append('threshold', threshold);
+            formData.append('min_scene_length', minSceneLength);
+            if (previewProxyCheckbox.checked) {
+                formData.append('preview_proxy', '1');
+            }
+
+            sceneCurrentStep.textContent = 'Starting scene detection...';
+            sceneProgressBar.style.width = '0%';
+
+            return fetch('/anime_editor/detect_scenes', {
+                method: 'POST',
+                body: formData
+            });
         })
         .then(response => {
+            // 429 means the job queue is full; the body carries the reason
+            if (response.status === 429) {
+                return response.json();
+            }
             if (!response.ok) {
                 throw new Error(`Server responded with status: ${response.status}`);
             }
@@ -83,8 +105,8 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (data.success) {
                 currentJobId = data.job_id;
-                // Start polling for status updates
-                startSceneStatusPolling(currentJobId);
+                // Start streaming status updates
+                startSceneStatusStream(currentJobId);
             } else {
                 showSceneError(data.error || 'Unknown error occurred');
             }
@@ -95,30 +117,20 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
-    // Function to start polling for scene detection status
-    function startSceneStatusPolling(jobId) {
-        // Clear any existing polling
-        if (pollingInterval) {
-            clearInterval(pollingInterval);
+    // Function to start streaming scene detection status
+    function startSceneStatusStream(jobId) {
+        // Close any existing stream
+        if (jobEvents) {
+            jobEvents.close();
         }
 
-        pollingInterval = setInterval(() => {
-            fetch(`/anime_editor/status/${jobId}`)
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        updateSceneStatus(data.job);
-                    } else {
-                        showSceneError(data.error);
-                        clearInterval(pollingInterval);
-                    }
-                })
-                .catch(error => {
-                    console.error('Error polling status:', error);
-                    showSceneError('Failed to get status updates. Please refresh the page and try again.');
-                    clearInterval(pollingInterval);
-                });
-        }, 2000); // Poll every 2 seconds
+        disarmCancel();
+        disarmCancel = window.cancelJobOnLeave(`/anime_editor/cancel/${jobId}`);
+        const url = `/anime_editor/events/${jobId}?until=scenes_detected,error,cancelled`;
+        jobEvents = window.watchJob(url, updateSceneStatus, message => {
+            showSceneError(message);
+            jobEvents.close();
+        });
     }
 
     // Function to update scene detection status
@@ -127,8 +139,11 @@ document.addEventListener('DOMContentLoaded', function() {
         sceneProgressBar.style.width = `${job.progress || 0}%`;
 
         // Check if job is complete or has error
+        if (['scenes_detected', 'error', 'cancelled'].includes(job.status)) {
+            disarmCancel();
+        }
         if (job.status === 'scenes_detected') {
-            clearInterval(pollingInterval);
+            jobEvents.close();
 
             // Move to phase 2 (scene selection)
             setTimeout(() => {
@@ -136,19 +151,46 @@ document.addEventListener('DOMContentLoaded', function() {
                 phase2.classList.remove('d-none');
 
                 // Populate scenes
-                populateScenes(job.results.scenes);
+                const hasPreview = job.results.preview_proxy;
+                loadScenes(currentJobId)
+                    .then(scenes => populateScenes(scenes, hasPreview))
+                    .catch(error => {
+                        console.error('Error:', error);
+                        showSceneError(error.message || 'Could not load the detected scenes.');
+                    });
             }, 1000);
         } else if (job.status === 'error') {
-            clearInterval(pollingInterval);
+            jobEvents.close();
             showSceneError(job.error || 'An error occurred during scene detection.');
+        } else if (job.status === 'cancelled') {
+            jobEvents.close();
+            showSceneError('Scene detection was cancelled.');
+        }
+    }
+
+    // The scene list is not part of the job status; fetch it page by page
+    async function loadScenes(jobId) {
+        const scenes = [];
+        let offset = 0;
+        while (offset !== null) {
+            const response = await fetch(`/anime_editor/scenes/${jobId}?offset=${offset}&limit=1000`);
+            const data = await response.json();
+            if (!data.success) {
+                throw new Error(data.error || 'Could not load the detected scenes.');
+            }
+            scenes.push(...data.scenes);
+            offset = data.next_offset;
         }
+        return scenes;
     }
 
     // Function to populate detected scenes
-    function populateScenes(scenes) {
+    function populateScenes(scenes, hasPreview) {
         scenesContainer.innerHTML = '';
         selectedScenes = [];
         orderedScenes = [];
+        scenesById = {};
+        draftPreviewSection.classList.toggle('d-none', !hasPreview);
 
         if (!scenes || scenes.length === 0) {
             scenesContainer.innerHTML = '<div class="col-12"><div class="alert alert-warning">No scenes detected. Please try with a different video or adjust detection settings.</div></div>';
@@ -191,6 +233,11 @@ document.addEventListener('DOMContentLoaded', function() {
             `;
 
             scenesContainer.appendChild(sceneCard);
+            scenesById[scene.id] = scene;
+
+            if (hasPreview) {
+                attachHoverPreview(sceneCard.querySelector('.scene-thumbnail'), scene);
+            }
         });
 
         // Add event listeners to scene checkboxes
@@ -373,33 +420,52 @@ document.addEventListener('DOMContentLoaded', function() {
         // Get the audio options
         const enableBeatSync = beatSyncCheckbox ? beatSyncCheckbox.checked : true;
         const enableFadeAudio = fadeAudioCheckbox ? fadeAudioCheckbox.checked : false;
+        const enableSmartRender = smartRenderCheckbox ? smartRenderCheckbox.checked : false;
+        const profile = encodingProfileSelect ? encodingProfileSelect.value : 'final';
+
+        startEditing({
+            job_id: currentJobId,
+            selected_scenes: selectedScenes,
+            ordered_scenes: orderedScenes,
+            music_url: youtubeUrl,
+            beat_sync: enableBeatSync,
+            fade_audio: enableFadeAudio,
+            smart_render: enableSmartRender,
+            profile: profile
+        });
+    });
+
+    // Re-render the timeline of the last (draft) render at final quality
+    promoteFinalButton.addEventListener('click', function() {
+        phase3.classList.add('d-none');
+        phase2.classList.remove('d-none');
+        startEditing({
+            job_id: currentJobId,
+            smart_render: smartRenderCheckbox ? smartRenderCheckbox.checked : false,
+            profile: 'final'
+        });
+    });
 
+    // Send the request to create the edited video and follow its progress
+    function startEditing(payload) {
         // Show editing progress
         editJobProgress.classList.remove('d-none');
         editErrorMessage.classList.add('d-none');
         editCurrentStep.textContent = 'Starting video editing...';
         editProgressBar.style.width = '0%';
 
-        // Send the request to create edited video
         fetch('/anime_editor/edit_video', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({
-                job_id: currentJobId,
-                selected_scenes: selectedScenes,
-                ordered_scenes: orderedScenes,
-                music_url: youtubeUrl,
-                beat_sync: enableBeatSync,
-                fade_audio: enableFadeAudio
-            })
+            body: JSON.stringify(payload)
         })
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                // Start polling for editing status
-                startEditStatusPolling(data.job_id);
+                // Start streaming editing status
+                startEditStatusStream(data.job_id);
             } else {
                 showEditError(data.error);
             }
@@ -408,59 +474,116 @@ document.addEventListener('DOMContentLoaded', function() {
             console.error('Error:', error);
             showEditError('An error occurred while starting video editing. Please try again.');
         });
-    });
+    }
 
-    // Function to start polling for editing status
-    function startEditStatusPolling(jobId) {
-        // Clear any existing polling
-        if (pollingInterval) {
-            clearInterval(pollingInterval);
+    // Function to start streaming editing status
+    function startEditStatusStream(jobId) {
+        // Close any existing stream
+        if (jobEvents) {
+            jobEvents.close();
         }
 
-        pollingInterval = setInterval(() => {
-            fetch(`/anime_editor/status/${jobId}`)
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        updateEditStatus(data.job);
-                    } else {
-                        showEditError(data.error);
-                        clearInterval(pollingInterval);
-                    }
-                })
-                .catch(error => {
-                    console.error('Error polling edit status:', error);
-                    showEditError('Failed to get status updates. Please refresh the page and try again.');
-                    clearInterval(pollingInterval);
-                });
-        }, 2000); // Poll every 2 seconds
+        disarmCancel();
+        disarmCancel = window.cancelJobOnLeave(`/anime_editor/cancel/${jobId}`);
+        const url = `/anime_editor/events/${jobId}?until=completed,error,cancelled`;
+        jobEvents = window.watchJob(url, updateEditStatus, message => {
+            showEditError(message);
+            jobEvents.close();
+        });
     }
 
     // Function to update editing status
     function updateEditStatus(job) {
-        editCurrentStep.textContent = job.current_step || 'Processing...';
+        const fps = job.encode_fps ? ` (${job.encode_fps} fps)` : '';
+        editCurrentStep.textContent = (job.current_step || 'Processing...') + fps;
         editProgressBar.style.width = `${job.progress || 0}%`;
 
         // Check if job is complete or has error
+        if (['completed', 'error', 'cancelled'].includes(job.status)) {
+            disarmCancel();
+        }
         if (job.status === 'completed') {
-            clearInterval(pollingInterval);
+            jobEvents.close();
 
             // Move to phase 3 (results)
             setTimeout(() => {
                 phase2.classList.add('d-none');
                 phase3.classList.remove('d-none');
 
-                // Set up download button
+                // Set up download button; each render has its own file, so
+                // its name keeps cached downloads of earlier renders apart
+                const editedVideo = encodeURIComponent(job.results.edited_video);
                 downloadEditedVideoButton.onclick = () => {
-                    window.location.href = `/anime_editor/download/${currentJobId}`;
+                    window.location.href = `/anime_editor/download/${currentJobId}/${editedVideo}`;
                 };
+                promoteFinalButton.classList.toggle('d-none', job.encoding_profile !== 'draft');
             }, 1000);
         } else if (job.status === 'error') {
-            clearInterval(pollingInterval);
+            jobEvents.close();
             showEditError(job.error || 'An error occurred during video editing.');
+        } else if (job.status === 'cancelled') {
+            jobEvents.close();
+            showEditError('Video editing was cancelled.');
         }
     }
 
+    // Play a scene from the preview proxy in place of its thumbnail while
+    // the pointer is over it; the media fragment limits playback to the scene
+    function attachHoverPreview(thumbnail, scene) {
+        let video = null;
+
+        thumbnail.addEventListener('mouseenter', function() {
+            video = document.createElement('video');
+            video.className = thumbnail.className;
+            video.muted = true;
+            video.playsInline = true;
+            video.src = `/anime_editor/preview/${currentJobId}#t=${scene.start_time.toFixed(3)},${scene.end_time.toFixed(3)}`;
+            video.addEventListener('mouseleave', function() {
+                video.pause();
+                video.removeAttribute('src');
+                video.load();
+                video.replaceWith(thumbnail);
+                video = null;
+            });
+            thumbnail.replaceWith(video);
+            video.play().catch(() => {});
+        });
+    }
+
+    // Play the selected scenes back to back from the preview proxy, as a
+    // draft of the edit before anything is rendered
+    playDraftButton.addEventListener('click', function() {
+        const timeline = orderedScenes.map(id => scenesById[id]).filter(Boolean);
+        if (timeline.length === 0) {
+            alert('Please select at least one scene.');
+            return;
+        }
+
+        let index = 0;
+        draftPreviewVideo.classList.remove('d-none');
+        if (!draftPreviewVideo.src) {
+            draftPreviewVideo.src = `/anime_editor/preview/${currentJobId}`;
+        }
+
+        const playScene = () => {
+            draftPreviewVideo.currentTime = timeline[index].start_time;
+            draftPreviewVideo.play().catch(() => {});
+        };
+        draftPreviewVideo.ontimeupdate = function() {
+            if (draftPreviewVideo.currentTime < timeline[index].end_time) {
+                return;
+            }
+            index += 1;
+            if (index < timeline.length) {
+                playScene();
+            } else {
+                draftPreviewVideo.pause();
+                draftPreviewVideo.ontimeupdate = null;
+            }
+        };
+        playScene();
+    });
+
     // Handle start new edit button click
     startNewEditButton.addEventListener('click', function() {
         // Reset everything and go back to phase 1
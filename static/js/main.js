@@ -47,6 +47,114 @@ document.addEventListener('DOMContentLoaded', function() {
         element.classList.add('d-none');
     };
 
+    // Follow a job over Server-Sent Events. The server sends the whole job
+    // first and then only the fields that changed; they are merged here so
+    // onUpdate always receives the full job. Returns the EventSource so the
+    // caller can close it once the job is done.
+    window.watchJob = function(url, onUpdate, onError) {
+        const job = {};
+        let failed = false;
+        const source = new EventSource(url);
+
+        source.onmessage = function(event) {
+            const data = JSON.parse(event.data);
+            if (!data.success) {
+                failed = true;
+                source.close();
+                onError(data.error);
+                return;
+            }
+            Object.assign(job, data.job);
+            onUpdate(job);
+        };
+
+        // EventSource reconnects by itself; only report a connection that
+        // was given up on
+        source.onerror = function() {
+            if (source.readyState === EventSource.CLOSED && !failed) {
+                onError('Failed to get status updates. Please refresh the page and try again.');
+            }
+        };
+
+        return source;
+    };
+
+    // Cancel a running job if the user leaves the page, so its encodes don't
+    // keep running for nobody. Returns a function that disarms the handler
+    // once the job has finished.
+    window.cancelJobOnLeave = function(url) {
+        const onLeave = () => navigator.sendBeacon(url);
+        window.addEventListener('pagehide', onLeave);
+        return () => window.removeEventListener('pagehide', onLeave);
+    };
+
+    // Resumable chunked upload: returns a promise for the upload ID.
+    // The upload ID is remembered per file, so a retry (or a page reload)
+    // only sends the byte ranges the server is still missing.
+    window.uploadFileChunked = async function(file, onProgress) {
+        const fingerprint = `upload:${file.name}:${file.size}:${file.lastModified}`;
+        let status = null;
+
+        const savedId = localStorage.getItem(fingerprint);
+        if (savedId) {
+            const response = await fetch(`/upload/${savedId}`);
+            if (response.ok) {
+                status = await response.json();
+            }
+        }
+
+        if (!status || !status.success) {
+            const response = await fetch('/upload', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size })
+            });
+            status = await response.json();
+            if (!status.success) {
+                throw new Error(status.error || 'Could not start upload');
+            }
+            localStorage.setItem(fingerprint, status.upload_id);
+        }
+
+        const uploadId = status.upload_id;
+        const chunkSize = status.chunk_size;
+        let received = status.received;
+
+        for (const [rangeStart, rangeEnd] of status.missing_ranges) {
+            for (let offset = rangeStart; offset < rangeEnd; offset += chunkSize) {
+                const end = Math.min(offset + chunkSize, rangeEnd);
+                let attempt = 0;
+                while (true) {
+                    try {
+                        const response = await fetch(`/upload/${uploadId}?offset=${offset}`, {
+                            method: 'PUT',
+                            headers: { 'Content-Type': 'application/octet-stream' },
+                            body: file.slice(offset, end)
+                        });
+                        const data = await response.json();
+                        if (!data.success) {
+                            throw new Error(data.error || 'Chunk upload failed');
+                        }
+                        received = data.received;
+                        break;
+                    } catch (error) {
+                        attempt += 1;
+                        if (attempt >= 5) {
+                            throw error;
+                        }
+                        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+                    }
+                }
+                if (onProgress) {
+                    onProgress(received / file.size);
+                }
+            }
+        }
+
+        localStorage.removeItem(fingerprint);
+        return uploadId;
+    };
+
     window.generateUUID = function() {
         return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
             const r = Math.random() * 16 | 0;